@@ -1,15 +1,39 @@
-from flask import Flask, render_template
+from flask import Flask, Response, jsonify, render_template, request
 from flask_restful import Api
 
+import atexit
 import os
 
+import archive
 import config
-from t3s import T3S
+import responses
+import server
+from batching import batcher
+from cache import caches
+from metrics import metrics
+from registry import registry
+from scheduling import HIGH, scheduler
+from tracing import tracer
+from startup import discover_models, startup
+from t3s import T3S, T3SBulk, T3SFanout, close_fanout
+from versions import versions
 
 app = Flask(__name__)
 api = Api(app)
 
 
+@app.after_request
+def compress(response):
+    # Streamed responses are sent as they are produced
+    if response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    body = responses.compress(response.get_data(), request.headers.get('Accept-Encoding'))
+    if body is not None:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/favicon.ico')
 def favicon():
     return ''
@@ -45,7 +69,100 @@ def modelpage(model=None):
         SITE_TITLE=app.config['SITE_TITLE'],
         model=model)
 
-api.add_resource(T3S, '/<model>/<string:data_input>')
+# The addresses of the server itself are under /_t3s/, see versions.ADMIN_PREFIX,
+# so that they never shadow the addresses of a model
+@app.route('/_t3s/health')
+def health():
+    return jsonify({'status': 'ok'})
+
+@app.route('/_t3s/ready')
+def ready():
+    status = startup.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/_t3s/batching')
+def batching():
+    return jsonify(batcher.stats())
+
+@app.route('/_t3s/cache')
+def cache():
+    return jsonify(caches.stats())
+
+@app.route('/_t3s/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/_t3s/versions')
+def served_versions():
+    return jsonify(versions.status())
+
+@app.route('/_t3s/residency')
+def residency():
+    return jsonify(registry.residency())
+
+@app.route('/_t3s/scheduling')
+def scheduling_stats():
+    return jsonify(scheduler.stats())
+
+@app.route('/_t3s/tracing')
+def tracing():
+    return jsonify(tracer.status())
+
+@app.route('/_t3s/tracing/<model>')
+def hotspots(model):
+    table = tracer.hotspots(model)
+    table['timelines'] = tracer.timelines(model)
+    return jsonify(table)
+
+@app.route('/_t3s/tracing/<model>/timeline')
+def chrome_trace(model):
+    try:
+        trace = tracer.chrome_trace(model, request.args.get('run', 0, type=int))
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 404
+    return Response(trace, mimetype='application/json', headers={
+        'Content-Disposition': 'attachment; filename=%s-timeline.json' % model})
+
+api.add_resource(T3S, '/<model>/<string:data_input>',
+                 '/<model>/versions/<int:version>/<string:data_input>')
+api.add_resource(T3SBulk, '/<model>/predict', '/<model>/versions/<int:version>/predict')
+api.add_resource(T3SFanout, '/fanout')
+# Same routes in the high priority scheduling lane
+api.add_resource(T3S, '/_t3s/priority/<model>/<string:data_input>',
+                 '/_t3s/priority/<model>/versions/<int:version>/<string:data_input>',
+                 endpoint='t3s_priority', defaults={'lane': HIGH})
+api.add_resource(T3SBulk, '/_t3s/priority/<model>/predict', '/_t3s/priority/<model>/versions/<int:version>/predict',
+                 endpoint='t3sbulk_priority', defaults={'lane': HIGH})
+
+
+def start_serving():
+    """Starts the background services of a serving process."""
+    # Release the batching queues, models sessions and output archive on shutdown
+    atexit.register(archive.close)
+    atexit.register(registry.close)
+    atexit.register(batcher.close)
+    atexit.register(close_fanout)
+    atexit.register(versions.close)
+
+    # Keep the loaded models under the memory budget, except the pinned ones
+    registry.set_budget(config.TF_MODELS['memory_budget'], [
+        config.TF_MODELS['dir'] + model for model in discover_models()
+        if config.get_model_option(model, 'pinned')
+    ])
+
+    # Load the models with the 'optimized_graph' option from their cached artifact
+    registry.set_artifacts(config.TF_MODELS['artifacts_dir'], [
+        config.TF_MODELS['dir'] + model for model in discover_models()
+        if config.get_model_option(model, 'optimized_graph')
+    ])
+
+    # Load and warm up the models in the background
+    if config.TF_MODELS['preload']:
+        startup.start()
+
+    # Swap in the new versions of the models as they are exported
+    if config.TF_MODELS['watch_interval']:
+        versions.start(config.TF_MODELS['watch_interval'])
 
 
 if __name__ == '__main__':
@@ -53,4 +170,15 @@ if __name__ == '__main__':
     config.configure_app(app)
 
     # Start server
-    app.run(host='0.0.0.0')
+    if config.SERVING['workers'] > 1:
+        port = app.config['SERVER_NAME'].partition(':')[2]
+        server.serve(app, '0.0.0.0', int(port or 5000), config.SERVING['workers'],
+                     config.SERVING['cpu_affinity'], on_start=start_serving,
+                     shutdown_timeout=config.SERVING['shutdown_timeout'],
+                     shutdown_grace=config.SERVING['shutdown_grace'],
+                     # Only the archived outputs are flushed by a worker stopped with
+                     # requests still being processed
+                     on_abort=archive.close)
+    else:
+        start_serving()
+        app.run(host='0.0.0.0')
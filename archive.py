@@ -0,0 +1,339 @@
+"""
+T3S asynchronous output archive.
+
+Saving the outputs of a model on the request path means waiting for the disk.
+When the archive is enabled for a model, the outputs of each run are put on a
+bounded in-memory queue instead and a background writer appends them to an
+archive file. There is one archive file per model, per time window, rotated
+every 'rotation_interval' seconds, and per process, so that the worker
+processes of the production server never interleave their records.
+
+When the writer falls behind and the queue is full, new outputs are either
+dropped ('drop' overflow) or the requests wait for room in the queue ('block'
+overflow, which applies backpressure on the clients). The outputs which cannot
+be written, e.g. when the disk is full, are logged and counted as dropped too,
+and the writer goes on with the next ones.
+
+Archive files are a sequence of records, each holding the outputs of one run:
+    - the b'T3SA' magic bytes and the header length as a little-endian uint32,
+    - a JSON header with the run time and, for each output, its key, dtype,
+    shape and data offset from the start of the record data,
+    - the raw output arrays data, each aligned on ALIGNMENT bytes.
+The arrays can therefore be read back without copy through a memory map, see
+read_archive().
+"""
+
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+import config
+
+
+MAGIC = b'T3SA'
+ALIGNMENT = 64
+
+_HEADER_LENGTH = struct.Struct('<I')
+
+_logger = logging.getLogger(__name__)
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+def encode_record(outputs, timestamp):
+    """
+    Encodes the outputs of a run as an archive record.
+
+    Args:
+        outputs: A dictionary that maps output keys to numpy ndarrays.
+        timestamp: Time of the run, in seconds since the epoch.
+
+    Returns:
+        The list of byte-like chunks making the record.
+    """
+    arrays = []
+    descriptions = []
+    offset = 0
+    for key in sorted(outputs):
+        array = np.asarray(outputs[key])
+        # Strings outputs are objects arrays, which cannot be memory mapped
+        if array.dtype == object:
+            array = array.astype(bytes)
+        array = np.ascontiguousarray(array)
+        arrays.append(array)
+        descriptions.append({
+            'key': key,
+            'dtype': array.dtype.str,
+            'shape': array.shape,
+            'offset': offset,
+        })
+        offset += array.nbytes + _padding(array.nbytes)
+
+    header = json.dumps({'time': timestamp, 'outputs': descriptions}).encode('utf-8')
+    prefix_length = len(MAGIC) + _HEADER_LENGTH.size + len(header)
+    chunks = [MAGIC, _HEADER_LENGTH.pack(len(header)), header, b'\0' * _padding(prefix_length)]
+    for array in arrays:
+        chunks.append(array.data)
+        chunks.append(b'\0' * _padding(array.nbytes))
+    return chunks
+
+
+def read_archive(path):
+    """
+    Reads the records of an archive file through a memory map.
+
+    Records must start on an ALIGNMENT boundary, which holds for the files
+    written by the OutputArchive.
+
+    Args:
+        path: Path of the archive file.
+
+    Yields:
+        A tuple with the time of each run and a dictionary that maps its output
+        keys to read-only numpy arrays backed by the file.
+    """
+    if os.path.getsize(path) == 0:
+        return
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    position = 0
+    while position < len(data):
+        if bytes(data[position:position + len(MAGIC)]) != MAGIC:
+            raise ValueError('Corrupted archive record at offset %d of %s.' % (position, path))
+        position += len(MAGIC)
+        header_length, = _HEADER_LENGTH.unpack(bytes(data[position:position + _HEADER_LENGTH.size]))
+        position += _HEADER_LENGTH.size
+        header = json.loads(bytes(data[position:position + header_length]).decode('utf-8'))
+        position += header_length
+        position += _padding(position)
+
+        outputs = {}
+        data_size = 0
+        for description in header['outputs']:
+            dtype = np.dtype(description['dtype'])
+            shape = tuple(description['shape'])
+            nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+            start = position + description['offset']
+            outputs[description['key']] = data[start:start + nbytes].view(dtype).reshape(shape)
+            data_size = description['offset'] + nbytes + _padding(nbytes)
+        position += data_size
+
+        yield header['time'], outputs
+
+
+class OutputArchive(object):
+    """Bounded queue of models outputs, appended to archive files by a writer thread."""
+
+    def __init__(self, directory, max_queue_size, rotation_interval, overflow):
+        """
+        Args:
+            directory: Directory containing the archives, in one subfolder per
+                model.
+            max_queue_size: Maximum number of runs waiting to be written.
+            rotation_interval: Duration in seconds of the time window covered by
+                each archive file.
+            overflow: What to do with new outputs when the queue is full, either
+                'drop' them or 'block' until the writer catches up.
+
+        Raises:
+            ValueError: When the overflow mode is unknown.
+        """
+        if overflow not in ('drop', 'block'):
+            raise ValueError('Unknown archive overflow mode "%s", please choose '
+                             'from "drop" or "block".' % overflow)
+        self.directory = directory
+        self.rotation_interval = rotation_interval
+        self.overflow = overflow
+
+        self._queue = queue.Queue(max_queue_size)
+        self._files = {}
+        self._written = 0
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+        self._writer = threading.Thread(target=self._write, name='t3s-archive')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def put(self, model, outputs):
+        """
+        Queues the outputs of a run to be archived.
+
+        Args:
+            model: Name of the model.
+            outputs: A dictionary that maps output keys to numpy ndarrays.
+
+        Returns:
+            True if the outputs were queued, False if they were dropped.
+        """
+        record = (model, outputs, time.time())
+        if self.overflow == 'block':
+            self._queue.put(record)
+            return True
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return False
+
+    def _file(self, model, timestamp):
+        window = int(timestamp // self.rotation_interval * self.rotation_interval)
+        current = self._files.get(model)
+        if current is not None and current[0] == window:
+            return current[1]
+        if current is not None:
+            current[1].close()
+
+        model_dir = os.path.join(self.directory, model)
+        os.makedirs(model_dir, exist_ok=True)
+        archive_file = open(os.path.join(model_dir, '%d-%d.t3sa' % (window, os.getpid())), 'ab')
+        # The window, file, and length of the file known to hold whole records
+        self._files[model] = [window, archive_file, archive_file.tell()]
+        return archive_file
+
+    def _write(self):
+        stopped = False
+        while not stopped:
+            # Write all the queued records before flushing
+            records = [self._queue.get()]
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            dirty = set()
+            for record in records:
+                if record is None:
+                    stopped = True
+                    continue
+                model, outputs, timestamp = record
+                start = None
+                try:
+                    archive_file = self._file(model, timestamp)
+                    start = archive_file.tell()
+                    archive_file.writelines(encode_record(outputs, timestamp))
+                except Exception:
+                    _logger.exception('Could not archive the outputs of model "%s".', model)
+                    self._forget(model, start)
+                    with self._lock:
+                        self._dropped += 1
+                    continue
+                dirty.add((model, archive_file))
+                with self._lock:
+                    self._written += 1
+            for model, archive_file in dirty:
+                if archive_file.closed:
+                    continue
+                end = archive_file.tell()
+                try:
+                    archive_file.flush()
+                except Exception:
+                    _logger.exception('Could not flush the archive of model "%s".', model)
+                    self._forget(model, end)
+                    continue
+                current = self._files.get(model)
+                if current is not None and current[1] is archive_file:
+                    current[2] = end
+
+        for model in list(self._files):
+            self._forget(model)
+
+    def _forget(self, model, length=None):
+        """
+        Closes the file of a model, e.g. after a write error so that it is opened
+        again for the next outputs.
+
+        Args:
+            model: Name of the model.
+            length: Length the file should have after a write error, cut back to
+                it so that the file never ends with a partial record, or None.
+                When the file ends up shorter, e.g. since the records written
+                before could not be flushed either, it is cut back to the last
+                length it was flushed at.
+        """
+        current = self._files.pop(model, None)
+        if current is None:
+            return
+        _, archive_file, flushed = current
+        try:
+            archive_file.close()
+        except Exception:
+            pass
+        if length is None:
+            return
+        try:
+            size = os.path.getsize(archive_file.name)
+            if size < length:
+                length = flushed
+            if size > length:
+                os.truncate(archive_file.name, length)
+        except OSError:
+            _logger.exception('Could not cut the partial record of the archive of model "%s".', model)
+
+    def stats(self):
+        """Returns the number of queued, written and dropped runs."""
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'written': self._written,
+                'dropped': self._dropped,
+            }
+
+    def close(self, timeout=None):
+        """
+        Writes the queued outputs, then stops the writer and closes the files.
+
+        Args:
+            timeout: Maximum time in seconds to wait for the writer, or None for
+                no limit.
+
+        Returns:
+            True if the writer stopped, False if it is still writing.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return False
+        self._writer.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        return not self._writer.is_alive()
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """Gets the output archive shared by the whole server, starting it on first use."""
+    global _archive
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = OutputArchive(
+                    config.OUTPUT_ARCHIVE['dir'],
+                    config.OUTPUT_ARCHIVE['max_queue_size'],
+                    config.OUTPUT_ARCHIVE['rotation_interval'],
+                    config.OUTPUT_ARCHIVE['overflow'])
+    return _archive
+
+
+def close(timeout=None):
+    """
+    Closes the shared output archive if it was started.
+
+    Args:
+        timeout: Maximum time in seconds to wait for the queued outputs to be
+            written, or None for no limit.
+    """
+    if _archive is not None and not _archive.close(timeout):
+        _logger.warning('Stopped the output archive with outputs still being written.')
@@ -0,0 +1,211 @@
+"""
+T3S optimized graph artifacts.
+
+Loading a SavedModel parses its whole graph, saving and training ops included,
+then restores its variables from their checkpoint, which makes the cold starts
+of a server with many models slow. The models with the 'optimized_graph' option
+are rather loaded from an optimized artifact of their 'predict' signature,
+cached on local disk in TF_MODELS['artifacts_dir']:
+    - the variables are frozen into constants, so there is nothing to restore,
+    - the graph is stripped down to the ops computing the signature outputs,
+    - the constant subgraphs are folded, and the identity ops removed.
+
+The first load of a model version builds its artifact from the SavedModel, and
+the following ones, in this process or the next ones, import it directly. Each
+artifact records the fingerprint of the SavedModel directory it was built from,
+see registry.directory_fingerprint(), and is rebuilt when the model is exported
+again to the directory.
+
+The worker processes of the production server all load the same models: the
+first one to miss an artifact builds it under a lock file, and the other ones
+wait for it, then import it. An artifact which cannot be parsed is deleted and
+built again.
+
+The artifact only holds the 'predict' signature, and cannot be built for the
+models initializing tables or other resources in a main op.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+
+_logger = logging.getLogger(__name__)
+
+PREDICT = 'predict'
+
+# Graph Transform Tool transforms applied to the frozen graph
+TRANSFORMS = [
+    'remove_nodes(op=Identity, op=CheckNumerics, op=StopGradient)',
+    'fold_constants(ignore_errors=true)',
+    'fold_batch_norms',
+    'fold_old_batch_norms',
+    'remove_attribute(attribute_name=_class)',
+]
+
+
+def artifact_path(artifacts_dir, saved_model_dir, tag_set):
+    """
+    Gets the path of the artifact of a SavedModel, without extension.
+
+    Args:
+        artifacts_dir: Directory of the artifacts.
+        saved_model_dir: Directory containing the SavedModel.
+        tag_set: Group of tag(s) of the MetaGraphDef, separated by ','.
+
+    Returns:
+        The path, named after the SavedModel directory.
+    """
+    saved_model_dir = os.path.abspath(saved_model_dir)
+    digest = hashlib.sha1(('%s\0%s' % (saved_model_dir, tag_set)).encode('utf-8')).hexdigest()
+    return os.path.join(artifacts_dir, '%s-%s' % (os.path.basename(saved_model_dir), digest[:16]))
+
+
+def _node_name(tensor_name):
+    return tensor_name.split(':', 1)[0].lstrip('^')
+
+
+def build(saved_model_dir, tag_set, signature_def_key=PREDICT):
+    """
+    Builds the optimized graph of a SavedModel signature.
+
+    Args:
+        saved_model_dir: Directory containing the SavedModel.
+        tag_set: Group of tag(s) of the MetaGraphDef, separated by ','.
+        signature_def_key: Key of the signature kept in the graph.
+
+    Returns:
+        A MetaGraphDef with the optimized GraphDef and the SignatureDef.
+
+    Raises:
+        ValueError: When the signature does not exist, or the model has a main
+            op, which the frozen graph could not run.
+    """
+    from tensorflow.core.protobuf import meta_graph_pb2
+    from tensorflow.python.client import session
+    from tensorflow.python.framework import graph_util
+    from tensorflow.python.framework import ops as ops_lib
+    from tensorflow.python.saved_model import constants, loader
+    from tensorflow.tools.graph_transforms import TransformGraph
+
+    graph = ops_lib.Graph()
+    with session.Session(graph=graph) as sess:
+        source = loader.load(sess, tag_set.split(','), saved_model_dir)
+        if signature_def_key not in source.signature_def:
+            raise ValueError('Could not find signature "%s" in %s.' % (signature_def_key, saved_model_dir))
+        for key in (constants.MAIN_OP_KEY, constants.LEGACY_INIT_OP_KEY):
+            if source.collection_def[key].node_list.value:
+                raise ValueError('The graph of %s cannot be optimized, because it has a main op.' %
+                                 saved_model_dir)
+
+        signature_def = source.signature_def[signature_def_key]
+        inputs = sorted(_node_name(info.name) for info in signature_def.inputs.values())
+        outputs = sorted(_node_name(info.name) for info in signature_def.outputs.values())
+        # Only keeps the ops the outputs depend on
+        frozen = graph_util.convert_variables_to_constants(sess, graph.as_graph_def(), outputs)
+
+    meta_graph_def = meta_graph_pb2.MetaGraphDef()
+    meta_graph_def.meta_info_def.tags.extend(source.meta_info_def.tags)
+    meta_graph_def.graph_def.CopyFrom(TransformGraph(frozen, inputs, outputs, TRANSFORMS))
+    meta_graph_def.signature_def[signature_def_key].CopyFrom(signature_def)
+    return meta_graph_def
+
+
+def _read(path, fingerprint):
+    """Reads an artifact, or returns None if it is missing, corrupted or was built from another fingerprint."""
+    from google.protobuf.message import DecodeError
+    from tensorflow.core.protobuf import meta_graph_pb2
+
+    try:
+        with open(path + '.json') as info_file:
+            info = json.load(info_file)
+        if info.get('fingerprint') != json.loads(json.dumps(fingerprint)):
+            return None
+        with open(path + '.pb', 'rb') as graph_file:
+            return meta_graph_pb2.MetaGraphDef.FromString(graph_file.read())
+    except (OSError, ValueError):
+        return None
+    except DecodeError:
+        _logger.warning('Deleting the corrupted artifact %s.', path)
+        _delete(path)
+        return None
+
+
+def _delete(path):
+    # The fingerprint first, so that a reader never pairs it with a missing graph
+    for extension in ('.json', '.pb'):
+        try:
+            os.remove(path + extension)
+        except FileNotFoundError:
+            pass
+
+
+@contextlib.contextmanager
+def _build_lock(path):
+    """Holds the lock file of an artifact, so that a single process builds it at a time."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_atomic(path, data):
+    temporary_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary_path, 'wb') as output_file:
+        output_file.write(data)
+    os.replace(temporary_path, path)
+
+
+def _write(path, meta_graph_def, saved_model_dir, fingerprint):
+    """Saves an artifact, the graph before its fingerprint so readers never pair an old graph with a new fingerprint."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write_atomic(path + '.pb', meta_graph_def.SerializeToString())
+    _write_atomic(path + '.json', json.dumps({
+        'saved_model_dir': os.path.abspath(saved_model_dir),
+        'fingerprint': fingerprint,
+        'built_at': time.time(),
+    }).encode('utf-8'))
+
+
+def load(sess, saved_model_dir, tag_set, fingerprint, artifacts_dir):
+    """
+    Loads the optimized graph of a SavedModel in a session, building its artifact
+    first when it is missing or outdated.
+
+    Args:
+        sess: The session to load the graph in, with an empty graph.
+        saved_model_dir: Directory containing the SavedModel.
+        tag_set: Group of tag(s) of the MetaGraphDef, separated by ','.
+        fingerprint: Fingerprint of the SavedModel directory.
+        artifacts_dir: Directory of the artifacts.
+
+    Returns:
+        The MetaGraphDef of the artifact, with the 'predict' SignatureDef only.
+
+    Raises:
+        ValueError: When the graph of the SavedModel cannot be optimized.
+    """
+    from tensorflow.python.framework import importer
+
+    path = artifact_path(artifacts_dir, saved_model_dir, tag_set)
+    meta_graph_def = _read(path, fingerprint)
+    if meta_graph_def is None:
+        with _build_lock(path):
+            # Another process may have built it while this one was waiting
+            meta_graph_def = _read(path, fingerprint)
+            if meta_graph_def is None:
+                start = time.perf_counter()
+                meta_graph_def = build(saved_model_dir, tag_set)
+                _write(path, meta_graph_def, saved_model_dir, fingerprint)
+                _logger.info('Built the optimized graph of %s in %.2f s.', saved_model_dir,
+                             time.perf_counter() - start)
+
+    with sess.graph.as_default():
+        importer.import_graph_def(meta_graph_def.graph_def, name='')
+    return meta_graph_def
@@ -0,0 +1,334 @@
+"""
+T3S dynamic micro-batching.
+
+Most requests only carry one or two examples, so running them one by one leaves
+the model nearly idle. Each model gets a batching queue that gathers the
+examples of concurrent requests until it holds 'max_batch_size' examples or the
+oldest one waited 'batch_timeout' seconds, whichever comes first. The gathered
+examples are run as one batch and each caller only gets back its own rows.
+
+A queue only holds its worker thread, the model being resolved and loaded for
+each batch. The queues of the versions, outputs and lanes which are not asked
+for anymore, e.g. of an unloaded or evicted model version, are stopped once
+they are idle for 'idle_timeout' seconds, and each model has at most
+'max_queues_per_model' queues: its requests for other versions, outputs or
+lanes are run right away.
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+import config
+
+
+_Task = collections.namedtuple('_Task', ['examples', 'future', 'arrival'])
+
+
+class BatchingQueue(object):
+    """Queue merging the examples of concurrent requests to a model."""
+
+    def __init__(self, name, run_batch, max_batch_size, batch_timeout, idle_timeout=None, on_idle=None):
+        """
+        Starts the queue worker thread.
+
+        Args:
+            name: Name of the model the queue runs.
+            run_batch: Function that takes a list of examples and returns the
+                sequence of per-example results.
+            max_batch_size: Maximum number of examples in a batch.
+            batch_timeout: Maximum time in seconds an example waits for the
+                batch to fill up.
+            idle_timeout: Time in seconds without examples after which the queue
+                is retired, or None to never retire it.
+            on_idle: Function called with the queue once it is idle, which
+                retires it and returns True, or returns False to keep it. The
+                queue retires itself when None.
+        """
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.batch_timeout = batch_timeout
+        self.idle_timeout = idle_timeout
+        self.on_idle = on_idle
+        self.retired = False
+
+        self._tasks = collections.deque()
+        self._pending = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        # Statistics
+        self._batches = 0
+        self._examples = 0
+        self._batch_sizes = collections.Counter()
+
+        self._worker = threading.Thread(
+            target=self._work, name='t3s-batching-%s' % name)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def submit(self, examples):
+        """
+        Queues examples to be run in the next batch.
+
+        Args:
+            examples: List of at most max_batch_size examples.
+
+        Returns:
+            A concurrent.futures.Future set with the results of the examples.
+
+        Raises:
+            ValueError: When there are more examples than max_batch_size.
+            RuntimeError: When the queue is closed or retired.
+        """
+        if len(examples) > self.max_batch_size:
+            raise ValueError(
+                'Cannot queue %d examples in batches of at most %d examples.' %
+                (len(examples), self.max_batch_size))
+
+        future = Future()
+        if not examples:
+            future.set_result([])
+            return future
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('The batching queue of "%s" is closed.' % self.name)
+            self._tasks.append(_Task(examples, future, time.monotonic()))
+            self._pending += len(examples)
+            self._cond.notify()
+        return future
+
+    def _work(self):
+        while True:
+            with self._cond:
+                idle = False
+                while not self._tasks and not self._closed and not idle:
+                    # wait() only returns False once idle_timeout expired
+                    idle = not self._cond.wait(self.idle_timeout) and not self._tasks
+                if self._closed:
+                    return
+
+                if not idle:
+                    # Wait for the batch to fill up, at most until the oldest
+                    # task times out
+                    deadline = self._tasks[0].arrival + self.batch_timeout
+                    while self._pending < self.max_batch_size and not self._closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+
+                    batch = []
+                    batch_size = 0
+                    while self._tasks and batch_size + len(self._tasks[0].examples) <= self.max_batch_size:
+                        task = self._tasks.popleft()
+                        batch.append(task)
+                        batch_size += len(task.examples)
+                    self._pending -= batch_size
+
+            if idle:
+                if self.retire() if self.on_idle is None else self.on_idle(self):
+                    return
+                continue
+            self._run_tasks(batch)
+
+    def _run_tasks(self, batch):
+        # Skip the tasks cancelled by their caller
+        batch = [task for task in batch if task.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        batch_size = sum(len(task.examples) for task in batch)
+
+        with self._cond:
+            self._batches += 1
+            self._examples += batch_size
+            self._batch_sizes[_bucket(batch_size)] += 1
+
+        examples = [example for task in batch for example in task.examples]
+        try:
+            results = self.run_batch(examples)
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0].future.set_exception(error)
+                return
+            # Run the tasks separately so a bad request does not fail the
+            # other requests of its batch
+            for task in batch:
+                try:
+                    task.future.set_result(self.run_batch(task.examples))
+                except Exception as task_error:
+                    task.future.set_exception(task_error)
+            return
+
+        offset = 0
+        for task in batch:
+            task.future.set_result(results[offset:offset + len(task.examples)])
+            offset += len(task.examples)
+
+    def stats(self):
+        """
+        Gets the queue statistics.
+
+        Returns:
+            A dictionary with the current queue depth in examples and requests,
+            the number of batches and examples run, and the distribution of the
+            batch sizes by power of two buckets.
+        """
+        with self._cond:
+            return {
+                'queue_depth': self._pending,
+                'queued_requests': len(self._tasks),
+                'batches': self._batches,
+                'examples': self._examples,
+                'batch_sizes': {
+                    '<=%d' % bucket: self._batch_sizes[bucket]
+                    for bucket in sorted(self._batch_sizes)
+                },
+            }
+
+    def retire(self):
+        """
+        Stops the worker if the queue is idle.
+
+        Returns:
+            True if the queue was retired, False if it has examples or was
+            closed.
+        """
+        with self._cond:
+            if self._tasks or self._closed:
+                return False
+            self._closed = True
+            self.retired = True
+            self._cond.notify_all()
+            return True
+
+    def close(self):
+        """Stops the worker and fails the examples still queued."""
+        with self._cond:
+            self._closed = True
+            tasks = list(self._tasks)
+            self._tasks.clear()
+            self._pending = 0
+            self._cond.notify_all()
+
+        for task in tasks:
+            if task.future.set_running_or_notify_cancel():
+                task.future.set_exception(RuntimeError(
+                    'The batching queue of "%s" was closed.' % self.name))
+        self._worker.join()
+
+
+def _bucket(batch_size):
+    """Returns the smallest power of two greater or equal to batch_size."""
+    return 1 << (batch_size - 1).bit_length()
+
+
+class Batcher(object):
+    """Thread-safe set of the batching queues, by model."""
+
+    def __init__(self, max_queues_per_model=None, idle_timeout=None):
+        """
+        Args:
+            max_queues_per_model: Maximum number of queues of each model, or
+                None for no limit.
+            idle_timeout: Time in seconds after which an idle queue is retired,
+                or None to keep the queues.
+        """
+        self.max_queues_per_model = max_queues_per_model
+        self.idle_timeout = idle_timeout
+        self._queues = {}
+        # Model of each queue, and number of queues of each model
+        self._models = {}
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def queue(self, model, name, run_batch, max_batch_size, batch_timeout):
+        """
+        Gets a batching queue of a model, creating it on first use.
+
+        Args:
+            model: Name of the model.
+            name: Name of the queue, e.g. after the version, outputs and lane of
+                its requests.
+            run_batch: Function running a batch of examples through the model,
+                only used to create the queue.
+            max_batch_size: Maximum number of examples in a batch.
+            batch_timeout: Maximum time in seconds an example waits for the
+                batch to fill up.
+
+        Returns:
+            The BatchingQueue, or None if the model already has
+            max_queues_per_model other queues.
+        """
+        queue = self._queues.get(name)
+        if queue is None:
+            with self._lock:
+                queue = self._queues.get(name)
+                if queue is None:
+                    if self.max_queues_per_model is not None and \
+                            self._counts[model] >= self.max_queues_per_model:
+                        return None
+                    queue = BatchingQueue(name, run_batch, max_batch_size, batch_timeout,
+                                          self.idle_timeout, self._retire)
+                    self._queues[name] = queue
+                    self._models[name] = model
+                    self._counts[model] += 1
+        return queue
+
+    def submit(self, model, name, run_batch, max_batch_size, batch_timeout, batches):
+        """
+        Queues batches of examples in a batching queue of a model, see queue().
+
+        Args:
+            batches: List of the batches of at most max_batch_size examples.
+
+        Returns:
+            The list of the concurrent.futures.Future of each batch results, or
+            None if the model has too many queues.
+        """
+        while True:
+            queue = self.queue(model, name, run_batch, max_batch_size, batch_timeout)
+            if queue is None:
+                return None
+            try:
+                return [queue.submit(batch) for batch in batches]
+            except RuntimeError:
+                # A retired queue is replaced, it has no examples so the first
+                # batch was not queued
+                if not queue.retired:
+                    raise
+
+    def _retire(self, queue):
+        with self._lock:
+            if not queue.retire():
+                return False
+            if self._queues.get(queue.name) is queue:
+                del self._queues[queue.name]
+                model = self._models.pop(queue.name)
+                self._counts[model] -= 1
+                if not self._counts[model]:
+                    del self._counts[model]
+            return True
+
+    def stats(self):
+        """Returns the statistics of each model queue."""
+        with self._lock:
+            queues = list(self._queues.values())
+        return {queue.name: queue.stats() for queue in queues}
+
+    def close(self):
+        """Closes all the queues."""
+        with self._lock:
+            queues = list(self._queues.values())
+            self._queues.clear()
+            self._models.clear()
+            self._counts.clear()
+        for queue in queues:
+            queue.close()
+
+
+# Batching queues shared by the whole server
+batcher = Batcher(config.BATCHING['max_queues_per_model'], config.BATCHING['idle_timeout'])
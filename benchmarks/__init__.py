@@ -0,0 +1,11 @@
+"""
+T3S benchmarks.
+
+Run each benchmark from the T3S folder as a module, e.g.:
+`python -m benchmarks.encoding`
+
+The serving benchmark runs its load on synthetic models exported by
+benchmarks.models, and compares its results with a saved baseline:
+`python -m benchmarks.serving --save-baseline`, then after a change
+`python -m benchmarks.serving`, which fails on regressions.
+"""
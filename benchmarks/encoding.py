@@ -0,0 +1,76 @@
+"""
+Benchmark of the tf.Example encoding of the examples features.
+
+Compares the direct encoder T3S.create_examples() with the former path, which
+dumped each example to JSON and parsed it back with
+T3S.preprocess_input_examples_arg_string().
+
+Run from the T3S folder with: `python -m benchmarks.encoding`
+"""
+
+import argparse
+import json
+import timeit
+
+import tensorflow as tf
+
+from t3s import T3S
+
+
+def make_inputs(count):
+    """Creates the features of count email examples."""
+    return [
+        {
+            'lp_length': 7 + i % 5,
+            'lp_alpha': 5,
+            'lp_num': i % 3,
+            'lp_other': 1,
+            'domain_length': 6,
+            'domain': 'ex%d.com' % (i % 10),
+            'score': 0.5 + i % 7,
+        }
+        for i in range(count)
+    ]
+
+
+def former_path(inputs):
+    examples = []
+    for parsed_json in inputs:
+        model_input = T3S.preprocess_input_examples_arg_string('examples=['+json.dumps(parsed_json)+']')
+        examples.extend(model_input['examples'])
+    return examples
+
+
+def direct_path(inputs):
+    return T3S.create_examples(inputs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--examples', type=int, default=200,
+                        help='number of examples per request')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timed repetitions')
+    parser.add_argument('--number', type=int, default=20,
+                        help='number of requests per repetition')
+    args = parser.parse_args()
+
+    inputs = make_inputs(args.examples)
+
+    # Both paths must give the same examples
+    parse = tf.train.Example.FromString
+    assert [parse(e) for e in former_path(inputs)] == [parse(e) for e in direct_path(inputs)]
+
+    print('%d examples per request, best of %d x %d requests:' %
+          (args.examples, args.repeat, args.number))
+    results = {}
+    for name, path in (('former', former_path), ('direct', direct_path)):
+        best = min(timeit.repeat(lambda: path(inputs), repeat=args.repeat, number=args.number))
+        results[name] = best / args.number
+        print('  %-6s %8.3f ms/request  %8.2f us/example' %
+              (name, results[name] * 1e3, results[name] * 1e6 / args.examples))
+    print('  speedup: x%.1f' % (results['former'] / results['direct']))
+
+
+if __name__ == '__main__':
+    main()
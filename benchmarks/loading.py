@@ -0,0 +1,116 @@
+"""
+Benchmark of the optimized graph artifacts.
+
+Compares, for each synthetic model of benchmarks.models, loading its SavedModel
+with loading its optimized graph artifact, see artifacts.py, and the p50 and p99
+latencies of their runs for several batch sizes. The first optimized load, which
+builds the artifact, is reported apart from the following ones.
+
+The loads all happen in the same process, so they do not include importing
+TensorFlow, which is the same for both.
+
+Run from the T3S folder with: `python -m benchmarks.loading`
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.encoding import make_inputs
+from benchmarks.models import SIZES, export_models
+from registry import LoadedModel
+from t3s import T3S
+
+
+def time_loads(saved_model_dir, loads, artifacts_dir=None):
+    """
+    Loads a model several times.
+
+    Args:
+        saved_model_dir: Directory containing the SavedModel.
+        loads: Number of loads.
+        artifacts_dir: Directory of the optimized graph artifacts, or None to
+            load the SavedModel itself.
+
+    Returns:
+        The median load time in seconds, and the last LoadedModel.
+    """
+    times = []
+    loaded = None
+    for _ in range(loads):
+        if loaded is not None:
+            loaded.close()
+        start = time.perf_counter()
+        loaded = LoadedModel(saved_model_dir, 'serve', artifacts_dir=artifacts_dir)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), loaded
+
+
+def time_runs(loaded, examples, runs):
+    """
+    Runs a batch of examples through the 'predict' signature of a loaded model.
+
+    Args:
+        loaded: The LoadedModel.
+        examples: List of serialized tf.Example.
+        runs: Number of timed runs.
+
+    Returns:
+        The p50 and p99 latencies in milliseconds, and the predictions.
+    """
+    plan = loaded.plan('predict')
+    feed_dict = plan.feed_dict({'examples': examples})
+    predictions = loaded.session.run(plan.fetch_names, feed_dict=feed_dict)
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        loaded.session.run(plan.fetch_names, feed_dict=feed_dict)
+        latencies.append((time.perf_counter() - start) * 1e3)
+    return float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99)), predictions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--models-dir', help='directory of the synthetic models, '
+                        'exported to a temporary directory by default')
+    parser.add_argument('--models', nargs='+', choices=sorted(SIZES), default=sorted(SIZES))
+    parser.add_argument('--loads', type=int, default=5, help='number of timed loads')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 32, 256])
+    parser.add_argument('--runs', type=int, default=200, help='number of timed runs per batch size')
+    args = parser.parse_args()
+
+    models_dir = args.models_dir or tempfile.mkdtemp(prefix='t3s-benchmark-')
+    export_models(models_dir, args.models)
+
+    for model in args.models:
+        saved_model_dir = os.path.join(models_dir, model)
+        artifacts_dir = tempfile.mkdtemp(prefix='t3s-artifacts-')
+
+        saved_model_seconds, saved_model = time_loads(saved_model_dir, args.loads)
+        build_seconds, built = time_loads(saved_model_dir, 1, artifacts_dir)
+        built.close()
+        optimized_seconds, optimized = time_loads(saved_model_dir, args.loads, artifacts_dir)
+        print('model=%-6s load: SavedModel %8.1f ms  optimized %8.1f ms (x%.1f)  first optimized %8.1f ms' %
+              (model, saved_model_seconds * 1e3, optimized_seconds * 1e3,
+               saved_model_seconds / optimized_seconds, build_seconds * 1e3))
+
+        for batch_size in args.batch_sizes:
+            examples = T3S.create_examples(make_inputs(batch_size))
+            saved_model_p50, saved_model_p99, expected = time_runs(saved_model, examples, args.runs)
+            optimized_p50, optimized_p99, predictions = time_runs(optimized, examples, args.runs)
+            # Both graphs must compute the same predictions
+            for expected_output, output in zip(expected, predictions):
+                np.testing.assert_allclose(output, expected_output, rtol=1e-5, atol=1e-6)
+            print('model=%-6s batch=%-4d run: SavedModel p50 %7.2f ms  p99 %7.2f ms  '
+                  'optimized p50 %7.2f ms  p99 %7.2f ms' %
+                  (model, batch_size, saved_model_p50, saved_model_p99, optimized_p50, optimized_p99))
+
+        saved_model.close()
+        optimized.close()
+
+
+if __name__ == '__main__':
+    main()
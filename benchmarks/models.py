@@ -0,0 +1,94 @@
+"""
+Synthetic SavedModels for the benchmarks.
+
+The models have the same interface as the 'Wide and Deep' models of the README:
+a 'predict' signature under the 'serve' tag, taking serialized tf.Example in
+its 'examples' input and returning the probabilities of 2 classes in its
+'probabilities' output. Their features are the ones computed by the
+CustomExtractor of extractor.py, so they can be fed either JSON features or
+email addresses.
+
+Export them from the T3S folder with:
+`python -m benchmarks.models <models_dir>`
+"""
+
+import argparse
+import os
+
+import tensorflow as tf
+
+# Features of the models, as computed by extractor.CustomExtractor
+INT_FEATURES = ('lp_length', 'lp_alpha', 'lp_num', 'lp_other', 'domain_length')
+STRING_FEATURES = ('domain',)
+
+# Hidden layer sizes and domain embedding size of each model size
+SIZES = {
+    'small': ((16,), 8),
+    'large': ((1024, 1024, 512), 64),
+}
+
+DOMAIN_BUCKETS = 1000
+
+
+def export_model(export_dir, size='small', seed=0):
+    """
+    Exports a synthetic SavedModel with random weights.
+
+    Args:
+        export_dir: Directory to export the SavedModel to, which must not exist.
+        size: Size of the model, one of the SIZES keys.
+        seed: Seed of the random weights.
+    """
+    hidden_sizes, embedding_size = SIZES[size]
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(seed)
+        examples = tf.placeholder(tf.string, shape=[None], name='examples')
+        spec = {name: tf.FixedLenFeature([], tf.int64, default_value=0) for name in INT_FEATURES}
+        spec.update({name: tf.FixedLenFeature([], tf.string, default_value='') for name in STRING_FEATURES})
+        features = tf.parse_example(examples, spec)
+
+        numeric = tf.stack([tf.cast(features[name], tf.float32) for name in INT_FEATURES], axis=1)
+        embeddings = tf.get_variable('domain_embeddings', [DOMAIN_BUCKETS, embedding_size])
+        domains = tf.string_to_hash_bucket_fast(features['domain'], DOMAIN_BUCKETS)
+        layer = tf.concat([numeric, tf.nn.embedding_lookup(embeddings, domains)], axis=1)
+        for units in hidden_sizes:
+            layer = tf.layers.dense(layer, units, activation=tf.nn.relu)
+        probabilities = tf.nn.softmax(tf.layers.dense(layer, 2), name='probabilities')
+
+        with tf.Session(graph=graph) as session:
+            session.run(tf.global_variables_initializer())
+            builder = tf.saved_model.builder.SavedModelBuilder(export_dir)
+            signature = tf.saved_model.signature_def_utils.predict_signature_def(
+                inputs={'examples': examples}, outputs={'probabilities': probabilities})
+            builder.add_meta_graph_and_variables(
+                session, [tf.saved_model.tag_constants.SERVING],
+                signature_def_map={'predict': signature})
+            builder.save()
+
+
+def export_models(models_dir, sizes=tuple(SIZES)):
+    """
+    Exports a synthetic model of each size, named after it, unless already exported.
+
+    Args:
+        models_dir: Directory containing the models in separate subfolders.
+        sizes: Sizes of the models to export.
+    """
+    for size in sizes:
+        export_dir = os.path.join(models_dir, size)
+        if not os.path.isdir(export_dir):
+            export_model(export_dir, size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('models_dir', help='directory to export the models to')
+    parser.add_argument('--sizes', nargs='+', choices=sorted(SIZES), default=sorted(SIZES),
+                        help='sizes of the models to export')
+    args = parser.parse_args()
+    export_models(args.models_dir, args.sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Load benchmark of the T3S server.
+
+Sends prediction requests to the synthetic models of benchmarks.models, with
+several concurrency levels, batch sizes and features extraction setups, either
+through the Flask test client in the same process or over local HTTP. Each
+scenario reports the throughput in examples per second and the p50 and p99
+latencies of the requests.
+
+The results can be saved as a baseline, and compared with it on the next runs:
+the benchmark then fails when the throughput of a scenario drops, or its p99
+latency rises, by more than the tolerance.
+
+Run from the T3S folder with: `python -m benchmarks.serving`, e.g.
+`python -m benchmarks.serving --save-baseline` before a change, then
+`python -m benchmarks.serving` after it.
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import config
+from api import app
+from benchmarks.models import SIZES, export_models
+from extractor import CustomExtractor
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Features extraction setups: no extractor (JSON features), or the
+# CustomExtractor without or with an extraction pool
+EXTRACTORS = {
+    'none': None,
+    'serial': {},
+    'thread': {'pool': 'thread', 'min_parallel_inputs': 64},
+    'process': {'pool': 'process', 'min_parallel_inputs': 64},
+}
+
+
+def make_emails(count, offset=0):
+    """Creates count email addresses."""
+    return ['john.doe%d@ex%d.com' % (i, i % 10) for i in range(offset, offset + count)]
+
+
+def make_request(model, batch_size, extractor, offset=0):
+    """
+    Creates the path of a prediction request.
+
+    Args:
+        model: Name of the model.
+        batch_size: Number of examples of the request.
+        extractor: Name of the features extraction setup, one of EXTRACTORS.
+        offset: Index of the first example, to vary the requests.
+
+    Returns:
+        The path of the request.
+    """
+    emails = make_emails(batch_size, offset)
+    if EXTRACTORS[extractor] is not None:
+        data = ';'.join(emails)
+    else:
+        features = [CustomExtractor().compute_features(email) for email in emails]
+        data = json.dumps(features, separators=(',', ':'))
+    return '/%s/%s' % (model, urllib.parse.quote(data, safe=''))
+
+
+class InProcessClient(object):
+    """Sends the requests to the app through the Flask test client."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self, path):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = app.test_client()
+        response = client.get(path)
+        if response.status_code != 200 or 'error' in response.get_json():
+            raise RuntimeError('Request failed: %s' % response.get_data(as_text=True)[:200])
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class HTTPClient(object):
+    """Sends the requests to the app served over local HTTP, with a connection per thread."""
+
+    def __init__(self):
+        self._server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=_QuietHandler)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self._local = threading.local()
+
+    def get(self, path):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection('127.0.0.1', self._server.port)
+        connection.request('GET', path)
+        response = connection.getresponse()
+        body = response.read()
+        if response.status != 200 or b'"error"' in body:
+            raise RuntimeError('Request failed: %s' % body[:200])
+
+    def close(self):
+        self._server.shutdown()
+
+
+def run_scenario(client, model, concurrency, batch_size, extractor, requests):
+    """
+    Sends requests from concurrent threads.
+
+    Args:
+        client: The InProcessClient or HTTPClient.
+        model: Name of the model.
+        concurrency: Number of threads sending requests.
+        batch_size: Number of examples per request.
+        extractor: Name of the features extraction setup.
+        requests: Number of requests sent by each thread.
+
+    Returns:
+        A dictionary with the throughput in examples per second, and the p50
+        and p99 latencies in milliseconds.
+    """
+    paths = [make_request(model, batch_size, extractor, i * batch_size) for i in range(16)]
+    for path in paths[:2]:
+        client.get(path)
+
+    latencies = [[] for _ in range(concurrency)]
+    errors = []
+
+    def send(worker):
+        try:
+            for i in range(requests):
+                start = time.perf_counter()
+                client.get(paths[(worker + i) % len(paths)])
+                latencies[worker].append(time.perf_counter() - start)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=send, args=(worker,)) for worker in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+
+    latencies = np.concatenate(latencies) * 1e3
+    return {
+        'throughput': concurrency * requests * batch_size / duration,
+        'p50': float(np.percentile(latencies, 50)),
+        'p99': float(np.percentile(latencies, 99)),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the results of the scenarios with the baseline.
+
+    Returns:
+        The list of the regressions messages.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if result['throughput'] < reference['throughput'] * (1 - tolerance):
+            regressions.append('%s: throughput %.0f examples/s < baseline %.0f examples/s' %
+                               (name, result['throughput'], reference['throughput']))
+        if result['p99'] > reference['p99'] * (1 + tolerance):
+            regressions.append('%s: p99 latency %.2f ms > baseline %.2f ms' %
+                               (name, result['p99'], reference['p99']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--models-dir', help='directory of the synthetic models, '
+                        'exported to a temporary directory by default')
+    parser.add_argument('--models', nargs='+', choices=sorted(SIZES), default=['small'])
+    parser.add_argument('--modes', nargs='+', choices=['inprocess', 'http'], default=['inprocess', 'http'])
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8])
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 32])
+    parser.add_argument('--extractors', nargs='+', choices=sorted(EXTRACTORS), default=['none', 'serial'])
+    parser.add_argument('--requests', type=int, default=50, help='number of requests per thread')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline results file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='save the results as the new baseline instead of comparing them')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='relative throughput drop or p99 rise allowed before failing')
+    args = parser.parse_args()
+
+    models_dir = args.models_dir or tempfile.mkdtemp(prefix='t3s-benchmark-')
+    export_models(models_dir, args.models)
+    config.TF_MODELS['dir'] = os.path.join(models_dir, '')
+
+    extractors = {name: CustomExtractor(**setup) for name, setup in EXTRACTORS.items() if setup is not None}
+    results = {}
+    for mode in args.modes:
+        client = HTTPClient() if mode == 'http' else InProcessClient()
+        for model, extractor, concurrency, batch_size in itertools.product(
+                args.models, args.extractors, args.concurrency, args.batch_sizes):
+            if extractor in extractors:
+                config.TF_MODELS['extractors'][model] = extractors[extractor]
+            else:
+                config.TF_MODELS['extractors'].pop(model, None)
+
+            name = 'model=%s,mode=%s,extractor=%s,concurrency=%d,batch=%d' % (
+                model, mode, extractor, concurrency, batch_size)
+            results[name] = result = run_scenario(
+                client, model, concurrency, batch_size, extractor, args.requests)
+            print('%-70s %10.0f examples/s  p50 %8.2f ms  p99 %8.2f ms' %
+                  (name, result['throughput'], result['p50'], result['p99']))
+        if mode == 'http':
+            client.close()
+    for extractor in extractors.values():
+        extractor.close()
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print('Saved the baseline to %s.' % args.baseline)
+        return
+
+    if not os.path.isfile(args.baseline):
+        print('No baseline to compare with, save one with --save-baseline.')
+        return
+    with open(args.baseline) as baseline_file:
+        regressions = compare(results, json.load(baseline_file), args.tolerance)
+    if regressions:
+        print('REGRESSIONS:\n  ' + '\n  '.join(regressions))
+        sys.exit(1)
+    print('No regression against %s.' % args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+T3S prediction cache.
+
+Requests often ask again for the same examples. Each model with the 'cache'
+option gets a bounded cache of its predictions, keyed by a stable hash of the
+canonicalized features of each example. Entries are evicted when the cache
+holds more than 'cache_size' entries, least recently used first, or when they
+are older than 'cache_ttl' seconds.
+
+A cache is bound to the version of the model that filled it: when the registry
+loads a new version of the model, its cache is emptied.
+"""
+
+import collections
+import hashlib
+import json
+import threading
+import time
+
+
+class _Missing(object):
+    """Placeholder for the examples missing from a cache."""
+
+    def __repr__(self):
+        return 'MISSING'
+
+
+MISSING = _Missing()
+
+
+def example_key(features):
+    """
+    Computes the cache key of an example.
+
+    Args:
+        features: A dictionary with the features of the example.
+
+    Returns:
+        A 16 bytes digest, equal for all the dictionaries with the same features
+        values whatever their keys order.
+    """
+    canonical = json.dumps(features, sort_keys=True, separators=(',', ':'), default=repr)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).digest()
+
+
+class PredictionCache(object):
+    """Thread-safe LRU cache of predictions with a time to live."""
+
+    def __init__(self, max_entries, ttl):
+        """
+        Args:
+            max_entries: Maximum number of cached predictions.
+            ttl: Time to live of the cached predictions, in seconds.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_many(self, keys):
+        """
+        Looks up predictions.
+
+        Args:
+            keys: List of examples keys.
+
+        Returns:
+            The list of the cached prediction of each example, or MISSING.
+        """
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] < now:
+                    del self._entries[key]
+                    self._evictions += 1
+                    entry = None
+
+                if entry is None:
+                    values.append(MISSING)
+                    self._misses += 1
+                else:
+                    self._entries.move_to_end(key)
+                    values.append(entry[0])
+                    self._hits += 1
+        return values
+
+    def put_many(self, keys, values):
+        """
+        Caches predictions.
+
+        Args:
+            keys: List of examples keys.
+            values: List of the prediction of each example.
+        """
+        expiry = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._entries[key] = (value, expiry)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        """Empties the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the number of entries, hits, misses and evictions of the cache."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+            }
+
+
+class PredictionCaches(object):
+    """Thread-safe set of the prediction caches, one per model."""
+
+    def __init__(self):
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def cache(self, model, version, max_entries, ttl):
+        """
+        Gets the prediction cache of a model version, creating it on first use.
+
+        Args:
+            model: Name of the model.
+            version: Identifier of the loaded version of the model. The cache is
+                emptied when it changes.
+            max_entries: Maximum number of cached predictions.
+            ttl: Time to live of the cached predictions, in seconds.
+
+        Returns:
+            The PredictionCache of the model.
+        """
+        with self._lock:
+            current = self._caches.get(model)
+            if current is None:
+                current = self._caches[model] = [version, PredictionCache(max_entries, ttl)]
+            elif current[0] != version:
+                current[0] = version
+                current[1].clear()
+            return current[1]
+
+    def stats(self):
+        """Returns the statistics of each model cache."""
+        with self._lock:
+            caches = {model: current[1] for model, current in self._caches.items()}
+        return {model: cache.stats() for model, cache in caches.items()}
+
+
+# Prediction caches shared by the whole server
+caches = PredictionCaches()
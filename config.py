@@ -11,6 +11,32 @@ Edit it to suit your needs:
         subfolders
         - 'extractors' is a Python dict that contains specific features extractor
         for your models if necessary (see the Readme for more information)
+        - 'options' is a Python dict that contains specific serving options for
+        your models, overriding the `DEFAULT_MODEL_OPTIONS`
+        - 'preload' tells whether to load and warm up all the models at startup,
+        using 'preload_workers' threads
+        - 'fanout_workers' is the number of threads running the models of the
+        requests posted to `/fanout`
+        - 'memory_budget' is the maximum estimated memory in bytes of the loaded
+        models, the least recently used ones being evicted beyond it, or None
+        for no limit
+        - 'artifacts_dir' is the local directory caching the optimized graphs
+        of the models with the 'optimized_graph' option
+        - 'watch_interval' is the time in seconds between two checks for new
+        versions of the models, None not to check
+    4. if some models have the 'archive_outputs' option, configure where and
+    how their outputs are saved by setting the `${OUTPUT_ARCHIVE}` dict
+    5. to serve in production, set the number of worker processes in the
+    `${SERVING}` dict
+    6. if you run the asyncio front-end, size its executor and set its limits
+    in the `${ASYNC_FRONTEND}` dict
+    7. tune the gzip compression of the responses in the
+    `${RESPONSE_COMPRESSION}` dict
+    8. set the number of models runs at the same time in the `${SCHEDULING}`
+    dict
+    9. if some models have a 'trace_rate', size their traces history in the
+    `${TRACING}` dict
+    10. bound the batching queues of the models in the `${BATCHING}` dict
 """
 
 import os
@@ -56,5 +82,172 @@ def configure_app(app):
 # ========================
 TF_MODELS = {
     'dir': '',
-    'extractors': {}
+    'extractors': {},
+    'options': {},
+    'preload': True,
+    'preload_workers': 4,
+    'fanout_workers': 8,
+    'memory_budget': None,
+    'artifacts_dir': './artifacts/',
+    'watch_interval': 30,
+}
+
+# Serving options used for the models without specific ones in TF_MODELS
+DEFAULT_MODEL_OPTIONS = {
+    # Maximum number of examples fed to the model in a single run, larger
+    # requests are split in several runs
+    'max_batch_size': 256,
+    # Whether to merge the examples of concurrent requests in common batches
+    'batching': True,
+    # Maximum time in seconds an example waits for its batch to fill up
+    'batch_timeout': 0.002,
+    # Whether to save the model outputs in the output archive
+    'archive_outputs': False,
+    # Whether to cache the predictions of the model, keyed by the examples
+    # features, and the maximum number and time to live in seconds of the
+    # cached predictions
+    'cache': False,
+    'cache_size': 100000,
+    'cache_ttl': 3600,
+    # Features schema of the model, mapping each feature name to its 'float',
+    # 'int64' or 'string' type. If None, it is inferred from the model graph
+    # when possible, else the features are typed after their JSON values
+    'features': None,
+    # Number of synthetic examples run through the model after preloading it at
+    # startup, 0 not to warm it up
+    'warmup_batch_size': 32,
+    # Number of the most recent versions of the model served at the same time,
+    # for the models stored in numeric version subfolders
+    'versions_kept': 2,
+    # Fields of the TensorFlow ConfigProto of the model session, e.g.
+    # {'intra_op_parallelism_threads': 4, 'inter_op_parallelism_threads': 2,
+    # 'graph_options': {'optimizer_options': {'opt_level': 'L1'}}}, or None for
+    # the TensorFlow defaults
+    'session_config': None,
+    # Maximum number of requests to the model processed at the same time and
+    # waiting to be processed by the asyncio front-end, the following ones
+    # being rejected
+    'max_concurrency': 8,
+    'max_queue_depth': 64,
+    # Whether the model is kept loaded whatever the 'memory_budget'
+    'pinned': False,
+    # Maximum number of batches of the model run at the same time, or None for
+    # no limit, and share of the run slots of the model relative to the other
+    # models, see scheduling.py
+    'run_quota': None,
+    'run_weight': 1,
+    # Fraction of the runs of the model traced op by op, see tracing.py
+    'trace_rate': 0.0,
+    # Whether to load the model from a frozen and optimized graph of its
+    # 'predict' signature, built once and cached in TF_MODELS['artifacts_dir'],
+    # see artifacts.py
+    'optimized_graph': False,
+}
+
+def get_model_option(model, option):
+    """
+    Gets a serving option of a model.
+
+    Args:
+        model: Name of the model.
+        option: Name of the option, one of the `DEFAULT_MODEL_OPTIONS` keys.
+
+    Returns:
+        The option value specified for the model in TF_MODELS, or the default one.
+    """
+    return TF_MODELS['options'].get(model, {}).get(
+        option, DEFAULT_MODEL_OPTIONS[option])
+
+
+# OUTPUT ARCHIVE CONFIGURATION
+# ============================
+# Used by the models with the 'archive_outputs' option
+OUTPUT_ARCHIVE = {
+    # Directory containing the archives, in one subfolder per model
+    'dir': './archive/',
+    # Maximum number of runs waiting to be written
+    'max_queue_size': 10000,
+    # Duration in seconds of the time window covered by each archive file
+    'rotation_interval': 3600,
+    # What to do with new outputs when the queue is full: 'drop' them or
+    # 'block' the requests until the writer catches up
+    'overflow': 'drop',
+}
+
+
+# PRODUCTION SERVER CONFIGURATION
+# ===============================
+SERVING = {
+    # Number of pre-forked worker processes, each with its own models sessions,
+    # or 1 to run the Flask development server
+    'workers': 1,
+    # Whether to pin each worker to its share of the CPUs
+    'cpu_affinity': False,
+    # Maximum time in seconds a stopped worker waits for its requests to finish
+    'shutdown_timeout': 30,
+    # Time in seconds a stopped worker gets after 'shutdown_timeout' to exit,
+    # before it is killed
+    'shutdown_grace': 10,
+}
+
+
+# ASYNCIO FRONT-END CONFIGURATION
+# ===============================
+# Used when serving with `python frontend.py`
+ASYNC_FRONTEND = {
+    # Number of threads processing the requests
+    'executor_workers': 32,
+    # Delay in seconds advised to the clients of the overloaded models
+    'retry_after': 1,
+    # Time in seconds after which the requests without a X-T3S-Timeout header
+    # expire, or None for no deadline
+    'default_timeout': None,
+    # Maximum size in bytes of the request bodies
+    'max_body_size': 64 * 1024 * 1024,
+}
+
+# SCHEDULING CONFIGURATION
+# ========================
+# The runs of all the models share the run slots, see scheduling.py
+SCHEDULING = {
+    # Maximum number of batches run at the same time, or None for no limit
+    'run_slots': None,
+    # Maximum number of high priority batches started in a row while normal
+    # ones wait, or None for no limit
+    'high_burst': 8,
+}
+
+# BATCHING CONFIGURATION
+# ======================
+# Queues of the models with the 'batching' option, see batching.py
+BATCHING = {
+    # Maximum number of batching queues of each model, one per version, set of
+    # outputs and lane requested, beyond which the requests are run unbatched
+    'max_queues_per_model': 16,
+    # Time in seconds after which an idle batching queue is stopped, or None to
+    # keep the queues
+    'idle_timeout': 300,
+}
+
+# TRACING CONFIGURATION
+# =====================
+# Traces of the runs sampled with the 'trace_rate' option, see tracing.py
+TRACING = {
+    # Number of last traced runs of each model summed up in its hotspot table
+    'window': 100,
+    # Number of ops listed in the hotspot tables
+    'hotspots': 20,
+    # Number of last traced runs of each model kept as Chrome traces
+    'timelines': 10,
+}
+
+# RESPONSE COMPRESSION CONFIGURATION
+# ==================================
+# Responses are compressed with gzip for the clients accepting it
+RESPONSE_COMPRESSION = {
+    'enabled': True,
+    # Size in bytes under which responses are not worth compressing
+    'min_size': 1024,
+    # gzip compression level, from 1 (fastest) to 9 (smallest)
+    'level': 1,
 }
@@ -1,9 +1,11 @@
+import numpy as np
+
 from t3s import T3SExtractor
 
 class CustomExtractor(T3SExtractor):
 
     def check_data(self, input):
-        return '@' in input
+        return input.count('@') == 1
 
     def compute_features(self, input):
         # compute features values
@@ -25,5 +27,49 @@ class CustomExtractor(T3SExtractor):
 
         return features
 
+    def compute_features_batch(self, inputs):
+        if not inputs:
+            return []
+
+        # the other inputs fail as they would alone, rather than shifting the
+        # features of the batch
+        for input in inputs:
+            if input.count('@') != 1:
+                self.compute_features(input)
+
+        # classify the characters of all the local parts at once
+        lps, domains = zip(*(input.split('@') for input in inputs))
+        lp_lengths = np.fromiter(map(len, lps), dtype=np.int64, count=len(lps))
+        chars = np.frombuffer(''.join(lps).encode('utf-32-le'), dtype=np.uint32)
+        lowered = chars | 0x20
+
+        ends = np.cumsum(lp_lengths)
+        starts = ends - lp_lengths
+        def count(mask):
+            counts = np.concatenate(([0], np.cumsum(mask)))
+            return (counts[ends] - counts[starts]).tolist()
+
+        lp_num = count((chars >= ord('0')) & (chars <= ord('9')))
+        lp_alpha = count((lowered >= ord('a')) & (lowered <= ord('z')))
+        non_ascii = count(chars > 0x7f)
+
+        # create features dictionaries
+        examples_features = []
+        for i, lp_length in enumerate(lp_lengths.tolist()):
+            if non_ascii[i]:
+                # unicode digits and letters are only counted by compute_features
+                examples_features.append(self.compute_features(inputs[i]))
+                continue
+            examples_features.append({
+                'lp_length': lp_length,
+                'lp_alpha': lp_alpha[i],
+                'lp_num': lp_num[i],
+                'lp_other': lp_length - lp_num[i] - lp_alpha[i],
+                'domain_length': len(domains[i]),
+                'domain': domains[i],
+            })
+
+        return examples_features
+
     def error_formatting(self):
         return 'Please enter emails in the form: "username@domain".'
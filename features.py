@@ -0,0 +1,329 @@
+"""
+T3S features schemas and compiled encoders.
+
+A features schema maps each feature of a model to its type: 'float', 'int64' or
+'string'. It is either declared in the 'features' option of the model, or
+inferred from the tf.parse_example() op the model feeds its serialized examples
+to.
+
+A schema is compiled into one specialized encoder per feature, which coerces
+the values of a whole batch column to the feature type at once, rejecting the
+mismatching ones, and directly writes their tf.train.Example wire format. The
+encoding of each feature key is computed once, so a float value only costs
+copying its 4 bytes, and the encodings of the int and string values are cached.
+"""
+
+import numpy as np
+
+
+FLOAT = 'float'
+INT64 = 'int64'
+STRING = 'string'
+
+# Maximum number of values whose encoding is cached by each feature encoder
+CACHE_SIZE = 4096
+
+_KINDS_BY_DTYPE = {
+    'float32': FLOAT,
+    'int64': INT64,
+    'string': STRING,
+}
+
+_UINT64_MASK = (1 << 64) - 1
+
+_INT64_INFO = np.iinfo(np.int64)
+
+# Field numbers of the tf.train.Feature kinds
+_FEATURE_FIELDS = {
+    STRING: 1,
+    FLOAT: 2,
+    INT64: 3,
+}
+
+
+def _varint(value):
+    """Encodes a non-negative integer as a protocol buffer varint."""
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _field(number, payload):
+    """Encodes a length-delimited protocol buffer field."""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _fragment(name, kind, values_list):
+    """
+    Encodes a feature as an entry of the tf.train.Features map.
+
+    Args:
+        name: Encoded name of the feature.
+        kind: Type of the feature.
+        values_list: Encoded content of its BytesList, FloatList or Int64List.
+
+    Returns:
+        The bytes to add to the features of a serialized tf.train.Example.
+    """
+    feature = _field(_FEATURE_FIELDS[kind], values_list)
+    return _field(1, _field(1, name) + _field(2, feature))
+
+
+def _is_number(value):
+    """Tells whether a value is an int or a float, from Python or NumPy, booleans excluded."""
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_))
+
+
+def _is_int64(value):
+    """Tells whether a number is an integer within the int64 range, which casting would otherwise wrap."""
+    if isinstance(value, (float, np.floating)):
+        # 2**63 is exactly representable, unlike the int64 maximum
+        return float(value).is_integer() and _INT64_INFO.min <= value < 2.0 ** 63
+    return _INT64_INFO.min <= value <= _INT64_INFO.max
+
+
+def _mismatch(name, kind, values, index, indices):
+    """Builds the error of the first value of a column not matching its feature type."""
+    position = index if indices is None else indices[index]
+    return ValueError('Feature "%s" expects %s values, but example %d has %r.' % (name, kind, position, values[index]))
+
+
+def _float_encoder(name):
+    prefix = _fragment(name.encode('utf-8'), FLOAT, _field(1, b'\0' * 4))[:-4]
+    prefix_row = np.frombuffer(prefix, dtype=np.uint8)
+    width = len(prefix) + 4
+
+    def encode(values, indices=None):
+        # Strings and booleans are rejected rather than cast
+        for i, value in enumerate(values):
+            if not _is_number(value):
+                raise _mismatch(name, 'float', values, i, indices)
+        try:
+            array = np.asarray(values, dtype=np.float64).astype('<f4')
+        except OverflowError:
+            for i, value in enumerate(values):
+                try:
+                    float(value)
+                except OverflowError:
+                    raise _mismatch(name, 'float', values, i, indices)
+            raise
+
+        rows = np.empty((len(array), width), dtype=np.uint8)
+        rows[:, :len(prefix)] = prefix_row
+        rows[:, len(prefix):] = array.view(np.uint8).reshape(-1, 4)
+        data = rows.tobytes()
+        return [data[start:start + width] for start in range(0, len(data), width)]
+
+    return encode
+
+
+def _int64_encoder(name):
+    encoded_name = name.encode('utf-8')
+    cache = {}
+
+    def encode(values, indices=None):
+        fragments = []
+        for i, value in enumerate(values):
+            if not _is_number(value) or not _is_int64(value):
+                raise _mismatch(name, 'integer', values, i, indices)
+            value = int(value)
+            fragment = cache.get(value)
+            if fragment is None:
+                fragment = _fragment(encoded_name, INT64, _field(1, _varint(value & _UINT64_MASK)))
+                if len(cache) < CACHE_SIZE:
+                    cache[value] = fragment
+            fragments.append(fragment)
+        return fragments
+
+    return encode
+
+
+def _string_encoder(name):
+    encoded_name = name.encode('utf-8')
+    cache = {}
+
+    def encode(values, indices=None):
+        fragments = []
+        for i, value in enumerate(values):
+            try:
+                fragment = cache.get(value)
+            except TypeError:
+                fragment = None
+            if fragment is None:
+                if isinstance(value, str):
+                    data = value.encode('utf-8')
+                elif isinstance(value, bytes):
+                    data = value
+                else:
+                    raise _mismatch(name, 'string', values, i, indices)
+                fragment = _fragment(encoded_name, STRING, _field(1, data))
+                if len(cache) < CACHE_SIZE:
+                    cache[value] = fragment
+            fragments.append(fragment)
+        return fragments
+
+    return encode
+
+
+_COMPILERS = {
+    FLOAT: _float_encoder,
+    INT64: _int64_encoder,
+    STRING: _string_encoder,
+}
+
+
+class FeatureSchema(object):
+    """Types of the features of a model."""
+
+    def __init__(self, features):
+        """
+        Args:
+            features: A dictionary that maps feature names to their type, one of
+                'float', 'int64' or 'string'.
+
+        Raises:
+            ValueError: When a feature type is unknown.
+        """
+        for name, kind in features.items():
+            if kind not in _COMPILERS:
+                raise ValueError(
+                    'Type "%s" of feature "%s" is not supported, please choose from '
+                    '"float", "int64" or "string".' % (kind, name))
+        self.features = dict(features)
+
+    def compile(self):
+        """Returns the SchemaEncoder of the schema."""
+        return SchemaEncoder(self)
+
+
+class SchemaEncoder(object):
+    """Encoder of feature dictionaries into serialized tf.train.Example."""
+
+    def __init__(self, schema):
+        """
+        Compiles the encoder of each feature.
+
+        Args:
+            schema: The FeatureSchema to encode.
+        """
+        self.schema = schema
+        self._encoders = [
+            (name, _COMPILERS[kind](name))
+            for name, kind in sorted(schema.features.items())
+        ]
+
+    def encode(self, example_dicts):
+        """
+        Encodes a batch of examples, column by column.
+
+        Features missing from an example, or set to None, are left out of it so
+        the model uses their default value. Features missing from the schema
+        are ignored since the model does not parse them.
+
+        Args:
+            example_dicts: List of dictionaries that contain the examples features.
+
+        Returns:
+            The list of serialized tf.Example.
+
+        Raises:
+            ValueError: An error when an example is not a dictionary or one of its
+                values does not match its feature type.
+        """
+        for example_dict in example_dicts:
+            if not isinstance(example_dict, dict):
+                raise ValueError(
+                    'An example must be a dictionary of features, but "%s" is %s.' %
+                    (example_dict, type(example_dict)))
+
+        count = len(example_dicts)
+        columns = []
+        for name, encode in self._encoders:
+            values = [example_dict.get(name) for example_dict in example_dicts]
+            present = [i for i, value in enumerate(values) if value is not None]
+            if len(present) == count:
+                columns.append(encode(values))
+            else:
+                column = [b''] * count
+                if present:
+                    for i, fragment in zip(present, encode([values[i] for i in present], present)):
+                        column[i] = fragment
+                columns.append(column)
+
+        rows = zip(*columns) if columns else [()] * count
+        return [_field(1, b''.join(row)) for row in rows]
+
+
+def _constant_strings(tensor):
+    from tensorflow.python.framework import tensor_util
+    value = tensor_util.constant_value(tensor)
+    if value is None:
+        return None
+    return [key.decode('utf-8') for key in np.asarray(value).ravel().tolist()]
+
+
+def _schema_from_parse_op(op):
+    """
+    Reads the schema of a ParseExample or ParseExampleV2 op.
+
+    Returns:
+        The FeatureSchema, or None if the op parses features T3S cannot encode
+        (non-scalar dense features, ragged features or unsupported types).
+    """
+    from tensorflow.python.framework import dtypes
+    from tensorflow.python.framework import tensor_shape
+
+    if op.type == 'ParseExample':
+        sparse_count = op.get_attr('Nsparse')
+        dense_count = op.get_attr('Ndense')
+        key_tensors = op.inputs[2:2 + sparse_count + dense_count]
+    else:
+        if op.get_attr('ragged_value_types'):
+            return None
+        key_tensors = op.inputs[2:4]
+
+    keys = []
+    for tensor in key_tensors:
+        tensor_keys = _constant_strings(tensor)
+        if tensor_keys is None:
+            return None
+        keys.extend(tensor_keys)
+    types = list(op.get_attr('sparse_types')) + list(op.get_attr('Tdense'))
+    if len(keys) != len(types):
+        return None
+
+    for shape in op.get_attr('dense_shapes'):
+        if tensor_shape.TensorShape(shape).num_elements() != 1:
+            return None
+
+    features = {}
+    for key, dtype in zip(keys, types):
+        kind = _KINDS_BY_DTYPE.get(dtypes.as_dtype(dtype).name)
+        if kind is None:
+            return None
+        features[key] = kind
+    return FeatureSchema(features)
+
+
+def infer_schema(graph, tensor_name):
+    """
+    Infers the features schema of a serialized examples input from its parsing op.
+
+    Args:
+        graph: The graph of the model.
+        tensor_name: Name of the input tensor fed with serialized tf.Example.
+
+    Returns:
+        The FeatureSchema, or None if the input is not parsed by a supported op.
+    """
+    ops = list(graph.get_tensor_by_name(tensor_name).consumers())
+    while ops:
+        op = ops.pop()
+        if op.type == 'Identity':
+            ops.extend(op.outputs[0].consumers())
+        elif op.type in ('ParseExample', 'ParseExampleV2'):
+            return _schema_from_parse_op(op)
+    return None
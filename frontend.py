@@ -0,0 +1,428 @@
+"""
+T3S asyncio front-end.
+
+The Flask server holds a thread per request for the whole extraction,
+serialization and run of its examples, and queues an unbounded number of
+requests when it is overloaded, so that latency grows without bound during
+spikes. This front-end accepts the requests on an asyncio event loop instead
+and hands their processing, still done by T3S and T3SBulk, to a bounded pool of
+'executor_workers' threads.
+
+The requests to each model are admitted by a limiter: at most
+'max_concurrency' of them are processed at the same time, and at most
+'max_queue_depth' wait for their turn. The following ones are immediately
+answered with a 503 status and a Retry-After header. A request can also set a
+deadline with the X-T3S-Timeout header, in seconds: it is answered with a 504
+status when the deadline expires, and is not processed at all if it expired
+while waiting.
+
+The results of the bulk requests of JSON rows are streamed as they are computed,
+batch after batch, as with Flask. The deadline of these requests only applies
+until their first batch. The requests posted to /fanout share a limiter of
+their own, sized by the default options of the models.
+
+The front-end also serves the statistics addresses of the Flask server, but not
+its HTML pages.
+
+Run it with `python frontend.py`, which requires the aiohttp package.
+"""
+
+import asyncio
+import functools
+import io
+import itertools
+import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from flask import Response
+
+import config
+import responses
+import scheduling
+import streaming
+import tensors
+from api import app, start_serving
+from batching import batcher
+from cache import caches
+from metrics import metrics
+from registry import registry
+from scheduling import scheduler
+from startup import startup
+from t3s import T3S, T3SBulk, T3SFanout, count_failed_request
+from tracing import tracer
+from versions import label, versions
+
+TIMEOUT_HEADER = 'X-T3S-Timeout'
+
+# Name of the limiter of the requests posted to /fanout
+FANOUT = '(fanout)'
+
+
+class Overloaded(Exception):
+    """Raised when a model has too many requests waiting."""
+
+
+class ModelLimiter(object):
+    """Bounds the number of requests processed and waiting for a model."""
+
+    def __init__(self, max_concurrency, max_queue_depth):
+        """
+        Args:
+            max_concurrency: Maximum number of requests processed at the same time.
+            max_queue_depth: Maximum number of requests waiting to be processed.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._running = 0
+        self._rejected = 0
+        self._expired = 0
+
+    async def run(self, executor, function, deadline=None, keep=False):
+        """
+        Runs a function in the executor once the model has room for it.
+
+        Args:
+            executor: The executor to run the function in.
+            function: The function processing the request.
+            deadline: Event loop time after which the result is not awaited
+                anymore, or None.
+            keep: Whether the room is kept once the function returned, for the
+                request to go on, until release() is called. The room is freed
+                anyway when the function raises or expires.
+
+        Returns:
+            The result of the function.
+
+        Raises:
+            Overloaded: When too many requests are already waiting.
+            asyncio.TimeoutError: When the deadline expired.
+        """
+        if self._semaphore.locked() and self._waiting >= self.max_queue_depth:
+            self._rejected += 1
+            raise Overloaded()
+
+        loop = asyncio.get_running_loop()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), _remaining(loop, deadline))
+        except asyncio.TimeoutError:
+            self._expired += 1
+            raise
+        finally:
+            self._waiting -= 1
+
+        # The slot is only freed once the function is done, even if the
+        # request expired meanwhile
+        self._running += 1
+        future = loop.run_in_executor(executor, function)
+        if not keep:
+            future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), _remaining(loop, deadline))
+        except BaseException as error:
+            if isinstance(error, asyncio.TimeoutError):
+                self._expired += 1
+            if keep:
+                future.add_done_callback(self._release)
+            raise
+
+    def release(self):
+        """Frees the room kept by a request, see run()."""
+        self._release()
+
+    def _release(self, future=None):
+        self._running -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        """Returns the number of running and waiting requests, and of the rejected and expired ones."""
+        return {
+            'running': self._running,
+            'waiting': self._waiting,
+            'rejected': self._rejected,
+            'expired': self._expired,
+        }
+
+
+def _remaining(loop, deadline):
+    if deadline is None:
+        return None
+    return max(0, deadline - loop.time())
+
+
+class Frontend(object):
+    """aiohttp application serving the predictions of the models."""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(config.ASYNC_FRONTEND['executor_workers'])
+        self.limiters = {}
+
+        self.app = web.Application(client_max_size=config.ASYNC_FRONTEND['max_body_size'])
+        self.app.router.add_get('/_t3s/health', self.health)
+        self.app.router.add_get('/_t3s/ready', self.ready)
+        self.app.router.add_get('/_t3s/limits', self.limits)
+        self.app.router.add_get('/_t3s/metrics', self.metrics)
+        for route, stats in (('batching', batcher.stats), ('cache', caches.stats), ('versions', versions.status),
+                             ('residency', registry.residency), ('scheduling', scheduler.stats),
+                             ('tracing', tracer.status)):
+            self.app.router.add_get('/_t3s/' + route, functools.partial(self.stats, stats))
+        self.app.router.add_get('/_t3s/tracing/{model}', self.hotspots)
+        self.app.router.add_get('/_t3s/tracing/{model}/timeline', self.chrome_trace)
+        self.app.router.add_post('/fanout', self.fanout)
+        self.app.router.add_get('/{model}/{data_input}', self.predict)
+        self.app.router.add_get(r'/{model}/versions/{version:\d+}/{data_input}', self.predict)
+        self.app.router.add_post('/{model}/predict', self.bulk_predict)
+        self.app.router.add_post(r'/{model}/versions/{version:\d+}/predict', self.bulk_predict)
+        # Same routes in the high priority scheduling lane
+        for route in ('/{model}/{data_input}', r'/{model}/versions/{version:\d+}/{data_input}'):
+            self.app.router.add_get('/_t3s/priority' + route, functools.partial(self.predict, lane=scheduling.HIGH))
+        for route in ('/{model}/predict', r'/{model}/versions/{version:\d+}/predict'):
+            self.app.router.add_post('/_t3s/priority' + route, functools.partial(self.bulk_predict, lane=scheduling.HIGH))
+        self.app.on_cleanup.append(self._shutdown)
+
+    def limiter(self, model, version=None):
+        """Gets the limiter of an existing model, creating it on first use."""
+        name = label(model, version)
+        limiter = self.limiters.get(name)
+        if limiter is None:
+            limiter = self.limiters[name] = ModelLimiter(
+                config.get_model_option(model, 'max_concurrency'),
+                config.get_model_option(model, 'max_queue_depth'))
+        return limiter
+
+    async def _process(self, request, model, version, function, keep=False):
+        # Limiters are only created for the models which exist
+        if model != FANOUT:
+            try:
+                versions.model_dir(model, version)
+            except ValueError as error:
+                count_failed_request(model)
+                return web.json_response({'error': str(error)})
+
+        timeout = request.headers.get(TIMEOUT_HEADER, config.ASYNC_FRONTEND['default_timeout'])
+        deadline = None
+        if timeout is not None:
+            try:
+                deadline = asyncio.get_running_loop().time() + float(timeout)
+            except ValueError:
+                return web.json_response(
+                    {'error': 'The %s header must be a number of seconds.' % TIMEOUT_HEADER}, status=400)
+
+        try:
+            return await self.limiter(model, version).run(self.executor, function, deadline, keep)
+        except Overloaded:
+            return web.json_response(
+                {'error': 'Model "%s" is overloaded, please retry later.' % model},
+                status=503, headers={'Retry-After': str(config.ASYNC_FRONTEND['retry_after'])})
+        except asyncio.TimeoutError:
+            return web.json_response({'error': 'The request deadline expired.'}, status=504)
+
+    @staticmethod
+    def _version(request):
+        version = request.match_info.get('version')
+        return None if version is None else int(version)
+
+    @staticmethod
+    def _lane(request, lane):
+        if lane is not None:
+            return lane
+        return scheduling.lane(request.headers.get(scheduling.PRIORITY_HEADER))
+
+    async def predict(self, request, lane=None):
+        model = request.match_info['model']
+        version = self._version(request)
+        function = functools.partial(T3S().get, model, request.match_info['data_input'], version,
+                                     request.query.get('outputs'), responses.negotiate(request.headers.get('Accept')),
+                                     self._lane(request, lane))
+        result = await self._process(request, model, version, function)
+        if isinstance(result, web.Response):
+            return result
+        return _compressed(request, _response(result))
+
+    async def bulk_predict(self, request, lane=None):
+        model = request.match_info['model']
+        version = self._version(request)
+        lane = self._lane(request, lane)
+        # The whole body is read before being processed, unlike with Flask
+        body = await request.read()
+        outputs = request.query.get('outputs')
+        if request.content_type not in tensors.FORMATS:
+            lines = functools.partial(_bulk_lines, model, body, version, outputs, lane)
+            return await self._stream(request, model, version, lines)
+
+        function = functools.partial(_bulk_tensors, model, request.content_type, body, version, outputs,
+                                     responses.negotiate(request.headers.get('Accept')), lane)
+        result = await self._process(request, model, version, function)
+        if isinstance(result, web.Response):
+            return result
+        return _compressed(request, _response(result))
+
+    async def _stream(self, request, model, version, lines):
+        """
+        Processes a request answered with JSON lines, writing them batch after
+        batch as the executor computes them.
+
+        Args:
+            request: The aiohttp request.
+            model: Name of the model.
+            version: Number of the version of the model, or None.
+            lines: Function returning the iterator over the lines of the response.
+
+        Returns:
+            The streamed response, or the error response of a request rejected
+            before its first batch.
+        """
+        # The lines of a batch are all computed at once
+        size = config.get_model_option(model, 'max_batch_size')
+        result = await self._process(request, model, version, functools.partial(_first_lines, lines, size), True)
+        if isinstance(result, web.Response):
+            return result
+
+        # The room of the request is kept until its last batch is written
+        limiter = self.limiter(model, version)
+        text, remaining = result
+        loop = asyncio.get_running_loop()
+        step = None
+        try:
+            response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+            # aiohttp would only send the compressed lines at the end, so each
+            # batch is flushed from the compressor explicitly
+            compressor = None
+            if config.RESPONSE_COMPRESSION['enabled'] and \
+                    responses.accepts_gzip(request.headers.get('Accept-Encoding')):
+                compressor = zlib.compressobj(config.RESPONSE_COMPRESSION['level'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                response.headers['Content-Encoding'] = 'gzip'
+            await response.prepare(request)
+            while text:
+                data = text.encode('utf-8')
+                if compressor is not None:
+                    data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                await response.write(data)
+                step = loop.run_in_executor(self.executor, _next_lines, remaining, size)
+                # A disconnected client does not interrupt the batch being computed
+                text = await asyncio.shield(step)
+            if compressor is not None:
+                await response.write(compressor.flush())
+            await response.write_eof()
+            return response
+        finally:
+            if step is None or step.done():
+                limiter.release()
+            else:
+                step.add_done_callback(lambda step: limiter.release())
+
+    async def fanout(self, request):
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if not isinstance(body, dict) or not isinstance(body.get('models'), list) \
+                or not isinstance(body.get('data_input'), str):
+            return web.json_response({
+                'error': 'Please post a JSON dictionary with the "models" list and the "data_input" string.'
+            })
+        function = functools.partial(T3SFanout.predict, body['models'], body['data_input'])
+        result = await self._process(request, FANOUT, None, function)
+        if isinstance(result, web.Response):
+            return result
+        return _compressed(request, _response(result))
+
+    async def health(self, request):
+        return web.json_response({'status': 'ok'})
+
+    async def ready(self, request):
+        status = startup.status()
+        return web.json_response(status, status=200 if status['ready'] else 503)
+
+    async def limits(self, request):
+        return web.json_response({name: limiter.stats() for name, limiter in self.limiters.items()})
+
+    async def metrics(self, request):
+        return web.Response(text=metrics.render(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def stats(self, stats, request):
+        return web.json_response(stats())
+
+    async def hotspots(self, request):
+        model = request.match_info['model']
+        table = tracer.hotspots(model)
+        table['timelines'] = tracer.timelines(model)
+        return web.json_response(table)
+
+    async def chrome_trace(self, request):
+        model = request.match_info['model']
+        try:
+            run = int(request.query.get('run', 0))
+        except ValueError:
+            run = 0
+        try:
+            trace = tracer.chrome_trace(model, run)
+        except ValueError as error:
+            return web.json_response({'error': str(error)}, status=404)
+        return web.Response(text=trace, content_type='application/json', headers={
+            'Content-Disposition': 'attachment; filename=%s-timeline.json' % model})
+
+    async def _shutdown(self, app):
+        self.executor.shutdown(wait=True)
+
+
+def _response(result):
+    """Converts the dictionary, or Flask Response, answered by T3S to an aiohttp response."""
+    if isinstance(result, web.Response):
+        return result
+    if isinstance(result, Response):
+        headers = {key: value for key, value in result.headers.items() if key.lower() != 'content-length'}
+        return web.Response(body=result.get_data(), status=result.status_code, headers=headers)
+    return web.json_response(result)
+
+
+def _compressed(request, response):
+    """Compresses a response with gzip when the client accepts it."""
+    options = config.RESPONSE_COMPRESSION
+    if options['enabled'] and response.body is not None and len(response.body) >= options['min_size'] \
+            and responses.accepts_gzip(request.headers.get('Accept-Encoding')):
+        response.enable_compression(web.ContentCoding.gzip)
+    return response
+
+
+def _bulk_tensors(model, content_type, body, version, outputs, response_format=None, lane=None):
+    try:
+        outputs = T3SBulk.check_request(model, version, outputs)
+    except ValueError as error:
+        return {'error': str(error)}
+    return T3SBulk.predict_tensors(model, content_type, body, version, outputs, response_format, lane)
+
+
+def _bulk_lines(model, body, version, outputs=None, lane=None):
+    try:
+        outputs = T3SBulk.check_request(model, version, outputs)
+        T3S.get_encoder(model, version)
+    except ValueError as error:
+        yield json.dumps({'error': str(error)}) + '\n'
+        return
+    rows = streaming.iter_json_rows(io.BytesIO(body))
+    yield from T3SBulk.stream_predictions(model, rows, version, outputs, lane)
+
+
+def _next_lines(lines, size):
+    """Joins the next lines of a response, up to a batch, or returns '' at its end."""
+    return ''.join(itertools.islice(lines, size))
+
+
+def _first_lines(lines, size):
+    """Starts computing a response of JSON lines, returning its first lines and the iterator over the other ones."""
+    lines = lines()
+    return _next_lines(lines, size), lines
+
+
+if __name__ == '__main__':
+    config.configure_app(app)
+    start_serving()
+    port = app.config['SERVER_NAME'].partition(':')[2]
+    web.run_app(Frontend().app, host='0.0.0.0', port=int(port or 5000))
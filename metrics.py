@@ -0,0 +1,244 @@
+"""
+T3S metrics.
+
+The time spent by each model in each stage of the requests processing (JSON
+parsing, features extraction, examples encoding, model runs and results
+formatting) is recorded in latency histograms, along with counters of the
+requests, examples and errors, and a histogram of the run batch sizes. The
+metrics are rendered in the Prometheus text format, see render().
+
+Recording a value must stay cheap enough to be left enabled in production: each
+thread records in its own shard, without any lock, and the shards are only
+summed up when the metrics are rendered. The shards of the finished threads,
+e.g. of the threads serving a single request, are folded into retired totals.
+
+The requests to models that do not exist are accounted under the UNKNOWN_MODEL
+label, so that they do not create new series without limit.
+"""
+
+import bisect
+import threading
+import time
+
+from registry import registry
+
+HISTOGRAM = 'histogram'
+COUNTER = 'counter'
+GAUGE = 'gauge'
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Label of the requests to models that do not exist
+UNKNOWN_MODEL = '(unknown)'
+
+# Number of shards above which the shards of the finished threads are folded
+_MIN_SWEEP = 64
+
+# Upper bounds of the batch size buckets
+SIZE_BUCKETS = tuple(2 ** i for i in range(13))
+
+# Type, help and buckets of each metric
+METRICS = {
+    't3s_stage_seconds': (HISTOGRAM, 'Time spent in each stage of the requests processing.', LATENCY_BUCKETS),
+    't3s_batch_size': (HISTOGRAM, 'Number of examples fed to each model run.', SIZE_BUCKETS),
+    't3s_queue_seconds': (HISTOGRAM, 'Time each model run waited for a run slot, by lane.', LATENCY_BUCKETS),
+    't3s_requests_total': (COUNTER, 'Number of prediction requests.', None),
+    't3s_examples_total': (COUNTER, 'Number of examples to predict.', None),
+    't3s_errors_total': (COUNTER, 'Number of invalid examples and failed requests.', None),
+}
+
+
+class Metrics(object):
+    """Per-thread sharded histograms and counters."""
+
+    def __init__(self):
+        self._local = threading.local()
+        # Thread and shard of each thread which recorded values
+        self._shards = []
+        # Sum of the shards of the finished threads
+        self._retired = {}
+        self._sweep_at = _MIN_SWEEP
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) > self._sweep_at:
+                    self._sweep()
+        return shard
+
+    def _sweep(self):
+        """Folds the shards of the finished threads into the retired totals. Must be called with the lock held."""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                _merge(self._retired, shard)
+        self._shards = alive
+        # Sweeping again once the shards doubled keeps the sweeps amortized
+        self._sweep_at = max(_MIN_SWEEP, 2 * len(alive))
+
+    def observe(self, name, labels, value):
+        """
+        Records a value in a histogram.
+
+        Args:
+            name: Name of the histogram, one of the METRICS keys.
+            labels: Tuple of the (label, value) pairs of the series.
+            value: The value to record.
+        """
+        shard = self._shard()
+        series = shard.get((name, labels))
+        buckets = METRICS[name][2]
+        if series is None:
+            # Counts of each bucket and of the +Inf one, then sum of the values
+            series = shard[(name, labels)] = [0] * (len(buckets) + 1) + [0.0]
+        series[bisect.bisect_left(buckets, value)] += 1
+        series[-1] += value
+
+    def increment(self, name, labels, value=1):
+        """
+        Increments a counter.
+
+        Args:
+            name: Name of the counter, one of the METRICS keys.
+            labels: Tuple of the (label, value) pairs of the series.
+            value: The increment.
+        """
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def count(self, name, model, value=1):
+        """
+        Increments the counter of a model.
+
+        Args:
+            name: Name of the counter, one of the METRICS keys.
+            model: Name of the model.
+            value: The increment.
+        """
+        self.increment(name, (('model', model),), value)
+
+    def stage(self, model, stage):
+        """
+        Times a stage of the requests processing.
+
+        Args:
+            model: Name of the model.
+            stage: Name of the stage, e.g. 'parse' or 'run'.
+
+        Returns:
+            A context manager recording the time spent in its block.
+        """
+        return _StageTimer(self, (('model', model), ('stage', stage)))
+
+    def collect(self):
+        """
+        Sums up the shards of all the threads.
+
+        Returns:
+            A dictionary that maps the (name, labels) of each series to its count,
+            or to its buckets counts and sum for histograms.
+        """
+        with self._lock:
+            self._sweep()
+            # The retired totals are only replaced, never updated in place
+            shards = [self._retired.copy()] + [shard for _, shard in self._shards]
+
+        totals = {}
+        for shard in shards:
+            _merge(totals, shard)
+        return totals
+
+    def render(self):
+        """
+        Renders the metrics, along with the load time, memory and load and
+        eviction counts of the models, in the Prometheus text format.
+        """
+        totals = self.collect()
+        lines = []
+        for name, (kind, description, buckets) in sorted(METRICS.items()):
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for (series_name, labels), value in sorted(totals.items()):
+                if series_name != name:
+                    continue
+                if kind != HISTOGRAM:
+                    lines.append('%s%s %s' % (name, _labels(labels), _number(value)))
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), value):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (name, _labels(labels + (('le', _number(bound)),)), cumulative))
+                lines.append('%s_sum%s %s' % (name, _labels(labels), _number(value[-1])))
+                lines.append('%s_count%s %d' % (name, _labels(labels), cumulative))
+
+        lines.append('# HELP t3s_model_load_seconds Time spent loading each loaded model.')
+        lines.append('# TYPE t3s_model_load_seconds %s' % GAUGE)
+        for loaded in registry.models():
+            labels = (('saved_model_dir', loaded.saved_model_dir), ('tag_set', loaded.tag_set))
+            lines.append('t3s_model_load_seconds%s %s' % (_labels(labels), _number(loaded.load_seconds)))
+
+        residency = registry.residency()
+        for name, kind, description, key in (
+                ('t3s_model_memory_bytes', GAUGE, 'Estimated memory of each loaded model.', 'memory_bytes'),
+                ('t3s_model_loads_total', COUNTER, 'Number of loads of each model.', 'loads'),
+                ('t3s_model_evictions_total', COUNTER, 'Number of evictions of each model.', 'evictions')):
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for model in residency['models']:
+                if kind == GAUGE and not model['loaded']:
+                    continue
+                labels = (('saved_model_dir', model['saved_model_dir']), ('tag_set', model['tag_set']))
+                lines.append('%s%s %s' % (name, _labels(labels), _number(model[key])))
+        return '\n'.join(lines) + '\n'
+
+
+def _merge(totals, shard):
+    """Adds the series of a shard to totals."""
+    # Copying a dictionary is atomic, unlike iterating over it
+    for key, value in shard.copy().items():
+        total = totals.get(key)
+        if isinstance(value, list):
+            totals[key] = list(value) if total is None else [a + b for a, b in zip(total, value)]
+        else:
+            totals[key] = value if total is None else total + value
+
+
+class _StageTimer(object):
+    __slots__ = ('metrics', 'labels', 'start')
+
+    def __init__(self, metrics, labels):
+        self.metrics = metrics
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe('t3s_stage_seconds', self.labels, time.perf_counter() - self.start)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels)
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Metrics of the whole server
+metrics = Metrics()
@@ -0,0 +1,628 @@
+"""
+T3S model sessions registry.
+
+Loading a SavedModel means reading the whole graph from disk and restoring its
+variables, which is far slower than running it. The registry loads each model
+once in its own graph and session and keeps it resident so that the following
+requests can reuse it.
+
+A TensorFlow session can safely be shared between threads to run the graph, so
+a single registry is shared by all the Flask requests.
+
+The signatures of a model are resolved once at load time into execution plans
+holding the tensor names to feed and fetch, so the requests do not need to
+parse the MetaGraphDef again. Plans live as long as their loaded model: they
+are only rebuilt when the model directory changes on disk, which refresh()
+detects, or when the model is explicitly unloaded.
+
+The requests running a model hold it through use(): unloading a model removes
+it from the registry right away, but only closes its session once these
+requests are drained.
+
+With a memory budget, see set_budget(), the registry keeps the estimated
+footprint of the loaded models under it by evicting the least recently used
+ones whenever a model is loaded. Pinned models are never evicted.
+
+The models set with set_artifacts() are loaded from an optimized graph of their
+'predict' signature cached on disk instead, see artifacts.py.
+"""
+
+import collections
+import contextlib
+import logging
+import os
+import threading
+import time
+
+import artifacts
+import features
+
+_logger = logging.getLogger(__name__)
+
+# TensorFlow is only imported when the first model is loaded, so that the server
+# starts quickly
+
+
+class SignaturePlan(object):
+    """Resolved feed and fetch tensors of a SignatureDef."""
+
+    def __init__(self, meta_graph_def, signature_def_key, graph):
+        """
+        Resolves the SignatureDef.
+
+        Args:
+            meta_graph_def: MetaGraphDef protocol buffer with the SignatureDef map.
+            signature_def_key: A SignatureDef key string.
+            graph: The graph the MetaGraphDef is loaded in.
+
+        Raises:
+            ValueError: When the SignatureDef key does not exist.
+        """
+        from tensorflow.contrib.saved_model.python.saved_model import signature_def_utils
+        from tensorflow.python.framework import dtypes
+        from tensorflow.python.framework import tensor_shape
+
+        signature_def = signature_def_utils.get_signature_def_by_key(
+            meta_graph_def, signature_def_key)
+
+        self.signature_def_key = signature_def_key
+        self.inputs_tensor_info = signature_def.inputs
+        self.outputs_tensor_info = signature_def.outputs
+
+        # Maps input keys to the tensor names session.run uses as feeds
+        self.feed_names = {
+            key: info.name for key, info in self.inputs_tensor_info.items()
+        }
+        self.input_dtypes = {
+            key: dtypes.as_dtype(info.dtype)
+            for key, info in self.inputs_tensor_info.items()
+        }
+        self.input_shapes = {
+            key: tensor_shape.TensorShape(info.tensor_shape)
+            for key, info in self.inputs_tensor_info.items()
+        }
+
+        # Sort to preserve order because we need to go from value to key later.
+        self.output_keys = sorted(self.outputs_tensor_info.keys())
+        self.fetch_names = [
+            self.outputs_tensor_info[key].name for key in self.output_keys
+        ]
+
+        # Compiled encoders of the inputs fed with serialized tf.Example, when
+        # their features schema can be inferred from the graph
+        self.encoders = {}
+        for key, dtype in self.input_dtypes.items():
+            if dtype == dtypes.string:
+                schema = features.infer_schema(graph, self.feed_names[key])
+                if schema is not None:
+                    self.encoders[key] = schema.compile()
+
+    def fetches(self, output_keys=None):
+        """
+        Gets the tensor names to fetch for some outputs.
+
+        Fetching only the needed outputs lets session.run skip the graph branches
+        computing the other ones.
+
+        Args:
+            output_keys: Sorted list of output keys, or None for all the outputs.
+
+        Returns:
+            A tuple with the sorted output keys and their tensor names.
+
+        Raises:
+            ValueError: When any of the output keys is not valid.
+        """
+        if output_keys is None:
+            return self.output_keys, self.fetch_names
+        for key in output_keys:
+            if key not in self.outputs_tensor_info:
+                raise ValueError(
+                    '"%s" is not a valid output key. Please choose from %s.' %
+                    (key, '"' + '", "'.join(self.output_keys) + '"'))
+        return output_keys, [self.outputs_tensor_info[key].name for key in output_keys]
+
+    def feed_dict(self, input_tensor_key_feed_dict):
+        """
+        Re-creates a feed_dict based on input tensor names instead of keys.
+
+        Args:
+            input_tensor_key_feed_dict: A dictionary that maps input keys to
+                numpy ndarrays.
+
+        Returns:
+            A dictionary that maps input tensor names to numpy ndarrays.
+
+        Raises:
+            ValueError: When any of the input tensor keys is not valid.
+        """
+        try:
+            return {
+                self.feed_names[key]: tensor
+                for key, tensor in input_tensor_key_feed_dict.items()
+            }
+        except KeyError as error:
+            raise ValueError(
+                '"%s" is not a valid input key. Please choose from %s.' %
+                (error.args[0], '"' + '", "'.join(self.feed_names.keys()) + '"'))
+
+
+    def check_tensors(self, tensors):
+        """
+        Checks numpy arrays against the dtypes and shapes of the signature inputs.
+
+        Args:
+            tensors: A dictionary that maps input keys to numpy arrays. A single
+                array mapped to the None key is fed to the only input of the
+                signature.
+
+        Returns:
+            A dictionary that maps input keys to the numpy arrays.
+
+        Raises:
+            ValueError: When the arrays do not match the signature inputs.
+        """
+        from tensorflow.python.framework import dtypes
+
+        if None in tensors:
+            if len(tensors) != 1 or len(self.feed_names) != 1:
+                raise ValueError(
+                    'A single tensor can only be given to a signature with a single '
+                    'input, please name your tensors after %s.' %
+                    ('"' + '", "'.join(self.feed_names.keys()) + '"'))
+            tensors = {next(iter(self.feed_names)): tensors[None]}
+
+        missing = [key for key in self.feed_names if key not in tensors]
+        if missing:
+            raise ValueError('Missing input tensor(s) "%s".' % '", "'.join(missing))
+
+        for key, tensor in tensors.items():
+            if key not in self.feed_names:
+                raise ValueError(
+                    '"%s" is not a valid input key. Please choose from %s.' %
+                    (key, '"' + '", "'.join(self.feed_names.keys()) + '"'))
+
+            dtype = self.input_dtypes[key]
+            if dtype == dtypes.string:
+                valid_dtype = tensor.dtype.kind == 'S'
+            else:
+                valid_dtype = tensor.dtype == dtype.as_numpy_dtype
+            if not valid_dtype:
+                raise ValueError('Input tensor "%s" must be of type %s, not %s.' %
+                                 (key, dtype.name, tensor.dtype))
+
+            if not self.input_shapes[key].is_compatible_with(tensor.shape):
+                raise ValueError('Input tensor "%s" must have a shape compatible with %s, not %s.' %
+                                 (key, self.input_shapes[key], tensor.shape))
+        return tensors
+
+
+class LoadedModel(object):
+    """A SavedModel loaded in its own graph and session."""
+
+    def __init__(self, saved_model_dir, tag_set, session_config=None, artifacts_dir=None):
+        """
+        Loads the SavedModel, or its optimized graph artifact.
+
+        Args:
+            saved_model_dir: Directory containing the SavedModel to load.
+            tag_set: Group of tag(s) of the MetaGraphDef to load, in string
+                format, separated by ','.
+            session_config: A dictionary with the ConfigProto fields of the
+                session, e.g. 'intra_op_parallelism_threads', or None for the
+                TensorFlow defaults.
+            artifacts_dir: Directory of the optimized graph artifacts, or None to
+                load the SavedModel itself.
+
+        Raises:
+            ValueError: When the session configuration is not valid, or the graph
+                of the SavedModel cannot be optimized.
+        """
+        from tensorflow.python.client import session
+        from tensorflow.python.framework import ops as ops_lib
+        from tensorflow.python.saved_model import loader
+
+        self.saved_model_dir = saved_model_dir
+        self.tag_set = tag_set
+        self.fingerprint = directory_fingerprint(saved_model_dir)
+        self.optimized = artifacts_dir is not None
+        self._active = 0
+        self._closing = False
+        self._idle = threading.Condition()
+        start = time.perf_counter()
+        self.graph = ops_lib.Graph()
+        self.session = session.Session(graph=self.graph, config=session_config_proto(session_config))
+        try:
+            if self.optimized:
+                self.meta_graph_def = artifacts.load(
+                    self.session, saved_model_dir, tag_set, self.fingerprint, artifacts_dir)
+            else:
+                self.meta_graph_def = loader.load(
+                    self.session, tag_set.split(','), saved_model_dir)
+        except Exception:
+            self.session.close()
+            raise
+
+        self.plans = {
+            key: SignaturePlan(self.meta_graph_def, key, self.graph)
+            for key in self.meta_graph_def.signature_def
+        }
+        self.load_seconds = time.perf_counter() - start
+        # The variables of the optimized graphs are frozen in their GraphDef
+        self.memory_bytes = memory_footprint(None if self.optimized else saved_model_dir,
+                                             self.meta_graph_def)
+        self.last_used = time.monotonic()
+
+    def plan(self, signature_def_key):
+        """
+        Gets the execution plan of a signature.
+
+        Args:
+            signature_def_key: A SignatureDef key string.
+
+        Returns:
+            The SignaturePlan.
+
+        Raises:
+            ValueError: When the SignatureDef key does not exist.
+        """
+        try:
+            return self.plans[signature_def_key]
+        except KeyError:
+            raise ValueError(
+                'Could not find signature "%s". Please choose from: %s' %
+                (signature_def_key, ', '.join(self.plans.keys())))
+
+    def acquire(self):
+        """
+        Marks the model as used by a request.
+
+        Returns:
+            True, or False if the model is being closed and must not be used.
+        """
+        with self._idle:
+            if self._closing:
+                return False
+            self._active += 1
+            self.last_used = time.monotonic()
+            return True
+
+    def release(self):
+        """Marks a request using the model as done."""
+        with self._idle:
+            self._active -= 1
+            if not self._active:
+                self._idle.notify_all()
+
+    def close(self):
+        """Waits for the requests using the model, then releases the session resources."""
+        with self._idle:
+            self._closing = True
+            while self._active:
+                self._idle.wait()
+        self.session.close()
+
+
+def session_config_proto(session_config):
+    """
+    Builds the ConfigProto of a session.
+
+    Args:
+        session_config: A dictionary with the ConfigProto fields, nested
+            messages being dictionaries too, or None.
+
+    Returns:
+        The ConfigProto, or None if session_config is None.
+
+    Raises:
+        ValueError: When a field does not exist or has a wrong type.
+    """
+    if session_config is None:
+        return None
+
+    from google.protobuf import json_format
+    from tensorflow.core.protobuf import config_pb2
+
+    try:
+        return json_format.ParseDict(session_config, config_pb2.ConfigProto())
+    except json_format.ParseError as error:
+        raise ValueError('The session configuration is not valid: %s' % error)
+
+
+def memory_footprint(saved_model_dir, meta_graph_def):
+    """
+    Estimates the memory held by a loaded SavedModel.
+
+    The variables restored in the session take as much memory as their
+    checkpoint files, and the graph about as much as its MetaGraphDef.
+
+    Args:
+        saved_model_dir: Directory containing the SavedModel, or None when its
+            variables are frozen in the graph.
+        meta_graph_def: The loaded MetaGraphDef.
+
+    Returns:
+        The estimated number of bytes.
+    """
+    footprint = meta_graph_def.ByteSize()
+    if saved_model_dir is None:
+        return footprint
+    variables_dir = os.path.join(saved_model_dir, 'variables')
+    if os.path.isdir(variables_dir):
+        footprint += sum(entry.stat().st_size for entry in os.scandir(variables_dir) if entry.is_file())
+    return footprint
+
+
+def directory_fingerprint(saved_model_dir):
+    """
+    Computes a cheap fingerprint of a SavedModel directory content.
+
+    Args:
+        saved_model_dir: Directory containing the SavedModel.
+
+    Returns:
+        A tuple with the modification times and sizes of the SavedModel files,
+        which changes when the model is exported again to the directory.
+    """
+    fingerprint = []
+    for directory in (saved_model_dir, os.path.join(saved_model_dir, 'variables')):
+        if not os.path.isdir(directory):
+            continue
+        for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+            if entry.is_file():
+                stat = entry.stat()
+                fingerprint.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+
+class ModelRegistry(object):
+    """Thread-safe registry of the loaded models, keyed by directory and tags."""
+
+    def __init__(self):
+        self._models = {}
+        self._load_locks = {}
+        self._lock = threading.Lock()
+        self._memory_budget = None
+        self._pinned = ()
+        self._artifacts_dir = None
+        self._optimized = ()
+        self._loads = collections.Counter()
+        self._evictions = collections.Counter()
+
+    @staticmethod
+    def _key(saved_model_dir, tag_set):
+        return (os.path.normpath(saved_model_dir), tag_set)
+
+    def set_budget(self, memory_budget, pinned=()):
+        """
+        Sets the memory budget of the loaded models.
+
+        Args:
+            memory_budget: Maximum estimated footprint in bytes of the loaded
+                models, or None for no limit.
+            pinned: Directories of the models never evicted, along with all their
+                subdirectories, i.e. their versions.
+        """
+        with self._lock:
+            self._memory_budget = memory_budget
+            self._pinned = tuple(os.path.normpath(directory) for directory in pinned)
+        self._evict()
+
+    def set_artifacts(self, artifacts_dir, optimized=()):
+        """
+        Sets the models loaded from their optimized graph artifact, see
+        artifacts.py. Only the models loaded afterwards are affected.
+
+        Args:
+            artifacts_dir: Directory of the artifacts.
+            optimized: Directories of the models loaded from their artifact, along
+                with all their subdirectories, i.e. their versions.
+        """
+        with self._lock:
+            self._artifacts_dir = artifacts_dir
+            self._optimized = tuple(os.path.normpath(directory) for directory in optimized)
+
+    @staticmethod
+    def _under(saved_model_dir, directories):
+        return any(
+            saved_model_dir == directory or saved_model_dir.startswith(directory + os.sep)
+            for directory in directories
+        )
+
+    def _is_pinned(self, saved_model_dir):
+        return self._under(saved_model_dir, self._pinned)
+
+    def _evict(self, loading=None):
+        """
+        Evicts the least recently used models until the loaded ones fit in the
+        memory budget.
+
+        Args:
+            loading: Key of the model just loaded, which is not evicted.
+        """
+        evicted = []
+        with self._lock:
+            if self._memory_budget is None:
+                return
+            footprint = sum(loaded.memory_bytes for loaded in self._models.values())
+            candidates = sorted(
+                (loaded.last_used, key) for key, loaded in self._models.items()
+                if key != loading and not self._is_pinned(key[0])
+            )
+            for _, key in candidates:
+                if footprint <= self._memory_budget:
+                    break
+                loaded = self._models.pop(key)
+                footprint -= loaded.memory_bytes
+                self._evictions[key] += 1
+                evicted.append(loaded)
+            if footprint > self._memory_budget:
+                _logger.warning('The loaded models take %d bytes, over the memory budget of %d bytes.',
+                                footprint, self._memory_budget)
+
+        # The requests using the evicted models are drained in the background, so
+        # that the request loading a model does not wait for them
+        for loaded in evicted:
+            _logger.info('Evicting model %s.', loaded.saved_model_dir)
+            thread = threading.Thread(target=loaded.close, name='t3s-evict')
+            thread.daemon = True
+            thread.start()
+
+    def get(self, saved_model_dir, tag_set, session_config=None):
+        """
+        Gets a loaded model, loading it on first use.
+
+        Concurrent first calls for the same model only load it once, and loading
+        a model does not block the requests to the models already loaded.
+
+        Args:
+            saved_model_dir: Directory containing the SavedModel.
+            tag_set: Group of tag(s) of the MetaGraphDef, separated by ','.
+            session_config: A dictionary with the ConfigProto fields of the
+                session, only used to load the model.
+
+        Returns:
+            The LoadedModel.
+        """
+        key = self._key(saved_model_dir, tag_set)
+        loaded = self._models.get(key)
+        if loaded is not None:
+            return loaded
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            loaded = self._models.get(key)
+            if loaded is None:
+                with self._lock:
+                    artifacts_dir = self._artifacts_dir if self._under(key[0], self._optimized) else None
+                loaded = LoadedModel(saved_model_dir, tag_set, session_config, artifacts_dir)
+                with self._lock:
+                    self._models[key] = loaded
+                    self._loads[key] += 1
+                self._evict(loading=key)
+        return loaded
+
+    @contextlib.contextmanager
+    def use(self, saved_model_dir, tag_set, session_config=None):
+        """
+        Gets a loaded model and keeps its session open while in use.
+
+        Args:
+            saved_model_dir: Directory containing the SavedModel.
+            tag_set: Group of tag(s) of the MetaGraphDef, separated by ','.
+            session_config: A dictionary with the ConfigProto fields of the
+                session, only used to load the model.
+
+        Yields:
+            The LoadedModel.
+        """
+        while True:
+            loaded = self.get(saved_model_dir, tag_set, session_config)
+            # A model being unloaded is already out of the registry
+            if loaded.acquire():
+                break
+        try:
+            yield loaded
+        finally:
+            loaded.release()
+
+    def unload(self, saved_model_dir, tag_set=None):
+        """
+        Closes and forgets a model so that it is reloaded from disk on next use.
+
+        The model is forgotten right away, but its session is only closed once
+        the requests using it are done.
+
+        Args:
+            saved_model_dir: Directory containing the SavedModel.
+            tag_set: Group of tag(s) to unload. If None, all the loaded tag-sets
+                of the model are unloaded.
+
+        Returns:
+            The number of unloaded sessions.
+        """
+        saved_model_dir = os.path.normpath(saved_model_dir)
+        with self._lock:
+            keys = [
+                key for key in self._models
+                if key[0] == saved_model_dir and tag_set in (None, key[1])
+            ]
+            unloaded = [self._models.pop(key) for key in keys]
+
+        for loaded in unloaded:
+            loaded.close()
+        return len(unloaded)
+
+    def refresh(self):
+        """
+        Unloads the models whose directory changed on disk since they were loaded,
+        so that they are loaded again with new plans on next use.
+
+        Returns:
+            The list of (directory, tag-set) of the unloaded models.
+        """
+        with self._lock:
+            models = list(self._models.items())
+
+        changed = [
+            key for key, loaded in models
+            if directory_fingerprint(loaded.saved_model_dir) != loaded.fingerprint
+        ]
+        for saved_model_dir, tag_set in changed:
+            self.unload(saved_model_dir, tag_set)
+        return changed
+
+    def close(self):
+        """Closes all the loaded sessions."""
+        with self._lock:
+            unloaded = list(self._models.values())
+            self._models.clear()
+
+        for loaded in unloaded:
+            loaded.close()
+
+    def loaded(self):
+        """Returns the list of (directory, tag-set) of the loaded models."""
+        with self._lock:
+            return list(self._models.keys())
+
+    def models(self):
+        """Returns the list of the LoadedModel."""
+        with self._lock:
+            return list(self._models.values())
+
+    def residency(self):
+        """
+        Describes the models loaded so far.
+
+        Returns:
+            A dictionary with the memory budget, the estimated footprint of the
+            loaded models, and the list of the models loaded so far with their
+            directory, tag-set, whether they are loaded, pinned and optimized, their
+            estimated footprint, and their load and eviction counts.
+        """
+        with self._lock:
+            models = []
+            for key in sorted(self._loads):
+                loaded = self._models.get(key)
+                models.append({
+                    'saved_model_dir': key[0],
+                    'tag_set': key[1],
+                    'loaded': loaded is not None,
+                    'pinned': self._is_pinned(key[0]),
+                    'optimized': loaded is not None and loaded.optimized,
+                    'memory_bytes': 0 if loaded is None else loaded.memory_bytes,
+                    'loads': self._loads[key],
+                    'evictions': self._evictions[key],
+                })
+            return {
+                'memory_budget': self._memory_budget,
+                'memory_bytes': sum(model['memory_bytes'] for model in models),
+                'models': models,
+            }
+
+
+# Registry shared by the whole server
+registry = ModelRegistry()
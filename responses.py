@@ -0,0 +1,195 @@
+"""
+T3S response formats.
+
+By default the predictions are answered as a JSON dictionary with an 'exN-res'
+key per example. For large batches, building this dictionary one example at a
+time dominates the request processing, so the client may instead ask, through
+the Accept header of the request, for the whole outputs arrays serialized at
+once:
+    - 'application/x-t3s-columns+json': a JSON array of the predictions, or a
+    JSON dictionary with the array of each requested output,
+    - 'application/x-npy': a .npy array of the predictions, or of the single
+    requested output,
+    - 'application/x-npz': a .npz archive with the array of each requested
+    output, or the 'predictions' array,
+    - 'application/x-t3s-float32': the raw little-endian float32 values of the
+    predictions, or of the single requested output, whose shape is given by the
+    X-T3S-Shape header.
+
+Responses are also compressed with gzip when the client accepts it, see
+compress().
+"""
+
+import gzip
+import io
+import json
+
+import numpy as np
+
+import config
+import tensors
+
+JSON = 'application/json'
+JSON_COLUMNS = 'application/x-t3s-columns+json'
+NPY = tensors.NPY
+NPZ = tensors.NPZ
+FLOAT32 = 'application/x-t3s-float32'
+
+COLUMNAR_FORMATS = (JSON_COLUMNS, NPY, NPZ, FLOAT32)
+
+SHAPE_HEADER = 'X-T3S-Shape'
+
+
+def _accepted(header):
+    """Parses an Accept or Accept-Encoding header into a dictionary that maps each value to its quality."""
+    accepted = {}
+    for item in (header or '').split(','):
+        value, _, parameters = item.partition(';')
+        value = value.strip().lower()
+        if not value:
+            continue
+        quality = 1.0
+        for parameter in parameters.split(';'):
+            name, _, number = parameter.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        accepted[value] = quality
+    return accepted
+
+
+def negotiate(accept):
+    """
+    Chooses the format of a response.
+
+    Args:
+        accept: The Accept header of the request, or None.
+
+    Returns:
+        The preferred one of the COLUMNAR_FORMATS, or None for the default JSON
+        dictionary, which wins ties and wildcards.
+    """
+    accepted = _accepted(accept)
+    best, best_quality = None, accepted.get(JSON, 0.0)
+    for mimetype in COLUMNAR_FORMATS:
+        quality = accepted.get(mimetype, 0.0)
+        if quality > best_quality:
+            best, best_quality = mimetype, quality
+    return best
+
+
+def accepts_gzip(accept_encoding):
+    """Tells whether the Accept-Encoding header of a request accepts gzip."""
+    accepted = _accepted(accept_encoding)
+    return accepted.get('gzip', accepted.get('*', 0.0)) > 0
+
+
+def jsonable(value):
+    """Converts a numpy array, scalar or bytes to JSON-serializable values."""
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind in 'OS':
+            return [jsonable(item) for item in value] if value.ndim else jsonable(value.item())
+        return value.tolist()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def columns(predictions):
+    """
+    Stacks the predictions of the examples.
+
+    Args:
+        predictions: The list of the prediction of each example, or of the
+            dictionary with its rows of the requested outputs.
+
+    Returns:
+        The array of the predictions, or a dictionary that maps the output keys
+        to their array.
+    """
+    if not len(predictions):
+        return np.zeros(0, np.float32)
+    if isinstance(predictions[0], dict):
+        return {
+            key: np.asarray([prediction[key] for prediction in predictions])
+            for key in predictions[0]
+        }
+    return np.asarray(predictions)
+
+
+def _single(columns, mimetype):
+    if not isinstance(columns, dict):
+        return columns
+    if len(columns) != 1:
+        raise ValueError('The "%s" format holds a single output, please request a single one, or use "%s".' %
+                         (mimetype, NPZ))
+    return next(iter(columns.values()))
+
+
+def _without_objects(array):
+    # TensorFlow returns the string outputs as arrays of bytes objects, which
+    # could only be read back from .npy files by unpickling them
+    if array.dtype.hasobject:
+        return array.astype(np.bytes_)
+    return array
+
+
+def encode(columns, mimetype):
+    """
+    Serializes the predictions arrays.
+
+    Args:
+        columns: The array of the predictions, or a dictionary that maps output
+            keys to their array, see columns().
+        mimetype: The format, one of COLUMNAR_FORMATS.
+
+    Returns:
+        The bytes of the response, and the dictionary of its extra headers.
+
+    Raises:
+        ValueError: When the arrays cannot be written in the format.
+    """
+    if mimetype == JSON_COLUMNS:
+        if isinstance(columns, dict):
+            return json.dumps({key: jsonable(array) for key, array in columns.items()}).encode(), {}
+        return json.dumps(jsonable(columns)).encode(), {}
+
+    if mimetype == NPZ:
+        if not isinstance(columns, dict):
+            columns = {'predictions': columns}
+        output = io.BytesIO()
+        np.savez(output, **{key: _without_objects(array) for key, array in columns.items()})
+        return output.getvalue(), {}
+
+    array = _without_objects(_single(columns, mimetype))
+    if mimetype == NPY:
+        output = io.BytesIO()
+        np.save(output, array)
+        return output.getvalue(), {}
+
+    if array.dtype.kind not in 'biuf':
+        raise ValueError('Only numeric outputs can be written as "%s".' % mimetype)
+    body = np.ascontiguousarray(array, dtype='<f4').tobytes()
+    return body, {SHAPE_HEADER: ','.join(str(dim) for dim in array.shape)}
+
+
+def compress(body, accept_encoding):
+    """
+    Compresses the body of a response with gzip, when the client accepts it and
+    the body is large enough to be worth it.
+
+    Args:
+        body: The bytes of the response.
+        accept_encoding: The Accept-Encoding header of the request, or None.
+
+    Returns:
+        The compressed bytes, or None if the body is not compressed.
+    """
+    options = config.RESPONSE_COMPRESSION
+    if not options['enabled'] or len(body) < options['min_size'] or not accepts_gzip(accept_encoding):
+        return None
+    return gzip.compress(body, options['level'])
@@ -0,0 +1,208 @@
+"""
+T3S inference scheduling.
+
+All the models share the same CPUs, so a model flooded with large batches would
+otherwise starve the latency-sensitive requests to the other models. Every model
+run first takes one of the 'run_slots' of the scheduler:
+    - a model runs at most 'run_quota' batches at the same time,
+    - the slots are shared between the models waiting for one by weighted fair
+    queuing: each run is charged its number of examples divided by the
+    'run_weight' of its model, and the run with the lowest start tag goes
+    first, so that each busy model gets its share of the slots,
+    - the runs of the 'high' lane, chosen by the X-T3S-Priority header or the
+    /_t3s/priority/ routes, go before all the runs of the 'normal' lane, but at most
+    'high_burst' of them in a row while normal runs wait, after which a normal
+    run goes first, so that a flood of high priority requests cannot starve
+    the normal lane.
+
+Both the slots and the quotas are unlimited by default, so that the runs are
+only ordered once they are set.
+
+The time spent waiting for a slot is recorded for each model and lane apart from
+the run time, see metrics.
+"""
+
+import collections
+import contextlib
+import threading
+import time
+
+import config
+from metrics import metrics
+
+HIGH = 'high'
+NORMAL = 'normal'
+
+# Lanes from the most to the least urgent
+LANES = (HIGH, NORMAL)
+
+PRIORITY_HEADER = 'X-T3S-Priority'
+
+
+def lane(priority):
+    """
+    Gets the lane of a request.
+
+    Args:
+        priority: The X-T3S-Priority header of the request, or None.
+
+    Returns:
+        HIGH if the priority is 'high', NORMAL otherwise.
+    """
+    return HIGH if priority is not None and priority.strip().lower() == HIGH else NORMAL
+
+
+class _Run(object):
+    __slots__ = ('start', 'sequence', 'admitted')
+
+    def __init__(self, start, sequence):
+        self.start = start
+        self.sequence = sequence
+        self.admitted = False
+
+
+class _ModelState(object):
+    """Runs of a model, running and waiting in each lane."""
+
+    def __init__(self, quota, weight):
+        self.quota = quota
+        self.weight = weight
+        self.running = 0
+        self.waiting = {name: collections.deque() for name in LANES}
+        # Finish tag of the last run queued in each lane
+        self.finish = dict.fromkeys(LANES, 0.0)
+        self.admitted = collections.Counter()
+
+
+class Scheduler(object):
+    """Weighted fair scheduler of the model runs, with per-model quotas and priority lanes."""
+
+    def __init__(self, run_slots=None, high_burst=None):
+        """
+        Args:
+            run_slots: Maximum number of model runs at the same time, or None for
+                no limit.
+            high_burst: Maximum number of runs of the high lane admitted in a row
+                while runs of the normal lane wait, or None for no limit.
+        """
+        self.run_slots = run_slots
+        self.high_burst = high_burst
+        self._models = {}
+        self._running = 0
+        # Runs of the high lane admitted in a row while normal runs waited
+        self._high_streak = 0
+        self._virtual_time = 0.0
+        self._sequence = 0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self, model, run_lane, cost, quota=None, weight=1):
+        """
+        Waits for a slot to run a batch through a model.
+
+        Args:
+            model: Name of the model.
+            run_lane: Lane of the run, one of LANES.
+            cost: Number of examples of the batch.
+            quota: Maximum number of runs of the model at the same time, or None
+                for no limit.
+            weight: Share of the slots of the model relative to the other ones.
+
+        Yields:
+            Once the batch can run, until it is done.
+        """
+        arrival = time.perf_counter()
+        with self._cond:
+            state = self._models.get(model)
+            if state is None:
+                state = self._models[model] = _ModelState(quota, weight)
+            state.quota = quota
+            state.weight = weight
+
+            start = max(self._virtual_time, state.finish[run_lane])
+            state.finish[run_lane] = start + max(cost, 1) / float(weight)
+            self._sequence += 1
+            run = _Run(start, self._sequence)
+            state.waiting[run_lane].append(run)
+
+            self._dispatch()
+            while not run.admitted:
+                self._cond.wait()
+        metrics.observe('t3s_queue_seconds', (('model', model), ('lane', run_lane)),
+                        time.perf_counter() - arrival)
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                state.running -= 1
+                self._running -= 1
+                self._dispatch()
+
+    def _dispatch(self):
+        """Admits the next runs while slots are free. Must be called with the lock held."""
+        admitted = False
+        while self.run_slots is None or self._running < self.run_slots:
+            lanes = LANES
+            if self.high_burst is not None and self._high_streak >= self.high_burst:
+                lanes = tuple(reversed(LANES))
+            best = None
+            for run_lane in lanes:
+                for state in self._models.values():
+                    if not state.waiting[run_lane]:
+                        continue
+                    if state.quota is not None and state.running >= state.quota:
+                        continue
+                    run = state.waiting[run_lane][0]
+                    if best is None or (run.start, run.sequence) < (best[0].start, best[0].sequence):
+                        best = (run, state, run_lane)
+                if best is not None:
+                    break
+            if best is None:
+                break
+
+            run, state, run_lane = best
+            if run_lane == HIGH and any(other.waiting[NORMAL] for other in self._models.values()):
+                self._high_streak += 1
+            else:
+                self._high_streak = 0
+            state.waiting[run_lane].popleft()
+            state.running += 1
+            state.admitted[run_lane] += 1
+            self._running += 1
+            self._virtual_time = max(self._virtual_time, run.start)
+            run.admitted = admitted = True
+
+        if admitted:
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Gets the scheduler statistics.
+
+        Returns:
+            A dictionary with the number of slots, the high lane burst and the
+            number of running batches, and for
+            each model its quota, weight, running batches, and the number of
+            batches waiting and admitted so far in each lane.
+        """
+        with self._cond:
+            return {
+                'run_slots': self.run_slots,
+                'high_burst': self.high_burst,
+                'running': self._running,
+                'models': {
+                    model: {
+                        'quota': state.quota,
+                        'weight': state.weight,
+                        'running': state.running,
+                        'waiting': {name: len(state.waiting[name]) for name in LANES},
+                        'admitted': {name: state.admitted[name] for name in LANES},
+                    }
+                    for model, state in self._models.items()
+                },
+            }
+
+
+# Scheduler of the model runs of the whole server
+scheduler = Scheduler(config.SCHEDULING['run_slots'], config.SCHEDULING['high_burst'])
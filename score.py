@@ -0,0 +1,322 @@
+"""
+T3S offline scoring.
+
+Scores a whole file of examples with a model of TF_MODELS['dir'], through the
+same features extraction, tf.Example encoding and model runs as the server,
+without going through HTTP. The examples are read from a CSV or JSONL file as
+they are scored, by batches of 'batch_size' examples, and their results are
+appended to a JSONL output file with one line per example, as for the bulk
+predictions: either its 'exN-res' result or an 'exN-error' message. The cells of
+the CSV files are typed after the features schema of the model, see
+typed_rows().
+
+The batches can be scored by several processes, each loading its own session of
+the model, while the results are still written in the input order.
+
+After each batch written, the number of scored examples is saved to a
+checkpoint file next to the output file. An interrupted run started again with
+the same arguments resumes after the last written batch, and the checkpoint is
+removed once the whole input is scored.
+
+Run it from the T3S folder with, e.g.:
+`python score.py model1 emails.csv scores.jsonl --column email --processes 4`
+"""
+
+import argparse
+import collections
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import config
+import streaming
+from features import FLOAT, STRING
+from t3s import T3S, T3SBulk
+from versions import versions
+
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+
+def read_rows(path, input_format=None, column=None, extracted=False):
+    """
+    Reads the examples of an input file, as they are scored.
+
+    Args:
+        path: Path of the CSV or JSONL file.
+        input_format: 'csv' or 'jsonl', guessed from the file extension when None.
+        column: Column of the CSV files holding the strings to extract the
+            features from, the first one by default.
+        extracted: Whether the model computes its features with an extractor,
+            in which case each example is a string.
+
+    Yields:
+        Each example, as a dictionary of features or a string to extract them
+        from, in the same form as for the bulk predictions.
+
+    Raises:
+        ValueError: When the file is not valid.
+    """
+    if input_format is None:
+        input_format = _guess_format(path)
+
+    if input_format == 'jsonl':
+        with open(path, 'rb') as input_file:
+            yield from streaming.iter_json_rows(input_file)
+        return
+
+    with open(path, newline='', encoding='utf-8') as input_file:
+        reader = csv.DictReader(input_file)
+        if extracted:
+            if column is None:
+                column = reader.fieldnames[0] if reader.fieldnames else None
+            elif column not in (reader.fieldnames or ()):
+                raise ValueError('Column "%s" is not in %s.' % (column, path))
+            for row in reader:
+                yield row[column] or ''
+            return
+        # Empty cells are left out so the model uses the default value
+        for row in reader:
+            yield {name: value for name, value in row.items() if value not in ('', None)}
+
+
+def _guess_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def _cell(value, kind):
+    # Cells which cannot be converted are left as strings, for the encoder to
+    # reject their row
+    casts = () if kind == STRING else (float,) if kind == FLOAT else (int, float)
+    for cast in casts:
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+def typed_rows(model, rows, version=None):
+    """
+    Types the cells of CSV rows, which are all strings.
+
+    The features of the schema of the model are converted to their type, and
+    the other ones, or all of them when the schema is not known, to an int or a
+    float when they read as one, as JSON values would be.
+
+    Args:
+        model: Name of the model.
+        rows: List of dictionaries of features read from a CSV file.
+        version: Number of the version of the model, or None for its current
+            version.
+
+    Returns:
+        The list of the dictionaries of typed features.
+    """
+    encoder = T3S.get_encoder(model, version)
+    schema = {} if encoder is None else encoder.schema.features
+    return [{name: _cell(value, schema.get(name)) for name, value in row.items()} for row in rows]
+
+
+class Checkpoint(object):
+    """Progress of a scoring run, saved next to its output file."""
+
+    def __init__(self, output_path, run):
+        """
+        Args:
+            output_path: Path of the output file.
+            run: Dictionary describing the run, which must match the saved one to
+                resume it.
+        """
+        self.path = output_path + CHECKPOINT_SUFFIX
+        self.run = run
+
+    def load(self):
+        """
+        Reads the saved progress.
+
+        Returns:
+            The number of examples scored and the size in bytes of their results
+            in the output file, or (0, 0) if there is no progress to resume.
+        """
+        try:
+            with open(self.path) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+        except (OSError, ValueError):
+            return 0, 0
+        if saved.get('run') != self.run:
+            return 0, 0
+        return saved['rows'], saved['output_bytes']
+
+    def save(self, rows, output_bytes):
+        """Saves the progress, atomically."""
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as checkpoint_file:
+            json.dump({'run': self.run, 'rows': rows, 'output_bytes': output_bytes}, checkpoint_file)
+        os.replace(temporary_path, self.path)
+
+    def remove(self):
+        """Removes the saved progress once the run is done."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _configure(model, batch_size, models_dir=None):
+    # Every batch is run at once, without waiting for other requests
+    if models_dir is not None:
+        config.TF_MODELS['dir'] = os.path.join(models_dir, '')
+    options = config.TF_MODELS['options'].setdefault(model, {})
+    options.update({'max_batch_size': batch_size, 'batching': False})
+
+
+def score_batch(model, rows, offset, version=None, outputs=None, csv_features=False):
+    """
+    Scores a batch of examples.
+
+    Args:
+        model: Name of the model.
+        rows: List of examples, as dictionaries of features or strings.
+        offset: Index of the first example in the input.
+        version: Number of the version of the model, or None for its current
+            version.
+        outputs: Sorted tuple of the keys of the outputs to compute, or None for
+            the default predictions.
+        csv_features: Whether the examples are dictionaries of features read
+            from a CSV file, to type with typed_rows().
+
+    Returns:
+        The newline-delimited JSON lines of the results.
+    """
+    if csv_features:
+        rows = typed_rows(model, rows, version)
+    return ''.join(T3SBulk.stream_predictions(model, rows, version, outputs, offset=offset))
+
+
+def _score_task(task):
+    return score_batch(*task)
+
+
+def score(model, input_path, output_path, input_format=None, column=None, batch_size=10000,
+          processes=1, version=None, outputs=None):
+    """
+    Scores a file of examples, resuming the previous run if it was interrupted.
+
+    Args:
+        model: Name of the model.
+        input_path: Path of the CSV or JSONL input file.
+        output_path: Path of the JSONL output file.
+        input_format: 'csv' or 'jsonl', guessed from the file extension when None.
+        column: Column of the CSV files holding the strings to extract the
+            features from.
+        batch_size: Number of examples scored at once.
+        processes: Number of processes scoring the batches.
+        version: Number of the version of the model, or None for its current
+            version.
+        outputs: Comma-separated keys of the outputs to return, or None for the
+            default predictions.
+
+    Returns:
+        The number of examples scored by this run.
+
+    Raises:
+        ValueError: When the model, the outputs or the input are not valid.
+    """
+    _configure(model, batch_size)
+    versions.model_dir(model, version)
+    if processes <= 1:
+        outputs = T3S.parse_outputs(model, outputs, version)
+    elif outputs:
+        # The model is only loaded by the worker processes
+        outputs = tuple(sorted(set(key for key in outputs.split(',') if key)))
+    else:
+        outputs = None
+
+    checkpoint = Checkpoint(output_path, {
+        'model': model, 'version': version, 'outputs': outputs and list(outputs), 'input': os.path.abspath(input_path),
+        'input_size': os.path.getsize(input_path), 'batch_size': batch_size,
+    })
+    done, output_bytes = checkpoint.load()
+    if done:
+        print('Resuming after %d examples.' % done, file=sys.stderr)
+
+    extracted = model in config.TF_MODELS['extractors']
+    csv_features = (input_format or _guess_format(input_path)) == 'csv' and not extracted
+    rows = read_rows(input_path, input_format, column, extracted)
+    rows = itertools.islice(rows, done, None)
+    tasks = (
+        (model, batch, done + index * batch_size, version, outputs, csv_features)
+        for index, batch in enumerate(streaming.chunks(rows, batch_size))
+    )
+
+    pool = None
+    if processes > 1:
+        # Spawned workers do not inherit any TensorFlow state
+        pool = multiprocessing.get_context('spawn').Pool(
+            processes, initializer=_configure, initargs=(model, batch_size, config.TF_MODELS['dir']))
+
+    scored = 0
+    start = time.perf_counter()
+    mode = 'r+b' if output_bytes and os.path.exists(output_path) else 'wb'
+    try:
+        with open(output_path, mode) as output_file:
+            # Forget the results written after the checkpoint
+            output_file.seek(output_bytes)
+            output_file.truncate()
+
+            # Keep every process busy, without reading the whole input ahead
+            pending = collections.deque()
+            for task in itertools.chain(tasks, [None]):
+                if task is not None:
+                    if pool is None:
+                        pending.append((len(task[1]), score_batch(*task)))
+                    else:
+                        pending.append((len(task[1]), pool.apply_async(_score_task, (task,))))
+                while pending and (task is None or len(pending) > 2 * processes - 1):
+                    count, result = pending.popleft()
+                    lines = result if pool is None else result.get()
+                    output_file.write(lines.encode('utf-8'))
+                    output_file.flush()
+                    scored += count
+                    checkpoint.save(done + scored, output_file.tell())
+                    print('%d examples scored, %.0f examples/s.' %
+                          (done + scored, scored / (time.perf_counter() - start)), file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    checkpoint.remove()
+    return scored
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('model', help='name of the model')
+    parser.add_argument('input', help='CSV or JSONL file of the examples')
+    parser.add_argument('output', help='JSONL file of the results')
+    parser.add_argument('--format', choices=['csv', 'jsonl'],
+                        help='format of the input, guessed from its extension by default')
+    parser.add_argument('--column', help='CSV column of the strings to extract the features from, '
+                        'the first one by default')
+    parser.add_argument('--batch-size', type=int, default=10000, help='number of examples scored at once')
+    parser.add_argument('--processes', type=int, default=1, help='number of processes scoring the batches')
+    parser.add_argument('--version', type=int, help='version of the model, the current one by default')
+    parser.add_argument('--outputs', help='comma-separated outputs of the model to return')
+    parser.add_argument('--models-dir', help='directory of the models, TF_MODELS["dir"] by default')
+    args = parser.parse_args()
+
+    if args.models_dir is not None:
+        config.TF_MODELS['dir'] = os.path.join(args.models_dir, '')
+    try:
+        scored = score(args.model, args.input, args.output, args.format, args.column, args.batch_size,
+                       args.processes, args.version, args.outputs)
+    except ValueError as error:
+        print('Error: %s' % error, file=sys.stderr)
+        sys.exit(1)
+    print('Scored %d examples to %s.' % (scored, args.output), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+T3S pre-fork production server.
+
+The Flask development server runs a single process, whose threads all share
+the same interpreter lock and the same models sessions. The production server
+binds the listening socket once, then forks 'workers' processes which accept
+the connections from it, each with its own models sessions. Models are only
+loaded by the workers, after the fork, since TensorFlow does not support being
+forked once initialized.
+
+With 'cpu_affinity', the CPUs available to the server are split between the
+workers and each worker is pinned to its share, so that the thread pools of
+their TensorFlow sessions, sized after the CPUs they can run on, do not compete
+for the same cores.
+
+A worker that dies is replaced. SIGTERM or SIGINT stop the workers gracefully:
+each worker stops accepting connections, waits up to 'shutdown_timeout' seconds
+for the requests it is processing to finish, then releases its models. The
+threads of the idle keep-alive connections are not waited for. A worker whose
+requests are still being processed after 'shutdown_timeout' only flushes what
+must not be lost, then exits without releasing the models its requests use. The
+workers still alive 'shutdown_grace' seconds later are killed by the master.
+"""
+
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+
+_logger = logging.getLogger(__name__)
+
+
+def cpu_shares(workers):
+    """
+    Splits the CPUs available to the process between workers.
+
+    Args:
+        workers: Number of workers.
+
+    Returns:
+        A list with the set of CPUs of each worker. With fewer CPUs than workers,
+        each worker gets a single CPU, shared with other workers.
+    """
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < workers:
+        return [{cpus[i % len(cpus)]} for i in range(workers)]
+    share, extra = divmod(len(cpus), workers)
+    shares = []
+    start = 0
+    for i in range(workers):
+        end = start + share + (1 if i < extra else 0)
+        shares.append(set(cpus[start:end]))
+        start = end
+    return shares
+
+
+class InFlightRequests(object):
+    """WSGI middleware counting the requests being processed, to wait for them on shutdown."""
+
+    def __init__(self, app):
+        self.app = app
+        self._count = 0
+        self._idle = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self._idle:
+            self._count += 1
+        try:
+            result = self.app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        # Streamed responses are only done once the server closes them
+        return ClosingIterator(result, self._done)
+
+    def _done(self):
+        with self._idle:
+            self._count -= 1
+            if not self._count:
+                self._idle.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the requests being processed to finish.
+
+        Args:
+            timeout: Maximum time to wait in seconds, or None for no limit.
+
+        Returns:
+            True if they finished, False if some are still being processed.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._count, timeout)
+
+
+class PreforkServer(object):
+    """Master process forking and supervising the WSGI workers."""
+
+    def __init__(self, app, host, port, workers, cpu_affinity=False, on_start=None, shutdown_timeout=None,
+                 shutdown_grace=10, on_abort=None):
+        """
+        Args:
+            app: The WSGI application.
+            host: Address to listen on.
+            port: Port to listen on.
+            workers: Number of worker processes.
+            cpu_affinity: Whether to pin each worker to its share of the CPUs.
+            on_start: Function called by each worker before serving, to start its
+                background services.
+            shutdown_timeout: Maximum time in seconds a stopped worker waits for
+                its requests to finish, or None for no limit.
+            shutdown_grace: Time in seconds a stopped worker gets after
+                shutdown_timeout to exit, before it is killed.
+            on_abort: Function called by a worker whose requests did not finish
+                within shutdown_timeout, with the time in seconds it may take,
+                before the worker exits without running its exit handlers.
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.on_start = on_start
+        self.shutdown_timeout = shutdown_timeout
+        self.shutdown_grace = shutdown_grace
+        self.on_abort = on_abort
+        self.cpus = cpu_shares(workers) if cpu_affinity else [None] * workers
+
+        self._socket = None
+        self._pids = {}
+        self._stopping = False
+        self._kill_at = None
+
+    def serve(self):
+        """Binds the socket and runs the workers until the server is stopped."""
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(socket.SOMAXCONN)
+        self._socket.set_inheritable(True)
+        _logger.info('Listening on %s:%d with %d workers.', self.host, self.port, self.workers)
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        for index in range(self.workers):
+            self._spawn(index)
+
+        while self._pids:
+            if self._kill_at is not None and time.monotonic() >= self._kill_at:
+                self._kill(signal.SIGKILL)
+                self._kill_at = None
+            try:
+                # Polls, since a blocking wait is resumed after the signal handlers
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            if not pid:
+                time.sleep(0.1)
+                continue
+            index = self._pids.pop(pid, None)
+            if index is not None and not self._stopping:
+                _logger.warning('Worker %d exited with status %d, replacing it.', pid, status)
+                # Do not spin when the workers fail right away
+                time.sleep(1)
+                self._spawn(index)
+
+        self._socket.close()
+
+    def _stop(self, signum, frame):
+        if not self._stopping and self.shutdown_timeout is not None:
+            self._kill_at = time.monotonic() + self.shutdown_timeout + self.shutdown_grace
+        self._stopping = True
+        self._kill(signal.SIGTERM)
+
+    def _kill(self, signum):
+        for pid in list(self._pids):
+            if signum == signal.SIGKILL:
+                _logger.warning('Worker %d did not stop in time, killing it.', pid)
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid:
+            self._pids[pid] = index
+            return
+
+        # Worker process
+        code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            if self.cpus[index] is not None:
+                os.sched_setaffinity(0, self.cpus[index])
+            if self.on_start is not None:
+                self.on_start()
+
+            # The request threads are daemon threads, which would be killed on exit
+            in_flight = InFlightRequests(self.app)
+            server = make_server(self.host, self.port, in_flight, threaded=True,
+                                 fd=self._socket.fileno())
+            # shutdown() waits for serve_forever() to return, so it cannot run
+            # on the serving thread
+            signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(
+                target=server.shutdown).start())
+            server.serve_forever()
+            if not in_flight.wait(self.shutdown_timeout):
+                _logger.warning('Worker %d stopped with requests still being processed.', os.getpid())
+                self._abort()
+        except Exception:
+            _logger.exception('Worker %d failed.', os.getpid())
+            code = 1
+        # Run the exit handlers registered by the worker
+        sys.exit(code)
+
+    def _abort(self):
+        """Exits a worker right away, since its exit handlers would wait for the requests still being processed."""
+        try:
+            if self.on_abort is not None:
+                self.on_abort(self.shutdown_grace / 2)
+        except Exception:
+            _logger.exception('Worker %d failed to abort.', os.getpid())
+        logging.shutdown()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(1)
+
+
+def serve(app, host, port, workers, cpu_affinity=False, on_start=None, shutdown_timeout=None,
+          shutdown_grace=10, on_abort=None):
+    """
+    Serves a WSGI application with pre-forked worker processes.
+
+    Args:
+        app: The WSGI application.
+        host: Address to listen on.
+        port: Port to listen on.
+        workers: Number of worker processes.
+        cpu_affinity: Whether to pin each worker to its share of the CPUs.
+        on_start: Function called by each worker before serving.
+        shutdown_timeout: Maximum time in seconds a stopped worker waits for its
+            requests to finish, or None for no limit.
+        shutdown_grace: Time in seconds a stopped worker gets after
+            shutdown_timeout to exit, before it is killed.
+        on_abort: Function called by a worker whose requests did not finish
+            within shutdown_timeout, with the time in seconds it may take.
+    """
+    PreforkServer(app, host, port, workers, cpu_affinity, on_start, shutdown_timeout,
+                  shutdown_grace, on_abort).serve()
@@ -0,0 +1,104 @@
+"""
+T3S startup preloading and warm-up.
+
+Without preloading, each model is only loaded by its first request, and the
+first runs of a fresh session are slower still while TensorFlow allocates its
+buffers and picks its kernels. At startup, the models found in the subfolders
+of TF_MODELS['dir'] are loaded in the background instead, in their latest
+version, in parallel when TF_MODELS['preload_workers'] is above 1, and warmed
+up.
+
+The server answers as soon as it starts: the readiness status only turns ready
+once every model was loaded and warmed up, or failed to.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from registry import registry
+from versions import ADMIN_PREFIX, versions
+from warmup import warm_up
+
+LOADING = 'loading'
+READY = 'ready'
+
+_logger = logging.getLogger(__name__)
+
+
+def discover_models():
+    """
+    Lists the models of the models directory.
+
+    Returns:
+        The sorted names of the non-hidden subfolders of TF_MODELS['dir'], but
+        the reserved versions.ADMIN_PREFIX.
+    """
+    models_dir = config.TF_MODELS['dir']
+    if not models_dir or not os.path.isdir(models_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(models_dir)
+        if not name.startswith('.') and name != ADMIN_PREFIX and os.path.isdir(os.path.join(models_dir, name))
+    )
+
+
+class Startup(object):
+    """Background preloading and warm-up of all the models."""
+
+    def __init__(self):
+        self._status = {}
+        self._ready = False
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Starts preloading the models in a background thread."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name='t3s-startup')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def run(self):
+        """Loads and warms up all the models, then flags the server as ready."""
+        models = discover_models()
+        with self._lock:
+            for model in models:
+                self._status[model] = LOADING
+
+        workers = max(1, config.TF_MODELS.get('preload_workers', 1))
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(self._preload, models))
+
+        with self._lock:
+            self._ready = True
+
+    def _preload(self, model):
+        try:
+            # The session is not closed by an eviction while warming up
+            with registry.use(versions.model_dir(model), "serve",
+                              config.get_model_option(model, 'session_config')) as loaded:
+                warm_up(model, loaded)
+            status = READY
+        except Exception as error:
+            _logger.exception('Could not preload model "%s".', model)
+            status = 'failed: %s' % error
+
+        with self._lock:
+            self._status[model] = status
+
+    def status(self):
+        """Returns whether the server is ready, and the preloading status of each model."""
+        with self._lock:
+            return {
+                'ready': self._ready or self._thread is None,
+                'models': dict(self._status),
+            }
+
+
+# Startup of the whole server
+startup = Startup()
@@ -0,0 +1,152 @@
+"""
+T3S streaming helpers.
+
+Parse JSON rows incrementally from a request body, so that large bodies never
+need to be held in memory as a whole. The body can either be a JSON array of
+rows or newline-delimited JSON (one row per line).
+"""
+
+import codecs
+import json
+
+# Size in bytes of the chunks read from the body
+READ_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+
+
+def _text_chunks(stream, read_size):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        data = stream.read(read_size)
+        if not data:
+            break
+        yield decoder.decode(data)
+    yield decoder.decode(b'', final=True)
+
+
+def iter_json_rows(stream, read_size=READ_SIZE):
+    """
+    Parses JSON rows from a binary stream, as they arrive.
+
+    Args:
+        stream: Binary file-like object to read the body from.
+        read_size: Size in bytes of the chunks read from the stream.
+
+    Yields:
+        Each row of the JSON array, or each JSON line.
+
+    Raises:
+        ValueError: An error when the body is not a JSON array nor
+            newline-delimited JSON.
+    """
+    decoder = json.JSONDecoder()
+    chunks = _text_chunks(stream, read_size)
+    buffer = ''
+    position = 0
+    exhausted = False
+
+    def read_more():
+        # Forget the parsed rows along the way
+        nonlocal buffer, position, exhausted
+        for chunk in chunks:
+            if chunk:
+                buffer = buffer[position:] + chunk
+                position = 0
+                return True
+        exhausted = True
+        return False
+
+    # Detect the body format from its first character
+    while not buffer.lstrip(_WHITESPACE) and read_more():
+        pass
+    buffer = buffer.lstrip(_WHITESPACE)
+    if not buffer:
+        return
+
+    if buffer[0] != '[':
+        # Newline-delimited JSON
+        line_number = 0
+        while True:
+            lines = buffer.split('\n')
+            buffer = lines.pop()
+            for line in lines:
+                line_number += 1
+                if line.strip(_WHITESPACE):
+                    yield _loads(line, line_number)
+            if not read_more():
+                break
+        if buffer.strip(_WHITESPACE):
+            yield _loads(buffer, line_number + 1)
+        return
+
+    # JSON array
+    position = 1
+    expect_row = True
+    count = 0
+    while True:
+        # Skip whitespace and separators
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            if position < len(buffer) or not read_more():
+                break
+        if position >= len(buffer):
+            raise ValueError('The JSON array of the body is not closed.')
+
+        if buffer[position] == ']':
+            if expect_row and count:
+                raise ValueError('Unexpected "," before the end of the JSON array.')
+            return
+        if not expect_row:
+            if buffer[position] != ',':
+                raise ValueError('Expected "," between the rows of the JSON array.')
+            position += 1
+            expect_row = True
+            continue
+
+        try:
+            row, end = decoder.raw_decode(buffer, position)
+        except json.decoder.JSONDecodeError as error:
+            # The row may not be complete yet
+            if read_more():
+                continue
+            raise ValueError('Invalid JSON row in the body: %s' % error)
+        if isinstance(row, (int, float)) and not isinstance(row, bool) and \
+                (end == len(buffer) or buffer[end] not in _WHITESPACE + ',]') and \
+                not exhausted and read_more():
+            # A number row may not be complete yet
+            continue
+
+        yield row
+        count += 1
+        expect_row = False
+        position = end
+
+
+def _loads(line, line_number):
+    try:
+        return json.loads(line)
+    except json.decoder.JSONDecodeError as error:
+        raise ValueError('Invalid JSON in line %d of the body: %s' % (line_number, error))
+
+
+def chunks(rows, size):
+    """
+    Groups rows in lists of at most size rows.
+
+    Args:
+        rows: Iterable of rows.
+        size: Maximum number of rows in a chunk.
+
+    Yields:
+        Lists of consecutive rows.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
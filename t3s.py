@@ -1,23 +1,49 @@
+from flask import Response, has_request_context, request, stream_with_context
 from flask_restful import Resource
 
-import tensorflow as tf
 import numpy as np
+import collections
+import functools
 import json
+import multiprocessing
+import threading
 
 import os
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 
-from tensorflow.python.tools import saved_model_utils
-from tensorflow.contrib.saved_model.python.saved_model import signature_def_utils
-from tensorflow.python.client import session
-from tensorflow.python.framework import ops as ops_lib
-from tensorflow.python.saved_model import loader
-from tensorflow.python.debug.wrappers import local_cli_wrapper
-
+import archive
 import config
+import responses
+from cache import MISSING, caches, example_key
+from metrics import UNKNOWN_MODEL, metrics
+import scheduling
+import streaming
+import tensors
+from batching import batcher
+from features import FeatureSchema
+from registry import registry
+from scheduling import scheduler
+from tracing import tracer
+from versions import label, versions
+
+# TensorFlow is only imported on first use, so that the server starts and
+# answers the light routes quickly
+
+# Per-thread reusable protocol buffers
+_local = threading.local()
+
+# Compiled encoders of the models with a declared features schema
+_declared_encoders = {}
+
+# Guards the creation of the extraction and fan-out pools
+_extractors_lock = threading.Lock()
+
+# Pool running the models of the fan-out requests, created on first use
+_fanout_executor = None
 
 class T3S(Resource):
 
-    def get(self, model, data_input):
+    def get(self, model, data_input, version=None, outputs=None, response_format=None, lane=None):
         """
         Processes the given input to predict results from the TensorFlow model
         for one or multiple examples.
@@ -31,17 +57,63 @@ class T3S(Resource):
         of JSON dictionaries with the features of the model as keys, and the
         pre-computed features values foreach example.
 
+        All the examples are fed to the model in a single run, or in several runs
+        of at most 'max_batch_size' examples for the largest requests. When the
+        'batching' option is set, these runs are merged with the ones of the
+        concurrent requests to the same model.
+
+        By default, the result of each example is its probability of the class 1
+        in the 'probabilities' output of the model. When the 'outputs' query
+        parameter names outputs of the model, only these outputs are computed,
+        and the result of each example is a dictionary with its rows of these
+        outputs.
+
+        The results are answered as a dictionary with a key per example, unless
+        the Accept header of the request asks for one of the columnar formats of
+        the responses module.
+
+        The runs of the request go through the 'high' scheduling lane, ahead of
+        the other requests, when the request has a 'X-T3S-Priority: high' header
+        or comes through the /_t3s/priority/ routes.
+
         Args:
+            model: Name of the model.
             input: String containing the examples to process.
+            version: Number of the version of the model to use, or None for its
+                current version.
+            outputs: Comma-separated keys of the outputs to return, read from the
+                query string when None.
+            response_format: One of responses.COLUMNAR_FORMATS, negotiated from
+                the Accept header when None.
+            lane: Scheduling lane of the request, one of scheduling.LANES, read
+                from the X-T3S-Priority header when None.
 
         Returns:
-            A dictionary that contains the prediction results.
+            A dictionary that contains the prediction results, or a Response with
+            their arrays in the columnar format.
         """
+        if has_request_context():
+            if outputs is None:
+                outputs = request.args.get('outputs')
+            if response_format is None:
+                response_format = responses.negotiate(request.headers.get('Accept'))
+            if lane is None:
+                lane = scheduling.lane(request.headers.get(scheduling.PRIORITY_HEADER))
+        try:
+            versions.model_dir(model, version)
+            outputs = T3S.parse_outputs(model, outputs, version)
+        except ValueError as error:
+            count_failed_request(model)
+            return {'error': str(error)}
+        metrics.count('t3s_requests_total', model)
+
         # If no features extraction file is given, expect direct JSON data
         if model not in config.TF_MODELS['extractors']:
             try:
-                inputs = json.loads(data_input)
+                with metrics.stage(model, 'parse'):
+                    inputs = json.loads(data_input)
             except json.decoder.JSONDecodeError:
+                metrics.count('t3s_errors_total', model)
                 return {
                     'error': '"%s" is not valid data. Please enter JSON-formatted data to represent your features.' % (data_input)
                 }
@@ -50,31 +122,413 @@ class T3S(Resource):
                 inputs = [inputs]
         # Else expect a string and extract features with the extracting file
         else:
-            inputs = config.TF_MODELS['extractors'][model].extract(data_input)
+            with metrics.stage(model, 'extract'):
+                inputs = config.TF_MODELS['extractors'][model].extract(data_input)
             if None in inputs:
+                metrics.count('t3s_errors_total', model)
                 return {
                     'error': '"%s" is not valid data. ' % (data_input) + \
                         config.TF_MODELS['extractors'][model].error_formatting()
                 }
+        metrics.count('t3s_examples_total', model, len(inputs))
+
+        # Cast and process examples, with the features schema of the model if it
+        # is known
+        try:
+            pending = T3S.submit_inputs(model, inputs, version, outputs, lane=lane)
+            if response_format is not None:
+                feature_chances = pending.columns()
+            else:
+                feature_chances = pending.result()
+        except ValueError as error:
+            metrics.count('t3s_errors_total', model)
+            return {
+                'error': '"%s" is not valid data. %s' % (data_input, error)
+            }
+        except Exception:
+            metrics.count('t3s_errors_total', model)
+            raise
+
+        if response_format is not None:
+            try:
+                return T3S.columnar_response(model, feature_chances, response_format)
+            except ValueError as error:
+                metrics.count('t3s_errors_total', model)
+                return {'error': str(error)}
 
-        # Cast and process examples
-        json_result = {}
-        for i, parsed_json in enumerate(inputs):
-            model_input = T3S.preprocess_input_examples_arg_string('examples=['+json.dumps(parsed_json)+']')
-            model_dir = config.TF_MODELS['dir'] + model + '/'
-            feature_chance = T3S.run_saved_model_with_feed_dict(model_dir, "serve", "predict", model_input, './', True)
-            json_result['ex' + str(i) + '-res'] = np.float64(feature_chance)
+        with metrics.stage(model, 'format'):
+            json_result = {}
+            for i, feature_chance in enumerate(feature_chances):
+                json_result['ex' + str(i) + '-res'] = T3S.format_result(feature_chance)
 
         return json_result
 
+    @staticmethod
+    def parse_outputs(model, outputs, version=None):
+        """
+        Parses and checks the outputs requested from a model.
+
+        Args:
+            model: Name of the model.
+            outputs: Comma-separated output keys, or None.
+            version: Number of the version of the model, or None for its current
+                version.
+
+        Returns:
+            The sorted tuple of the output keys, or None if no output is requested.
+
+        Raises:
+            ValueError: When any of the output keys is not valid, or when no
+                output is requested from a model without a default prediction,
+                see _default_predictions().
+        """
+        if not outputs:
+            plan = T3S.load(model, version).plan("predict")
+            if "probabilities" not in plan.outputs_tensor_info and len(plan.output_keys) != 1:
+                raise ValueError('Model "%s" has no "probabilities" output, please choose the outputs to compute '
+                                 'among %s with the "outputs" parameter.' %
+                                 (model, '"' + '", "'.join(plan.output_keys) + '"'))
+            return None
+        outputs = tuple(sorted(set(key for key in outputs.split(',') if key)))
+        T3S.load(model, version).plan("predict").fetches(outputs)
+        return outputs
+
+    @staticmethod
+    def format_result(result):
+        """
+        Converts the result of an example to JSON-serializable values.
+
+        Args:
+            result: The prediction of the example, or a dictionary with its rows
+                of the requested outputs.
+
+        Returns:
+            The prediction as a float, or a dictionary that maps the output keys
+            to lists, numbers or strings.
+        """
+        if not isinstance(result, dict):
+            return np.float64(result)
+        return {key: responses.jsonable(value) for key, value in result.items()}
+
+    @staticmethod
+    def columnar_response(model, columns, response_format):
+        """
+        Serializes the results of the examples in a columnar format.
+
+        Args:
+            model: Name of the model.
+            columns: The array of the predictions, or a dictionary that maps the
+                output keys to their array, see responses.columns().
+            response_format: One of responses.COLUMNAR_FORMATS.
+
+        Returns:
+            The Response.
+
+        Raises:
+            ValueError: When the results cannot be written in the format.
+        """
+        with metrics.stage(model, 'format'):
+            body, headers = responses.encode(columns, response_format)
+        return Response(body, mimetype=response_format, headers=headers)
+
+    @staticmethod
+    def submit_inputs(model, inputs, version=None, outputs=None, examples=None, lane=None):
+        """
+        Encodes and submits examples features to a model.
+
+        When the 'cache' option of the model is set, the examples whose prediction
+        is cached are not submitted.
+
+        Args:
+            model: Name of the model.
+            inputs: List of dictionaries that contain the examples features.
+            version: Number of the version of the model, or None for its current
+                version.
+            outputs: Sorted tuple of the keys of the outputs to compute, or None
+                for the default predictions.
+            examples: The list of the inputs serialized as tf.Example, when they
+                are already encoded.
+            lane: Scheduling lane of the runs, one of scheduling.LANES, or None
+                for the normal lane.
+
+        Returns:
+            A _PendingPredictions whose result() is the list of the computed
+            prediction, or rows of the outputs, for each example.
+
+        Raises:
+            ValueError: An error when the features do not match the model.
+        """
+        if not config.get_model_option(model, 'cache'):
+            if examples is None:
+                examples = T3S.encode(model, inputs, version)
+            return _PendingPredictions(T3S.submit(model, examples, version, outputs, lane))
+
+        cache = caches.cache(
+            _name(model, version, outputs), T3S.load(model, version).fingerprint,
+            config.get_model_option(model, 'cache_size'),
+            config.get_model_option(model, 'cache_ttl'))
+        keys = [example_key(features) for features in inputs]
+        cached = cache.get_many(keys)
+        missing = [i for i, value in enumerate(cached) if value is MISSING]
+
+        if examples is None:
+            missing_examples = T3S.encode(model, [inputs[i] for i in missing], version)
+        else:
+            missing_examples = [examples[i] for i in missing]
+        futures = T3S.submit(model, missing_examples, version, outputs, lane)
+        return _PendingPredictions(futures, cache, keys, cached, missing)
+
+    @staticmethod
+    def encode(model, inputs, version=None):
+        """
+        Encodes examples features for a model.
+
+        Args:
+            model: Name of the model.
+            inputs: List of dictionaries that contain the examples features.
+            version: Number of the version of the model, or None for its current
+                version.
+
+        Returns:
+            The list of serialized tf.Example.
+
+        Raises:
+            ValueError: An error when the features do not match the model.
+        """
+        encoder = T3S.get_encoder(model, version)
+        with metrics.stage(model, 'encode'):
+            if encoder is not None:
+                return encoder.encode(inputs)
+            return T3S.create_examples(inputs)
+
+    @staticmethod
+    def submit(model, examples, version=None, outputs=None, lane=None):
+        """
+        Submits serialized examples to a model, by batches of at most max_batch_size.
+
+        When the 'batching' option of the model is set, the batches are merged with
+        the ones of the concurrent requests to the same model in the same lane,
+        unless the model has too many batching queues, see batching.py, otherwise
+        they are run right away.
+
+        Args:
+            model: Name of the model.
+            examples: List of serialized tf.Example.
+            version: Number of the version of the model, or None for its current
+                version, resolved when each batch is run.
+            outputs: Sorted tuple of the keys of the outputs to compute, or None
+                for the default predictions.
+            lane: Scheduling lane of the runs, one of scheduling.LANES, or None
+                for the normal lane.
+
+        Returns:
+            The list of the concurrent.futures.Future of each batch results.
+        """
+        batch_size = config.get_model_option(model, 'max_batch_size')
+        batches = [examples[start:start + batch_size] for start in range(0, len(examples), batch_size)]
+        if config.get_model_option(model, 'batching'):
+            futures = batcher.submit(
+                model,
+                _name(model, version, outputs, lane),
+                functools.partial(T3S.run_examples, model, version=version, outputs=outputs, lane=lane),
+                batch_size,
+                config.get_model_option(model, 'batch_timeout'),
+                batches)
+            # The model has too many queues already
+            if futures is not None:
+                return futures
+
+        futures = []
+        for batch in batches:
+            future = Future()
+            try:
+                future.set_result(T3S.run_examples(model, batch, version, outputs, lane))
+            except Exception as error:
+                future.set_exception(error)
+            futures.append(future)
+        return futures
+
+    @staticmethod
+    def predict(model, examples, version=None):
+        """
+        Runs serialized examples through a model.
+
+        Args:
+            model: Name of the model.
+            examples: List of serialized tf.Example.
+            version: Number of the version of the model, or None for its current
+                version.
+
+        Returns:
+            The list of the computed prediction for each example.
+        """
+        return [
+            result
+            for future in T3S.submit(model, examples, version)
+            for result in future.result()
+        ]
+
+    @staticmethod
+    def get_encoder(model, version=None):
+        """
+        Gets the compiled features encoder of a model.
+
+        The features schema declared in the 'features' option of the model takes
+        precedence over the one inferred from its graph.
+
+        Args:
+            model: Name of the model.
+            version: Number of the version of the model, or None for its current
+                version.
+
+        Returns:
+            The SchemaEncoder of the model, or None if its features schema is not
+            known.
+        """
+        declared = config.get_model_option(model, 'features')
+        if declared is not None:
+            encoder = _declared_encoders.get(model)
+            if encoder is None:
+                encoder = _declared_encoders[model] = FeatureSchema(declared).compile()
+            return encoder
+
+        return T3S.load(model, version).plan("predict").encoders.get('examples')
+
+    @staticmethod
+    def load(model, version=None):
+        """
+        Gets the loaded 'serve' graph of a model, loading it with the
+        'session_config' option of the model on first use.
+
+        Args:
+            model: Name of the model.
+            version: Number of the version of the model, or None for its current
+                version.
+
+        Returns:
+            The LoadedModel.
+        """
+        return registry.get(versions.model_dir(model, version), "serve",
+                            config.get_model_option(model, 'session_config'))
+
+    @staticmethod
+    def run_examples(model, examples, version=None, outputs=None, lane=None):
+        """
+        Runs a batch of serialized examples through a model.
+
+        Args:
+            model: Name of the model.
+            examples: List of serialized tf.Example.
+            version: Number of the version of the model, or None for its current
+                version.
+            outputs: Sorted tuple of the keys of the outputs to compute, or None
+                for the default predictions.
+            lane: Scheduling lane of the runs, one of scheduling.LANES, or None
+                for the normal lane.
+
+        Returns:
+            An array with the computed prediction for each example, or the list
+            of its rows of the outputs.
+        """
+        return T3S.run_inputs(model, {'examples': examples}, version, outputs, lane)
+
+    @staticmethod
+    def run_inputs(model, input_tensor_key_feed_dict, version=None, outputs=None, lane=None):
+        """
+        Runs a batch of inputs through the 'predict' signature of a model, once
+        the scheduler gives it a slot. A 'trace_rate' fraction of the runs are
+        traced, see tracing.py.
+
+        Args:
+            model: Name of the model.
+            input_tensor_key_feed_dict: A dictionary that maps input keys to numpy
+                ndarrays or lists.
+            version: Number of the version of the model, or None for its current
+                version.
+            outputs: Sorted tuple of the keys of the outputs to compute, or None
+                for the default predictions.
+            lane: Scheduling lane of the runs, one of scheduling.LANES, or None
+                for the normal lane.
+
+        Returns:
+            An array with the computed prediction for each example, or the list
+            of its rows of the outputs.
+        """
+        model_dir = versions.model_dir(model, version)
+        archive_model = model if config.get_model_option(model, 'archive_outputs') else None
+        batch_size = 1
+        for tensor in input_tensor_key_feed_dict.values():
+            if np.ndim(tensor):
+                batch_size = len(tensor)
+                metrics.observe('t3s_batch_size', (('model', model),), batch_size)
+                break
+        run_options, run_metadata = tracer.start(model)
+        with scheduler.slot(model, lane or scheduling.NORMAL, batch_size,
+                            config.get_model_option(model, 'run_quota'),
+                            config.get_model_option(model, 'run_weight')):
+            with metrics.stage(model, 'run'):
+                result = T3S.run_saved_model_with_feed_dict(model_dir, "serve", "predict", input_tensor_key_feed_dict,
+                                                            None, False, archive_model=archive_model,
+                                                            session_config=config.get_model_option(model, 'session_config'),
+                                                            output_keys=outputs, run_options=run_options,
+                                                            run_metadata=run_metadata)
+        if run_metadata is not None:
+            tracer.record(model, run_metadata)
+        return result
+
+    @staticmethod
+    def run_tensors(model, input_tensors, version=None, outputs=None, lane=None):
+        """
+        Runs numpy arrays through the 'predict' signature of a model, by batches of
+        at most max_batch_size rows.
+
+        Args:
+            model: Name of the model.
+            input_tensors: A dictionary that maps input keys to numpy arrays, see
+                SignaturePlan.check_tensors().
+            version: Number of the version of the model, or None for its current
+                version.
+            outputs: Sorted tuple of the keys of the outputs to compute, or None
+                for the default predictions.
+            lane: Scheduling lane of the runs, one of scheduling.LANES, or None
+                for the normal lane.
+
+        Returns:
+            The list of the computed prediction for each row.
+
+        Raises:
+            ValueError: When the arrays do not match the signature inputs.
+        """
+        plan = T3S.load(model, version).plan("predict")
+        input_tensors = plan.check_tensors(input_tensors)
+
+        # Arrays are only split when they all have the same rows count
+        rows_counts = set(len(tensor) if tensor.ndim else None for tensor in input_tensors.values())
+        if len(rows_counts) != 1 or None in rows_counts:
+            return list(T3S.run_inputs(model, input_tensors, version, outputs, lane))
+
+        rows_count = rows_counts.pop()
+        batch_size = config.get_model_option(model, 'max_batch_size')
+        results = []
+        for start in range(0, rows_count, batch_size):
+            batch = {key: tensor[start:start + batch_size] for key, tensor in input_tensors.items()}
+            results.extend(T3S.run_inputs(model, batch, version, outputs, lane))
+        return results
 
     def run_saved_model_with_feed_dict(saved_model_dir, tag_set, signature_def_key,
                                        input_tensor_key_feed_dict, outdir,
-                                       overwrite_flag, tf_debug=False):
+                                       overwrite_flag, tf_debug=False,
+                                       archive_model=None, session_config=None,
+                                       output_keys=None, run_options=None, run_metadata=None):
       """Runs SavedModel and fetch all outputs.
       Runs the input dictionary through the MetaGraphDef within a SavedModel
       specified by the given tag_set and SignatureDef. Also save the outputs to file
-      if outdir is not None.
+      if outdir is not None, or queue them in the output archive if archive_model
+      is not None.
+
+      The SavedModel is only loaded on the first call, its session and the execution
+      plan of its signature are then kept in the models registry and reused by the
+      following calls.
 
       Args:
         saved_model_dir: Directory containing the SavedModel to execute.
@@ -90,75 +544,80 @@ class T3S(Resource):
         tf_debug: A boolean flag to use TensorFlow Debugger (TFDBG) to observe the
             intermediate Tensor values and runtime GraphDefs while running the
             SavedModel.
+        archive_model: Name of the model under which to archive the outputs
+            asynchronously, or None not to archive them.
+        session_config: A dictionary with the ConfigProto fields of the session
+            created when the SavedModel is loaded, e.g.
+            'intra_op_parallelism_threads'.
+        output_keys: Sorted list of the keys of the outputs to fetch, the graph
+            branches computing the other outputs being skipped. If None, all the
+            outputs are fetched.
+        run_options: RunOptions of the run, e.g. to trace it, or None.
+        run_metadata: RunMetadata filled by the run with its trace, or None.
 
       Returns:
-        An strings with the computed prediction for the input.
+        An array with the computed prediction for each input example or, when
+        output_keys is not None, the list of the dictionaries mapping each output
+        key to the row of the output of each input example.
 
       Raises:
-        ValueError: When any of the input tensor keys is not valid.
+        ValueError: When any of the input tensor keys is not valid, or when
+            output_keys is None and the signature has neither a "probabilities"
+            output nor a single output with a number per example.
         RuntimeError: An error when output file already exists and overwrite is not
             enabled.
       """
-      result_string = ''
-
-      # Get a list of output tensor names.
-      meta_graph_def = saved_model_utils.get_meta_graph_def(saved_model_dir, tag_set)
-
-      # Re-create feed_dict based on input tensor name instead of key as session.run
-      # uses tensor name.
-      inputs_tensor_info = T3S._get_inputs_tensor_info_from_meta_graph_def(meta_graph_def, signature_def_key)
-
-      # Check if input tensor keys are valid.
-      for input_key_name in input_tensor_key_feed_dict.keys():
-        if input_key_name not in inputs_tensor_info.keys():
-          raise ValueError(
-              '"%s" is not a valid input key. Please choose from %s, or use '
-              '--show option.' %
-              (input_key_name, '"' + '", "'.join(inputs_tensor_info.keys()) + '"'))
-
-      inputs_feed_dict = {
-          inputs_tensor_info[key].name: tensor
-          for key, tensor in input_tensor_key_feed_dict.items()
-      }
-      # Get outputs
-      outputs_tensor_info = T3S._get_outputs_tensor_info_from_meta_graph_def(meta_graph_def, signature_def_key)
-      # Sort to preserve order because we need to go from value to key later.
-      output_tensor_keys_sorted = sorted(outputs_tensor_info.keys())
-      output_tensor_names_sorted = [
-          outputs_tensor_info[tensor_key].name
-          for tensor_key in output_tensor_keys_sorted
-      ]
-
-      with session.Session(graph=ops_lib.Graph()) as sess:
-        loader.load(sess, tag_set.split(','), saved_model_dir)
+      result = []
+
+      # The session is kept open until the run is done, even if the model is
+      # unloaded meanwhile
+      with registry.use(saved_model_dir, tag_set, session_config) as loaded:
+        plan = loaded.plan(signature_def_key)
+
+        # Re-create feed_dict based on input tensor name instead of key as
+        # session.run uses tensor name, checking the input tensor keys are valid.
+        inputs_feed_dict = plan.feed_dict(input_tensor_key_feed_dict)
+
+        sess = loaded.session
 
         if tf_debug:
+          from tensorflow.python.debug.wrappers import local_cli_wrapper
           sess = local_cli_wrapper.LocalCLIDebugWrapperSession(sess)
 
-        outputs = sess.run(output_tensor_names_sorted, feed_dict=inputs_feed_dict)
+        fetched_keys, fetch_names = plan.fetches(output_keys)
+        outputs = sess.run(fetch_names, feed_dict=inputs_feed_dict,
+                           options=run_options, run_metadata=run_metadata)
+
+      if archive_model is not None:
+        archive.get_archive().put(archive_model, dict(zip(fetched_keys, outputs)))
 
-        for i, output in enumerate(outputs):
-          output_tensor_key = output_tensor_keys_sorted[i]
-          if output_tensor_key == "probabilities" :
-            feature_chance = output[0][1]
-            result_string = feature_chance
+      if output_keys is not None:
+        result = _output_rows(dict(zip(fetched_keys, outputs)), input_tensor_key_feed_dict)
 
-          # Only save if outdir is specified.
-          if outdir:
-            # Create directory if outdir does not exist
-            if not os.path.isdir(outdir):
-              os.makedirs(outdir)
-            output_full_path = os.path.join(outdir, output_tensor_key + '.npy')
+      if output_keys is None and "probabilities" not in fetched_keys:
+        result = _default_predictions(dict(zip(fetched_keys, outputs)))
 
-            # If overwrite not enabled and file already exist, error out
-            if not overwrite_flag and os.path.exists(output_full_path):
-              raise RuntimeError(
-                  'Output file %s already exists. Add \"--overwrite\" to overwrite'
-                  ' the existing output files.' % output_full_path)
+      for output_tensor_key, output in zip(fetched_keys, outputs):
+        if output_tensor_key == "probabilities" and output_keys is None:
+          feature_chances = output[:, 1]
+          result = feature_chances
 
-            np.save(output_full_path, output)
+        # Only save if outdir is specified.
+        if outdir:
+          # Create directory if outdir does not exist
+          if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+          output_full_path = os.path.join(outdir, output_tensor_key + '.npy')
 
-        return result_string
+          # If overwrite not enabled and file already exist, error out
+          if not overwrite_flag and os.path.exists(output_full_path):
+            raise RuntimeError(
+                'Output file %s already exists. Add \"--overwrite\" to overwrite'
+                ' the existing output files.' % output_full_path)
+
+          np.save(output_full_path, output)
+
+      return result
 
     @staticmethod
     def _get_inputs_tensor_info_from_meta_graph_def(meta_graph_def,
@@ -175,6 +634,7 @@ class T3S(Resource):
       Returns:
         A dictionary that maps input tensor keys to TensorInfos.
       """
+      from tensorflow.contrib.saved_model.python.saved_model import signature_def_utils
       return signature_def_utils.get_signature_def_by_key(meta_graph_def,
                                                           signature_def_key).inputs
 
@@ -193,6 +653,7 @@ class T3S(Resource):
       Returns:
         A dictionary that maps output tensor keys to TensorInfos.
       """
+      from tensorflow.contrib.saved_model.python.saved_model import signature_def_utils
       return signature_def_utils.get_signature_def_by_key(meta_graph_def,
                                                           signature_def_key).outputs
 
@@ -263,6 +724,8 @@ class T3S(Resource):
       Returns:
         A byte-string to represent the serialized example data.
       """
+      import tensorflow as tf
+
       # Cast features in TensorFlow types
       features = {}
       for f_name, f_val in example_dict.items():
@@ -273,6 +736,67 @@ class T3S(Resource):
       # Serialize to string
       return example.SerializeToString()
 
+    @staticmethod
+    def create_examples(example_dicts):
+        """
+        Creates serialized tf.Example from a list of feature dictionaries.
+
+        Unlike preprocess_input_examples_arg_string(), the dictionaries are encoded
+        directly instead of going through a string of Python expressions, and a
+        single tf.Example protocol buffer is reused by each thread for all of them.
+
+        Args:
+            example_dicts: List of dictionaries that contain the examples features.
+
+        Returns:
+            The list of serialized tf.Example.
+
+        Raises:
+            ValueError: An error when an example is not a dictionary or one of its
+                values type is not supported.
+        """
+        example = getattr(_local, 'example', None)
+        if example is None:
+            import tensorflow as tf
+            example = _local.example = tf.train.Example()
+
+        examples = []
+        for example_dict in example_dicts:
+            if not isinstance(example_dict, dict):
+                raise ValueError(
+                    'An example must be a dictionary of features, but "%s" is %s.' %
+                    (example_dict, type(example_dict)))
+            example.Clear()
+            feature_map = example.features.feature
+            for f_name, f_val in example_dict.items():
+                T3S._set_feature(feature_map[f_name], f_val)
+            examples.append(example.SerializeToString())
+        return examples
+
+    @staticmethod
+    def _set_feature(feature, value):
+        """
+        Sets the value of a tf.train.Feature depending on its Python type.
+
+        Args:
+            feature: The tf.train.Feature to fill.
+            value: Value to set.
+                Can be: float, str, int or bytes.
+        """
+        if isinstance(value, float):
+            feature.float_list.value.append(value)
+        elif isinstance(value, str):
+            feature.bytes_list.value.append(value.encode('utf-8'))
+        elif isinstance(value, int):
+            feature.int64_list.value.append(value)
+        elif isinstance(value, bytes):
+            feature.bytes_list.value.append(value)
+        else:
+            raise ValueError(
+                'Type %s for value %s is not supported for tf.train.Feature.' %
+                (type(value), value)
+            )
+
     @staticmethod
     def _cast_feature(value):
         """
@@ -288,7 +812,7 @@ class T3S(Resource):
         if isinstance(value, float):
             return T3S._float_feature(value)
         elif isinstance(value, str):
-            return T3S._bytes_feature(tf.compat.as_bytes(value))
+            return T3S._bytes_feature(value.encode('utf-8'))
         elif isinstance(value, int):
             return T3S._int64_feature(value)
         elif isinstance(value, bytes):
@@ -301,19 +825,549 @@ class T3S(Resource):
 
     @staticmethod
     def _float_feature(value):
+        import tensorflow as tf
         return tf.train.Feature(float_list=tf.train.FloatList(value=[value]))
     @staticmethod
     def _int64_feature(value):
+        import tensorflow as tf
         return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
     @staticmethod
     def _bytes_feature(value):
+        import tensorflow as tf
         return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
 
 
+class _PendingPredictions(object):
+    """Predictions of submitted examples, some of which may come from a cache."""
+
+    def __init__(self, futures, cache=None, keys=None, cached=None, missing=None):
+        """
+        Args:
+            futures: The futures of the results of the submitted examples.
+            cache: The PredictionCache of the model, if any.
+            keys: The cache keys of all the examples.
+            cached: The list of the cached prediction of each example, or MISSING.
+            missing: The indexes of the submitted examples.
+        """
+        self.futures = futures
+        self.cache = cache
+        self.keys = keys
+        self.cached = cached
+        self.missing = missing
+
+    def result(self):
+        """Waits for the predictions and returns them in the examples order."""
+        results = [result for future in self.futures for result in future.result()]
+        if self.cache is None:
+            return results
+
+        self.cache.put_many([self.keys[i] for i in self.missing], results)
+        predictions = list(self.cached)
+        for i, result in zip(self.missing, results):
+            predictions[i] = result
+        return predictions
+
+    def columns(self):
+        """
+        Waits for the predictions and returns them as arrays, see
+        responses.columns().
+
+        Without a cache, the arrays of the batches are concatenated directly,
+        without going through a Python object per example.
+        """
+        if self.cache is None and self.futures:
+            results = [future.result() for future in self.futures]
+            if all(isinstance(result, np.ndarray) for result in results):
+                return np.concatenate(results)
+            return responses.columns([row for result in results for row in result])
+        return responses.columns(self.result())
+
+
+def _name(model, version, outputs, lane=None):
+    """Returns the name of the batching queue, or cache, of the requests for some outputs of a model."""
+    name = label(model, version)
+    if outputs is not None:
+        name += '[%s]' % ','.join(outputs)
+    if lane is not None and lane != scheduling.NORMAL:
+        name += '@' + lane
+    return name
+
+
+def _default_predictions(outputs):
+    """
+    Gets the default predictions of a model without a 'probabilities' output.
+
+    Args:
+        outputs: A dictionary that maps all the output keys of the signature to
+            their numpy ndarray.
+
+    Returns:
+        The array of the only output, if it holds a number per example.
+
+    Raises:
+        ValueError: When the signature has several outputs, or its output does
+            not hold a number per example.
+    """
+    if len(outputs) == 1:
+        output = np.asarray(next(iter(outputs.values())))
+        if output.dtype.kind in 'biuf' and output.ndim in (1, 2) and output.size == len(output):
+            return output.reshape(len(output))
+    raise ValueError('The model has no "probabilities" output, please choose the outputs to compute '
+                     'among %s with the "outputs" parameter.' % ', '.join('"%s"' % key for key in sorted(outputs)))
+
+
+def _output_rows(outputs, input_tensor_key_feed_dict):
+    """
+    Splits the outputs of a run by example.
+
+    Args:
+        outputs: A dictionary that maps output keys to numpy ndarrays.
+        input_tensor_key_feed_dict: The inputs of the run.
+
+    Returns:
+        The list of the dictionaries mapping each output key to the row of the
+        output of each example. Outputs without a row per example are given
+        whole to each example.
+    """
+    count = 0
+    for tensor in input_tensor_key_feed_dict.values():
+        if np.ndim(tensor):
+            count = len(tensor)
+            break
+    per_example = {
+        key: np.ndim(output) > 0 and len(output) == count
+        for key, output in outputs.items()
+    }
+    return [
+        {key: output[i] if per_example[key] else output for key, output in outputs.items()}
+        for i in range(count)
+    ]
+
+
+class T3SBulk(Resource):
+
+    def post(self, model, version=None, lane=None):
+        """
+        Streams the predictions of the examples posted in the request body.
+
+        The body is either a JSON array or newline-delimited JSON. Each row is an
+        example given the same way as to T3S.get(): a JSON dictionary with the
+        pre-computed features values, or a string to compute the features from if
+        the model has a features extractor.
+
+        The body is parsed as it arrives and processed by chunks of
+        'max_batch_size' examples, so that neither the whole input nor the whole
+        output is held in memory.
+
+        For models whose 'predict' signature takes dense tensors, the body can
+        instead hold NumPy arrays in one of the binary formats of the tensors
+        module, selected by the request Content-Type. The arrays are fed to the
+        model as they are, without copy.
+
+        As with T3S.get(), the 'outputs' query parameter selects the outputs
+        to compute and return for each example.
+
+        Args:
+            model: Name of the model.
+            version: Number of the version of the model to use, or None for its
+                current version.
+            lane: Scheduling lane of the request, one of scheduling.LANES, read
+                from the X-T3S-Priority header when None.
+
+        Returns:
+            A streamed newline-delimited JSON response with one line per example,
+            holding either its 'exN-res' prediction or an 'exN-error' message. If
+            the body is not valid, its last line holds an 'error' message.
+            For binary tensors, a dictionary that contains the prediction results
+            for each row, or a Response with their arrays in the columnar format
+            asked by the Accept header.
+        """
+        try:
+            outputs = T3SBulk.check_request(model, version, request.args.get('outputs'))
+        except ValueError as error:
+            return {'error': str(error)}
+        if lane is None:
+            lane = scheduling.lane(request.headers.get(scheduling.PRIORITY_HEADER))
+
+        # Feed binary tensors directly
+        if request.mimetype in tensors.FORMATS:
+            return T3SBulk.predict_tensors(model, request.mimetype, request.get_data(), version, outputs,
+                                           responses.negotiate(request.headers.get('Accept')), lane)
+
+        # Load the model before starting to answer
+        T3S.get_encoder(model, version)
+
+        rows = streaming.iter_json_rows(request.stream)
+        return Response(
+            stream_with_context(T3SBulk.stream_predictions(model, rows, version, outputs, lane)),
+            mimetype='application/x-ndjson')
+
+    @staticmethod
+    def check_request(model, version=None, outputs=None):
+        """
+        Checks the model and outputs of a bulk request, and counts the request.
+
+        Args:
+            model: Name of the model.
+            version: Number of the version of the model, or None for its current
+                version.
+            outputs: Comma-separated keys of the outputs to compute, or None.
+
+        Returns:
+            The sorted tuple of the keys of the outputs, see T3S.parse_outputs().
+
+        Raises:
+            ValueError: When the model, version or outputs do not exist.
+        """
+        try:
+            versions.model_dir(model, version)
+            outputs = T3S.parse_outputs(model, outputs, version)
+        except ValueError:
+            count_failed_request(model)
+            raise
+        metrics.count('t3s_requests_total', model)
+        return outputs
+
+    @staticmethod
+    def predict_tensors(model, content_type, body, version=None, outputs=None, response_format=None, lane=None):
+        """
+        Predicts results for binary tensors.
+
+        Args:
+            model: Name of the model.
+            content_type: Format of the tensors, one of tensors.FORMATS.
+            body: Bytes of the tensors.
+            version: Number of the version of the model, or None for its current
+                version.
+            outputs: Sorted tuple of the keys of the outputs to compute, or None
+                for the default predictions.
+            response_format: One of responses.COLUMNAR_FORMATS, or None for a
+                dictionary with a key per row.
+            lane: Scheduling lane of the runs, one of scheduling.LANES, or None
+                for the normal lane.
+
+        Returns:
+            A dictionary that contains the prediction results for each row, or a
+            Response with their arrays in the columnar format.
+        """
+        try:
+            with metrics.stage(model, 'parse'):
+                input_tensors = tensors.parse(content_type, body)
+            feature_chances = T3S.run_tensors(model, input_tensors, version, outputs, lane)
+        except ValueError as error:
+            metrics.count('t3s_errors_total', model)
+            return {
+                'error': 'The tensors are not valid data. %s' % error
+            }
+        metrics.count('t3s_examples_total', model, len(feature_chances))
+
+        if response_format is not None:
+            try:
+                return T3S.columnar_response(model, responses.columns(feature_chances), response_format)
+            except ValueError as error:
+                metrics.count('t3s_errors_total', model)
+                return {'error': str(error)}
+
+        with metrics.stage(model, 'format'):
+            json_result = {}
+            for i, feature_chance in enumerate(feature_chances):
+                json_result['ex' + str(i) + '-res'] = T3S.format_result(feature_chance)
+        return json_result
+
+    @staticmethod
+    def stream_predictions(model, rows, version=None, outputs=None, lane=None, offset=0):
+        """
+        Predicts results for a stream of examples.
+
+        Args:
+            model: Name of the model.
+            rows: Iterable of examples, as JSON dictionaries or strings.
+            version: Number of the version of the model, or None for its current
+                version.
+            outputs: Sorted tuple of the keys of the outputs to compute, or None
+                for the default predictions.
+            lane: Scheduling lane of the runs, one of scheduling.LANES, or None
+                for the normal lane.
+            offset: Index of the first example, numbering the result lines.
+
+        Yields:
+            The newline-delimited JSON lines of the response.
+        """
+        pending = collections.deque()
+        try:
+            for chunk in streaming.chunks(rows, config.get_model_option(model, 'max_batch_size')):
+                pending.append(T3SBulk._submit_chunk(model, chunk, offset, version, outputs, lane))
+                offset += len(chunk)
+                # Keep one chunk running while the next one is parsed
+                while len(pending) > 1:
+                    yield from T3SBulk._chunk_lines(model, *pending.popleft())
+        except ValueError as error:
+            while pending:
+                yield from T3SBulk._chunk_lines(model, *pending.popleft())
+            metrics.count('t3s_errors_total', model)
+            yield json.dumps({'error': str(error)}) + '\n'
+            return
+
+        while pending:
+            yield from T3SBulk._chunk_lines(model, *pending.popleft())
+
+    @staticmethod
+    def _submit_chunk(model, rows, offset, version=None, outputs=None, lane=None):
+        """
+        Extracts, encodes and submits a chunk of examples to the model.
+
+        Returns:
+            A tuple with the offset of the chunk, its number of examples, a
+            dictionary that maps the index of each invalid example to its error
+            message, the indexes of the valid ones and their _PendingPredictions.
+        """
+        metrics.count('t3s_examples_total', model, len(rows))
+        errors = {}
+        extractor = config.TF_MODELS['extractors'].get(model)
+        if extractor is not None:
+            strings = [row if isinstance(row, str) else '' for row in rows]
+            with metrics.stage(model, 'extract'):
+                inputs = extractor.extract_inputs(strings)
+            for i, features in enumerate(inputs):
+                if features is None:
+                    errors[i] = '"%s" is not valid data. %s' % (rows[i], extractor.error_formatting())
+        else:
+            inputs = rows
+
+        valid = [i for i in range(len(rows)) if i not in errors]
+        try:
+            pending = T3S.submit_inputs(model, [inputs[i] for i in valid], version, outputs, lane=lane)
+        except ValueError:
+            # Find the invalid examples
+            for i in list(valid):
+                try:
+                    T3S.encode(model, [inputs[i]], version)
+                except ValueError as error:
+                    errors[i] = '"%s" is not valid data. %s' % (rows[i], error)
+                    valid.remove(i)
+            pending = T3S.submit_inputs(model, [inputs[i] for i in valid], version, outputs, lane=lane)
+
+        return offset, len(rows), errors, valid, pending
+
+    @staticmethod
+    def _chunk_lines(model, offset, count, errors, valid, pending):
+        try:
+            results = pending.result()
+        except Exception as error:
+            results = None
+            for i in valid:
+                errors[i] = str(error)
+        if errors:
+            metrics.count('t3s_errors_total', model, len(errors))
+
+        with metrics.stage(model, 'format'):
+            values = dict(zip(valid, results)) if results is not None else {}
+            lines = []
+            for i in range(count):
+                if i in errors:
+                    line = {'ex%d-error' % (offset + i): errors[i]}
+                else:
+                    line = {'ex%d-res' % (offset + i): T3S.format_result(values[i])}
+                lines.append(json.dumps(line) + '\n')
+        yield from lines
+
+
+class T3SFanout(Resource):
+
+    def post(self):
+        """
+        Predicts results for the same examples with several models.
+
+        The body is a JSON dictionary with the "models" list of the names of the
+        models, and the "data_input" string of the examples, in the same form as
+        for T3S.get(). The examples are parsed, or extracted, once for all the
+        models sharing the same features extractor, and serialized once for all
+        the models sharing the same features schema. The models are loaded,
+        then run, concurrently.
+
+        Returns:
+            A dictionary that maps each model to its prediction results, or to
+            its own 'error' message when it failed.
+        """
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get('models'), list) \
+                or not isinstance(body.get('data_input'), str):
+            return {
+                'error': 'Please post a JSON dictionary with the "models" list and the "data_input" string.'
+            }
+        return T3SFanout.predict(body['models'], body['data_input'])
+
+    @staticmethod
+    def predict(models, data_input):
+        """
+        Predicts results for the same examples with several models.
+
+        Args:
+            models: List of the names of the models.
+            data_input: String containing the examples to process.
+
+        Returns:
+            A dictionary that maps each model to its prediction results, or to
+            an 'error' message.
+        """
+        results = {}
+        # Load the models concurrently, as the cold ones take much longer than
+        # running them
+        encoders = {}
+        for model in dict.fromkeys(str(model) for model in models):
+            try:
+                versions.model_dir(model)
+            except ValueError as error:
+                count_failed_request(model)
+                results[model] = {'error': str(error)}
+                continue
+            encoders[model] = _fanout_pool().submit(T3S.get_encoder, model)
+
+        # Inputs of each features extractor, and examples of each features
+        # schema, or the ValueError raised while computing them
+        inputs = {}
+        examples = {}
+        futures = {}
+        for model, encoder_future in encoders.items():
+            try:
+                encoder = encoder_future.result()
+                extractor = config.TF_MODELS['extractors'].get(model)
+                inputs_key = None if extractor is None else id(extractor)
+                if inputs_key not in inputs:
+                    inputs[inputs_key] = T3SFanout._inputs(model, data_input)
+                model_inputs = _raise_error(inputs[inputs_key])
+
+                examples_key = (inputs_key, None if encoder is None else tuple(sorted(encoder.schema.features.items())))
+                if examples_key not in examples:
+                    try:
+                        examples[examples_key] = T3S.encode(model, model_inputs)
+                    except ValueError as error:
+                        examples[examples_key] = ValueError('"%s" is not valid data. %s' % (data_input, error))
+                model_examples = _raise_error(examples[examples_key])
+            except ValueError as error:
+                count_failed_request(model)
+                results[model] = {'error': str(error)}
+                continue
+            except Exception as error:
+                # A model which cannot be loaded does not fail the other ones
+                count_failed_request(model)
+                results[model] = {'error': 'Model "%s" failed: %s' % (model, error)}
+                continue
+
+            metrics.count('t3s_requests_total', model)
+            metrics.count('t3s_examples_total', model, len(model_inputs))
+            futures[model] = _fanout_pool().submit(T3SFanout._run, model, model_inputs, model_examples)
+
+        for model, future in futures.items():
+            try:
+                results[model] = future.result()
+            except Exception as error:
+                metrics.count('t3s_errors_total', model)
+                results[model] = {'error': 'Model "%s" failed: %s' % (model, error)}
+        return results
+
+    @staticmethod
+    def _inputs(model, data_input):
+        """Parses, or extracts with the extractor of a model, the examples of a request, or returns the ValueError."""
+        extractor = config.TF_MODELS['extractors'].get(model)
+        if extractor is None:
+            try:
+                with metrics.stage(model, 'parse'):
+                    inputs = json.loads(data_input)
+            except json.decoder.JSONDecodeError:
+                return ValueError(
+                    '"%s" is not valid data. Please enter JSON-formatted data to represent your features.' % (data_input))
+            return inputs if isinstance(inputs, list) else [inputs]
+
+        with metrics.stage(model, 'extract'):
+            inputs = extractor.extract(data_input)
+        if None in inputs:
+            return ValueError('"%s" is not valid data. ' % (data_input) + extractor.error_formatting())
+        return inputs
+
+    @staticmethod
+    def _run(model, inputs, examples):
+        """Runs the serialized examples through a model and formats its results."""
+        try:
+            predictions = T3S.submit_inputs(model, inputs, examples=examples).result()
+        except ValueError as error:
+            metrics.count('t3s_errors_total', model)
+            return {'error': 'Model "%s" failed: %s' % (model, error)}
+        with metrics.stage(model, 'format'):
+            return {
+                'ex%d-res' % i: T3S.format_result(prediction)
+                for i, prediction in enumerate(predictions)
+            }
+
+
+def count_failed_request(model):
+    """Counts a request failed before running its model, under UNKNOWN_MODEL if the model does not exist."""
+    if not versions.known(model):
+        model = UNKNOWN_MODEL
+    metrics.count('t3s_requests_total', model)
+    metrics.count('t3s_errors_total', model)
+
+
+def _raise_error(value):
+    if isinstance(value, ValueError):
+        raise value
+    return value
+
+
+def _fanout_pool():
+    global _fanout_executor
+    if _fanout_executor is None:
+        with _extractors_lock:
+            if _fanout_executor is None:
+                _fanout_executor = ThreadPoolExecutor(config.TF_MODELS['fanout_workers'])
+    return _fanout_executor
+
+
+def close_fanout():
+    """Shuts the pool running the models of the fan-out requests down."""
+    global _fanout_executor
+    if _fanout_executor is not None:
+        _fanout_executor.shutdown()
+        _fanout_executor = None
+
+
 class T3SExtractor(object):
     """Abstract class to inherit from to create a specific features extractor
     adapted to your model"""
 
+    # Extraction pool settings, see __init__()
+    pool = None
+    workers = None
+    min_parallel_inputs = 1000
+    _executor = None
+
+    def __init__(self, pool=None, workers=None, min_parallel_inputs=1000):
+        """
+        Args:
+            pool: To spread the extraction of large batches across cores, either
+                'thread' or 'process' to use a pool of threads or processes.
+                None to extract on the calling thread.
+            workers: Number of workers of the pool, defaults to the number of
+                cores.
+            min_parallel_inputs: Minimum number of inputs for a batch to be
+                spread across the pool.
+
+        Raises:
+            ValueError: When the pool type is unknown.
+        """
+        if pool not in (None, 'thread', 'process'):
+            raise ValueError('Unknown extraction pool "%s", please choose from '
+                             '"thread" or "process".' % pool)
+        self.pool = pool
+        self.workers = workers
+        self.min_parallel_inputs = min_parallel_inputs
+
+    def __getstate__(self):
+        # The pool is not sent to the processes workers
+        state = self.__dict__.copy()
+        state.pop('_executor', None)
+        return state
+
     def check_data(self, input):
         """
         Checks for the input validity.
@@ -341,6 +1395,22 @@ class T3SExtractor(object):
         raise NotImplementedError('You need to provide a specific extracting '
             'function matching your model.')
 
+    def compute_features_batch(self, inputs):
+        """
+        Computes the TensorFlow model features from a batch of valid inputs.
+
+        Calls compute_features() on each input by default. Override it to compute
+        the features of the whole batch at once, e.g. with NumPy.
+
+        Args:
+            inputs: List of strings to compute the features from.
+
+        Returns:
+            A list with, for each input, a dictionary with the model's keys as keys
+            and the computed features as values.
+        """
+        return [self.compute_features(input) for input in inputs]
+
     def extract(self, data, debug=False):
         """
         Runs the features extraction process.
@@ -351,36 +1421,80 @@ class T3SExtractor(object):
             debug: A boolean flag to display or not the computed features.
 
         Returns:
-            If the input data is not in the right form, returns None.
-            Else, returns a dictionary with the model's keys as keys and the computed
-            features as values.
+            A list with, for each example, None if the input data is not in the
+            right form, else a dictionary with the model's keys as keys and the
+            computed features as values.
         """
         # Split examples
-        inputs = data.split(';')
+        return self.extract_inputs(data.split(';'), debug)
+
+    def extract_inputs(self, inputs, debug=False):
+        """
+        Runs the features extraction process on a list of examples.
+
+        The valid inputs are computed together by compute_features_batch(), spread
+        across the extraction pool when there are at least min_parallel_inputs.
+
+        Args:
+            inputs: List of strings to compute the features from, one per example.
+            debug: A boolean flag to display or not the computed features.
+
+        Returns:
+            A list with, for each example, None if the input data is not in the
+            right form, else a dictionary with the model's keys as keys and the
+            computed features as values.
+        """
+        valid = [i for i, input in enumerate(inputs) if self.check_data(input)]
+        valid_inputs = [inputs[i] for i in valid]
+
+        if self.pool is not None and len(valid_inputs) >= self.min_parallel_inputs:
+            workers = self.workers or os.cpu_count() or 1
+            size = -(-len(valid_inputs) // (workers * 4))
+            chunks = [valid_inputs[start:start + size] for start in range(0, len(valid_inputs), size)]
+            valid_features = [
+                features
+                for chunk_features in self._get_executor().map(self.compute_features_batch, chunks)
+                for features in chunk_features
+            ]
+        else:
+            valid_features = self.compute_features_batch(valid_inputs)
+
+        examples_features = [None] * len(inputs)
+        for i, features in zip(valid, valid_features):
+            examples_features[i] = features
 
         if debug:
             print('=' * 23)
             print('T3S computation result:')
             print('=' * 23)
-
-        examples_features = []
-        # Compute each example
-        for input in inputs:
-            features = None
-
-            if self.check_data(input):
-                features = self.compute_features(input)
-
-                if debug:
-                    print('Example #%3d:' % len(examples_features))
+            for i, input in enumerate(inputs):
+                if examples_features[i] is not None:
+                    print('Example #%3d:' % i)
                     print('-' * 13)
                     print('Input:', input)
-                    print('Result:', features, '\n')
-
-            examples_features.append(features)
+                    print('Result:', examples_features[i], '\n')
 
         return examples_features
 
+    def _get_executor(self):
+        if self._executor is None:
+            with _extractors_lock:
+                if self._executor is None:
+                    if self.pool == 'process':
+                        # Forking a process already running TensorFlow sessions
+                        # and background threads could deadlock the workers
+                        self._executor = ProcessPoolExecutor(
+                            self.workers, mp_context=multiprocessing.get_context('spawn'))
+                    else:
+                        self._executor = ThreadPoolExecutor(self.workers)
+        return self._executor
+
+    def close(self):
+        """Shuts the extraction pool down."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
     def error_formatting(self):
         """
         Informs the user of the correct input format for this features extractor.
@@ -0,0 +1,212 @@
+"""
+T3S binary tensor formats.
+
+Models whose signature takes plain dense tensors can be fed NumPy arrays
+directly instead of serialized tf.Example. The arrays are read with
+np.frombuffer() over the request body, without copy nor per-row Python objects,
+from one of the following formats:
+    - 'application/x-npy': a single .npy array, for signatures with a single
+    input,
+    - 'application/x-npz': a .npz archive (as written by np.savez()) with one
+    array per input key; compressed members are the only ones copied,
+    - 'application/x-t3s-columns': a simple length-prefixed columnar buffer,
+    see encode_columns().
+"""
+
+import io
+import struct
+import zipfile
+
+import numpy as np
+
+NPY = 'application/x-npy'
+NPZ = 'application/x-npz'
+COLUMNS = 'application/x-t3s-columns'
+
+FORMATS = (NPY, NPZ, COLUMNS)
+
+COLUMNS_MAGIC = b'T3SC'
+
+_NPY_MAGIC = b'\x93NUMPY'
+_ZIP_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+_COUNT = struct.Struct('<I')
+_KEY_LENGTH = struct.Struct('<H')
+_BYTE = struct.Struct('<B')
+_DIM = struct.Struct('<Q')
+
+
+def _array(buffer, offset, dtype, shape, order='C'):
+    dtype = np.dtype(dtype)
+    if dtype.hasobject:
+        raise ValueError('Arrays of Python objects are not supported.')
+    count = int(np.prod(shape, dtype=np.int64))
+    if offset + count * dtype.itemsize > len(buffer):
+        raise ValueError('The array data is truncated.')
+    array = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+    return array.reshape(shape, order=order)
+
+
+def parse_npy(buffer, offset=0):
+    """
+    Reads a .npy array from a buffer, without copy.
+
+    Args:
+        buffer: Bytes-like object containing the array.
+        offset: Position of the array in the buffer.
+
+    Returns:
+        A read-only numpy array backed by the buffer.
+
+    Raises:
+        ValueError: An error when the buffer does not hold a valid .npy array.
+    """
+    if bytes(buffer[offset:offset + len(_NPY_MAGIC)]) != _NPY_MAGIC:
+        raise ValueError('The data is not a .npy array.')
+    if offset + len(_NPY_MAGIC) + 2 > len(buffer):
+        raise ValueError('The .npy header is truncated.')
+    major = buffer[offset + len(_NPY_MAGIC)]
+    length_format = '<H' if major == 1 else '<I'
+    prefix_length = len(_NPY_MAGIC) + 2 + struct.calcsize(length_format)
+    if offset + prefix_length > len(buffer):
+        raise ValueError('The .npy header is truncated.')
+    header_length, = struct.unpack_from(length_format, buffer, offset + len(_NPY_MAGIC) + 2)
+    if offset + prefix_length + header_length > len(buffer):
+        raise ValueError('The .npy header is truncated.')
+
+    header = io.BytesIO(bytes(buffer[offset:offset + prefix_length + header_length]))
+    version = np.lib.format.read_magic(header)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+    return _array(buffer, offset + header.tell(), dtype, shape, 'F' if fortran_order else 'C')
+
+
+def parse_npz(buffer):
+    """
+    Reads the arrays of a .npz archive from a buffer.
+
+    Args:
+        buffer: Bytes object containing the archive.
+
+    Returns:
+        A dictionary that maps the names of the arrays to numpy arrays, backed
+        by the buffer for the uncompressed ones.
+
+    Raises:
+        ValueError: An error when the buffer does not hold a valid .npz archive.
+    """
+    arrays = {}
+    try:
+        with zipfile.ZipFile(io.BytesIO(buffer)) as archive:
+            for info in archive.infolist():
+                key = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+                if info.compress_type == zipfile.ZIP_STORED:
+                    header = _ZIP_LOCAL_HEADER.unpack_from(buffer, info.header_offset)
+                    offset = info.header_offset + _ZIP_LOCAL_HEADER.size + header[9] + header[10]
+                    arrays[key] = parse_npy(buffer, offset)
+                else:
+                    arrays[key] = parse_npy(archive.read(info))
+    except (zipfile.BadZipFile, struct.error) as error:
+        raise ValueError('The data is not a valid .npz archive: %s' % error)
+    return arrays
+
+
+def parse_columns(buffer):
+    """
+    Reads the arrays of a columnar buffer, without copy.
+
+    Args:
+        buffer: Bytes-like object written by encode_columns().
+
+    Returns:
+        A dictionary that maps the column keys to read-only numpy arrays backed
+        by the buffer.
+
+    Raises:
+        ValueError: An error when the buffer is not a valid columnar buffer.
+    """
+    if bytes(buffer[:len(COLUMNS_MAGIC)]) != COLUMNS_MAGIC:
+        raise ValueError('The data is not a T3S columnar buffer.')
+    arrays = {}
+    try:
+        offset = len(COLUMNS_MAGIC)
+        count, = _COUNT.unpack_from(buffer, offset)
+        offset += _COUNT.size
+        for _ in range(count):
+            key_length, = _KEY_LENGTH.unpack_from(buffer, offset)
+            offset += _KEY_LENGTH.size
+            key = bytes(buffer[offset:offset + key_length]).decode('utf-8')
+            offset += key_length
+
+            dtype_length, = _BYTE.unpack_from(buffer, offset)
+            offset += _BYTE.size
+            dtype = np.dtype(bytes(buffer[offset:offset + dtype_length]).decode('ascii'))
+            offset += dtype_length
+
+            ndim, = _BYTE.unpack_from(buffer, offset)
+            offset += _BYTE.size
+            shape = tuple(_DIM.unpack_from(buffer, offset + i * _DIM.size)[0] for i in range(ndim))
+            offset += ndim * _DIM.size
+
+            arrays[key] = _array(buffer, offset, dtype, shape)
+            offset += arrays[key].nbytes
+    except (struct.error, TypeError, UnicodeDecodeError) as error:
+        raise ValueError('The T3S columnar buffer is not valid: %s' % error)
+    return arrays
+
+
+def encode_columns(arrays):
+    """
+    Writes arrays as a columnar buffer.
+
+    The buffer starts with the b'T3SC' magic bytes and the number of columns as
+    a uint32. Each column then holds its key length as a uint16 and its UTF-8
+    key, its numpy dtype string length as a uint8 and its dtype string (e.g.
+    '<f4'), its number of dimensions as a uint8 followed by each dimension as a
+    uint64, and finally its raw C-ordered data. All integers are little-endian.
+
+    Args:
+        arrays: A dictionary that maps column keys to numpy arrays.
+
+    Returns:
+        The bytes of the buffer.
+    """
+    chunks = [COLUMNS_MAGIC, _COUNT.pack(len(arrays))]
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        encoded_key = key.encode('utf-8')
+        dtype = array.dtype.str.encode('ascii')
+        chunks.extend([
+            _KEY_LENGTH.pack(len(encoded_key)), encoded_key,
+            _BYTE.pack(len(dtype)), dtype,
+            _BYTE.pack(array.ndim),
+        ])
+        chunks.extend(_DIM.pack(dim) for dim in array.shape)
+        chunks.append(array.tobytes())
+    return b''.join(chunks)
+
+
+def parse(content_type, buffer):
+    """
+    Reads the arrays of a request body.
+
+    Args:
+        content_type: Format of the body, one of FORMATS.
+        buffer: Bytes of the body.
+
+    Returns:
+        A dictionary that maps input keys to numpy arrays. A single .npy array is
+        mapped to the None key.
+
+    Raises:
+        ValueError: An error when the body is not valid.
+    """
+    if content_type == NPY:
+        return {None: parse_npy(buffer)}
+    elif content_type == NPZ:
+        return parse_npz(buffer)
+    elif content_type == COLUMNS:
+        return parse_columns(buffer)
+    raise ValueError('Unknown tensor format "%s", please choose from %s.' %
+                     (content_type, ', '.join(FORMATS)))
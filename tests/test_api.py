@@ -0,0 +1,24 @@
+import pytest
+
+import config
+from api import app
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setitem(config.TF_MODELS, 'dir', str(tmp_path) + '/')
+    return app.test_client()
+
+
+@pytest.mark.parametrize('address', ['/_t3s/health', '/_t3s/batching', '/_t3s/cache', '/_t3s/metrics',
+                                     '/_t3s/versions', '/_t3s/residency', '/_t3s/scheduling', '/_t3s/tracing',
+                                     '/_t3s/tracing/model'])
+def test_admin_addresses(client, address):
+    assert client.get(address).status_code == 200
+
+
+@pytest.mark.parametrize('model', ['tracing', 'metrics', 'priority', 'scheduling'])
+def test_admin_addresses_do_not_shadow_models(client, model):
+    assert client.get('/%s/example' % model).get_json() == {'error': 'Model "%s" does not exist.' % model}
+    assert client.post('/%s/predict' % model, data='[]').get_json() == {
+        'error': 'Model "%s" does not exist.' % model}
@@ -0,0 +1,93 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+import archive
+from archive import OutputArchive, encode_record, read_archive
+
+
+def write_records(path, records):
+    with open(path, 'wb') as archive_file:
+        for outputs, timestamp in records:
+            archive_file.writelines(encode_record(outputs, timestamp))
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'outputs.t3sa')
+    records = [
+        ({'probabilities': np.arange(6, dtype=np.float32).reshape(2, 3), 'ids': np.array([7, 8])}, 10.5),
+        ({'classes': np.array([b'yes', b'no'], dtype=object), 'scalar': np.float64(3)}, 11.0),
+        ({'empty': np.zeros((0, 4), dtype=np.int32)}, 12.0),
+    ]
+    write_records(path, records)
+
+    read = list(read_archive(path))
+    assert [timestamp for timestamp, _ in read] == [10.5, 11.0, 12.0]
+    for (outputs, _), (_, read_outputs) in zip(records, read):
+        assert sorted(read_outputs) == sorted(outputs)
+        for key, array in outputs.items():
+            expected = np.asarray(array)
+            if expected.dtype == object:
+                expected = expected.astype(bytes)
+            np.testing.assert_array_equal(read_outputs[key], expected)
+            assert read_outputs[key].dtype == expected.dtype
+            assert not read_outputs[key].flags.writeable
+
+
+def test_records_are_aligned():
+    chunks = encode_record({'x': np.arange(3, dtype=np.int8)}, 0.0)
+    assert sum(len(memoryview(chunk).cast('B')) for chunk in chunks) % archive.ALIGNMENT == 0
+
+
+def test_empty_archive(tmp_path):
+    path = tmp_path / 'empty.t3sa'
+    path.write_bytes(b'')
+    assert list(read_archive(str(path))) == []
+
+
+def test_corrupted_archive(tmp_path):
+    path = str(tmp_path / 'corrupted.t3sa')
+    write_records(path, [({'x': np.arange(3)}, 0.0)])
+    with open(path, 'ab') as archive_file:
+        archive_file.write(b'garbage!' * 8)
+    with pytest.raises(ValueError, match='Corrupted archive record'):
+        list(read_archive(path))
+
+
+def test_archive_writes_the_queued_outputs(tmp_path):
+    output_archive = OutputArchive(str(tmp_path), 100, 3600, 'block')
+    for i in range(5):
+        assert output_archive.put('model', {'x': np.full(2, i)})
+    assert output_archive.close(timeout=10)
+
+    [path] = glob.glob(str(tmp_path / 'model' / ('*-%d.t3sa' % os.getpid())))
+    assert [outputs['x'].tolist() for _, outputs in read_archive(path)] == [[i, i] for i in range(5)]
+    assert output_archive.stats() == {'queued': 0, 'written': 5, 'dropped': 0}
+
+
+def test_archive_cuts_the_partial_records(tmp_path, monkeypatch):
+    def failing_record(outputs, timestamp):
+        chunks = encode_record(outputs, timestamp)
+        if outputs.get('fail'):
+            # The first chunks of the record are written before the error
+            yield from chunks[:3]
+            raise OSError(28, 'No space left on device')
+        yield from chunks
+
+    monkeypatch.setattr(archive, 'encode_record', failing_record)
+    output_archive = OutputArchive(str(tmp_path), 100, 3600, 'block')
+    output_archive.put('model', {'x': np.arange(2)})
+    output_archive.put('model', {'x': np.arange(3), 'fail': np.ones(1)})
+    output_archive.put('model', {'x': np.arange(4)})
+    assert output_archive.close(timeout=10)
+
+    [path] = glob.glob(str(tmp_path / 'model' / '*.t3sa'))
+    assert [outputs['x'].tolist() for _, outputs in read_archive(path)] == [[0, 1], [0, 1, 2, 3]]
+    assert output_archive.stats() == {'queued': 0, 'written': 2, 'dropped': 1}
+
+
+def test_archive_rejects_unknown_overflow(tmp_path):
+    with pytest.raises(ValueError):
+        OutputArchive(str(tmp_path), 1, 60, 'wait')
@@ -0,0 +1,43 @@
+import json
+import threading
+import time
+
+import pytest
+
+import artifacts
+
+
+def test_artifact_path_is_unique_per_directory_and_tags(tmp_path):
+    path = artifacts.artifact_path(str(tmp_path), '/models/iris', 'serve')
+    assert path.startswith(str(tmp_path / 'iris-'))
+    assert path != artifacts.artifact_path(str(tmp_path), '/other/iris', 'serve')
+    assert path != artifacts.artifact_path(str(tmp_path), '/models/iris', 'serve,gpu')
+
+
+def test_build_lock_is_exclusive(tmp_path):
+    path = str(tmp_path / 'artifacts' / 'model')
+    events = []
+
+    def build(name):
+        with artifacts._build_lock(path):
+            events.append(('start', name))
+            time.sleep(0.05)
+            events.append(('end', name))
+
+    threads = [threading.Thread(target=build, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [kind for kind, _ in events] == ['start', 'end'] * 4
+    assert all(events[i][1] == events[i + 1][1] for i in range(0, 8, 2))
+
+
+def test_corrupted_artifact_is_deleted(tmp_path):
+    pytest.importorskip('tensorflow')
+    path = str(tmp_path / 'model')
+    (tmp_path / 'model.json').write_text(json.dumps({'fingerprint': [1, 2]}))
+    (tmp_path / 'model.pb').write_bytes(b'\xff' * 16)
+    assert artifacts._read(path, [1, 2]) is None
+    assert not (tmp_path / 'model.json').exists()
+    assert not (tmp_path / 'model.pb').exists()
@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+
+from batching import Batcher, BatchingQueue
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def double(examples):
+    return [2 * example for example in examples]
+
+
+def test_merges_the_concurrent_examples():
+    batches = []
+    release = threading.Event()
+
+    def run_batch(examples):
+        batches.append(list(examples))
+        release.wait()
+        return double(examples)
+
+    queue = BatchingQueue('model', run_batch, 4, 0.1)
+    try:
+        first = queue.submit([1])
+        wait_until(lambda: batches)
+        # Queued while the first batch runs, then run together
+        futures = [queue.submit([2, 3]), queue.submit([4]), queue.submit([5])]
+        release.set()
+        assert first.result(5) == [2]
+        assert [future.result(5) for future in futures] == [[4, 6], [8], [10]]
+        assert batches == [[1], [2, 3, 4, 5]]
+    finally:
+        queue.close()
+
+
+def test_rejects_too_many_examples():
+    queue = BatchingQueue('model', double, 2, 0)
+    try:
+        with pytest.raises(ValueError):
+            queue.submit([1, 2, 3])
+        assert queue.submit([]).result(5) == []
+    finally:
+        queue.close()
+
+
+def test_a_failing_request_does_not_fail_its_batch():
+    release = threading.Event()
+
+    def run_batch(examples):
+        release.wait()
+        if None in examples:
+            raise ValueError('bad example')
+        return double(examples)
+
+    queue = BatchingQueue('model', run_batch, 8, 0.1)
+    try:
+        blocker = queue.submit([0])
+        good = queue.submit([1])
+        bad = queue.submit([None])
+        release.set()
+        assert blocker.result(5) == [0]
+        assert good.result(5) == [2]
+        with pytest.raises(ValueError):
+            bad.result(5)
+    finally:
+        queue.close()
+
+
+def test_close_fails_the_queued_examples():
+    release = threading.Event()
+    queue = BatchingQueue('model', lambda examples: release.wait() and double(examples), 1, 0)
+    running = queue.submit([1])
+    wait_until(lambda: not queue.stats()['queued_requests'])
+    queued = queue.submit([2])
+    threading.Timer(0.05, release.set).start()
+    queue.close()
+    assert running.result(5) == [2]
+    with pytest.raises(RuntimeError):
+        queued.result(5)
+    with pytest.raises(RuntimeError):
+        queue.submit([3])
+
+
+def test_idle_queues_are_retired():
+    batcher = Batcher(idle_timeout=0.05)
+    try:
+        assert batcher.submit('model', 'model:1', double, 4, 0, [[1]])[0].result(5) == [2]
+        assert list(batcher.stats()) == ['model:1']
+        wait_until(lambda: not batcher.stats())
+        # A new queue replaces the retired one
+        assert batcher.submit('model', 'model:1', double, 4, 0, [[2]])[0].result(5) == [4]
+    finally:
+        batcher.close()
+
+
+def test_retired_queue_is_replaced_on_submit():
+    batcher = Batcher()
+    try:
+        queue = batcher.queue('model', 'model', double, 4, 0)
+        assert batcher._retire(queue)
+        assert batcher.submit('model', 'model', double, 4, 0, [[3]])[0].result(5) == [6]
+        assert batcher.queue('model', 'model', double, 4, 0) is not queue
+    finally:
+        batcher.close()
+
+
+def test_queues_per_model_are_bounded():
+    batcher = Batcher(max_queues_per_model=2)
+    try:
+        assert batcher.submit('a', 'a', double, 4, 0, [[1]]) is not None
+        assert batcher.submit('a', 'a[x]', double, 4, 0, [[1]]) is not None
+        assert batcher.submit('a', 'a[y]', double, 4, 0, [[1]]) is None
+        # The existing queues and the other models are still served
+        assert batcher.submit('a', 'a', double, 4, 0, [[1]]) is not None
+        assert batcher.submit('b', 'b', double, 4, 0, [[1]]) is not None
+        assert sorted(batcher.stats()) == ['a', 'a[x]', 'b']
+    finally:
+        batcher.close()
@@ -0,0 +1,70 @@
+import pytest
+
+import cache
+from cache import MISSING, PredictionCache, PredictionCaches, example_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_example_key_ignores_the_features_order():
+    assert example_key({'a': 1, 'b': 'x'}) == example_key({'b': 'x', 'a': 1})
+    assert example_key({'a': 1}) != example_key({'a': 2})
+    assert example_key({'a': 1}) != example_key({'a': '1'})
+    assert len(example_key({})) == 16
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    predictions = PredictionCache(max_entries=2, ttl=60)
+    predictions.put_many(['a', 'b'], [1, 2])
+    # Reading "a" makes "b" the least recently used entry
+    assert predictions.get_many(['a']) == [1]
+    predictions.put_many(['c'], [3])
+    assert predictions.get_many(['a', 'b', 'c']) == [1, MISSING, 3]
+    assert predictions.stats() == {'entries': 2, 'hits': 3, 'misses': 1, 'evictions': 1}
+
+
+def test_updated_entries_are_refreshed(clock):
+    predictions = PredictionCache(max_entries=2, ttl=60)
+    predictions.put_many(['a', 'b'], [1, 2])
+    predictions.put_many(['a'], [10])
+    predictions.put_many(['c'], [3])
+    assert predictions.get_many(['a', 'b', 'c']) == [10, MISSING, 3]
+
+
+def test_entries_expire_after_their_ttl(clock):
+    predictions = PredictionCache(max_entries=10, ttl=60)
+    predictions.put_many(['a'], [1])
+    clock[0] += 30
+    predictions.put_many(['b'], [2])
+    clock[0] += 30
+    assert predictions.get_many(['a', 'b']) == [1, 2]
+    clock[0] += 0.5
+    # Reading an entry does not extend its time to live
+    assert predictions.get_many(['a', 'b']) == [MISSING, 2]
+    clock[0] += 30
+    assert predictions.get_many(['b']) == [MISSING]
+    assert predictions.stats() == {'entries': 0, 'hits': 3, 'misses': 2, 'evictions': 2}
+
+
+def test_falsy_predictions_are_cached(clock):
+    predictions = PredictionCache(max_entries=10, ttl=60)
+    predictions.put_many(['zero', 'none'], [0.0, None])
+    assert predictions.get_many(['zero', 'none']) == [0.0, None]
+
+
+def test_model_cache_is_emptied_by_a_new_version(clock):
+    caches = PredictionCaches()
+    first = caches.cache('model', 1, 10, 60)
+    first.put_many(['a'], [1])
+    assert caches.cache('model', 1, 10, 60) is first
+    assert first.get_many(['a']) == [1]
+
+    assert caches.cache('model', 2, 10, 60) is first
+    assert first.get_many(['a']) == [MISSING]
+    assert caches.cache('other', 1, 10, 60) is not first
+    assert sorted(caches.stats()) == ['model', 'other']
@@ -0,0 +1,44 @@
+import pytest
+
+from extractor import CustomExtractor
+
+EMAILS = [
+    'john.doe42@example.com',
+    'JANE_DOE@Example.ORG',
+    '@empty.local',
+    'no-domain@',
+    '1234567890@numbers.net',
+    'a+b-c.d@sub.domain.co.uk',
+    'zoë.müller@unicode.de',
+    '١٢٣abc@arabic-digits.eg',
+    '名前@日本.jp',
+    '~!#$%^&*@symbols.io',
+]
+
+
+def test_batched_extraction_equals_per_row_extraction():
+    extractor = CustomExtractor()
+    assert extractor.compute_features_batch(EMAILS) == [extractor.compute_features(email) for email in EMAILS]
+
+
+@pytest.mark.parametrize('pool', ['thread', 'process'])
+def test_pooled_extraction_equals_per_row_extraction(pool):
+    extractor = CustomExtractor(pool=pool, workers=2, min_parallel_inputs=4)
+    try:
+        inputs = EMAILS * 3 + ['not an email', 'a@b@c']
+        expected = [extractor.compute_features(email) for email in EMAILS] * 3 + [None, None]
+        assert extractor.extract_inputs(inputs) == expected
+    finally:
+        extractor.close()
+
+
+@pytest.mark.parametrize('email', ['a@b@c', 'no at sign', '@@'])
+def test_rejects_emails_without_exactly_one_at(email):
+    extractor = CustomExtractor()
+    assert not extractor.check_data(email)
+    assert extractor.extract('valid@example.com;%s' % email)[1] is None
+    # Called on them anyway, the batched extraction fails as the per-row one
+    with pytest.raises(ValueError):
+        extractor.compute_features(email)
+    with pytest.raises(ValueError):
+        extractor.compute_features_batch(['valid@example.com', email])
@@ -0,0 +1,126 @@
+import struct
+
+import numpy as np
+import pytest
+
+from features import FeatureSchema
+
+
+def read_varint(data, position):
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, position
+
+
+def read_fields(data):
+    """Decodes the length-delimited fields of a protocol buffer message."""
+    fields = []
+    position = 0
+    while position < len(data):
+        key, position = read_varint(data, position)
+        assert key & 7 == 2
+        size, position = read_varint(data, position)
+        fields.append((key >> 3, data[position:position + size]))
+        position += size
+    return fields
+
+
+def decode_example(serialized):
+    """Decodes a serialized tf.train.Example into a dictionary of (kind, values)."""
+    [(number, features)] = read_fields(serialized)
+    assert number == 1
+    decoded = {}
+    for number, entry in read_fields(features):
+        assert number == 1
+        (_, name), (_, feature) = read_fields(entry)
+        [(kind, values_list)] = read_fields(feature)
+        [(_, packed)] = read_fields(values_list)
+        if kind == 1:
+            values = [packed]
+        elif kind == 2:
+            values = list(struct.unpack('<%df' % (len(packed) // 4), packed))
+        else:
+            values = []
+            position = 0
+            while position < len(packed):
+                value, position = read_varint(packed, position)
+                values.append(value - (1 << 64) if value >= 1 << 63 else value)
+        decoded[name.decode('utf-8')] = (kind, values)
+    return decoded
+
+
+def test_encodes_the_example_wire_format():
+    encoder = FeatureSchema({'age': 'int64', 'score': 'float', 'email': 'string'}).compile()
+    examples = encoder.encode([
+        {'age': 42, 'score': 0.5, 'email': 'a@b.c'},
+        {'age': -3, 'score': np.float32(2), 'email': b'\xff'},
+        {'age': 2 ** 63 - 1, 'score': 7, 'email': 'é'},
+    ])
+    assert [decode_example(example) for example in examples] == [
+        {'age': (3, [42]), 'score': (2, [0.5]), 'email': (1, [b'a@b.c'])},
+        {'age': (3, [-3]), 'score': (2, [2.0]), 'email': (1, [b'\xff'])},
+        {'age': (3, [2 ** 63 - 1]), 'score': (2, [7.0]), 'email': (1, ['é'.encode('utf-8')])},
+    ]
+
+
+def test_matches_the_protobuf_encoding():
+    example_pb2 = pytest.importorskip('tensorflow.core.example.example_pb2')
+    encoder = FeatureSchema({'age': 'int64', 'score': 'float'}).compile()
+    [serialized] = encoder.encode([{'age': -1, 'score': 1.25}])
+    example = example_pb2.Example.FromString(serialized)
+    assert example.features.feature['age'].int64_list.value == [-1]
+    assert example.features.feature['score'].float_list.value == [1.25]
+
+
+def test_leaves_out_the_missing_features():
+    encoder = FeatureSchema({'a': 'int64', 'b': 'float'}).compile()
+    examples = encoder.encode([{'a': 1}, {'a': None, 'b': 2.0}, {'c': 'ignored'}])
+    assert [decode_example(example) for example in examples] == [
+        {'a': (3, [1])},
+        {'b': (2, [2.0])},
+        {},
+    ]
+
+
+@pytest.mark.parametrize('kind, value', [
+    ('float', True),
+    ('float', np.bool_(False)),
+    ('float', '1.0'),
+    ('float', [1.0]),
+    ('int64', True),
+    ('int64', 1.5),
+    ('int64', float('nan')),
+    ('int64', 2 ** 63),
+    ('int64', np.uint64(2 ** 63)),
+    ('int64', '1'),
+    ('string', 1),
+])
+def test_rejects_the_mismatching_values(kind, value):
+    encoder = FeatureSchema({'f': kind}).compile()
+    good = {'float': 2.0, 'int64': 2, 'string': 'x'}[kind]
+    with pytest.raises(ValueError) as error:
+        encoder.encode([{'f': good}, {'f': good}, {'f': value}])
+    assert str(error.value) == 'Feature "f" expects %s values, but example 2 has %r.' % (
+        {'float': 'float', 'int64': 'integer', 'string': 'string'}[kind], value)
+
+
+def test_reports_the_index_of_the_example_with_missing_features():
+    encoder = FeatureSchema({'f': 'float'}).compile()
+    with pytest.raises(ValueError, match='example 3 has True'):
+        encoder.encode([{'f': 1.0}, {}, {'f': None}, {'f': True}])
+
+
+def test_rejects_the_examples_which_are_not_dictionaries():
+    encoder = FeatureSchema({'f': 'float'}).compile()
+    with pytest.raises(ValueError):
+        encoder.encode([[1.0]])
+
+
+def test_rejects_the_unknown_types():
+    with pytest.raises(ValueError):
+        FeatureSchema({'f': 'double'})
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from scheduling import HIGH, NORMAL, Scheduler, lane
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def admission_order(scheduler, runs):
+    """
+    Queues runs behind a run holding the only slot, then releases it.
+
+    Args:
+        scheduler: A Scheduler with a single run slot.
+        runs: List of (model, lane, cost, weight) of the runs, queued in order.
+
+    Returns:
+        The list of the indices of the runs in the order they were admitted.
+    """
+    order = []
+    release = threading.Event()
+
+    def hold():
+        with scheduler.slot('holder', NORMAL, 1):
+            release.wait()
+
+    def run(index, model, run_lane, cost, weight):
+        with scheduler.slot(model, run_lane, cost, weight=weight):
+            order.append(index)
+
+    threads = [threading.Thread(target=hold)]
+    threads[0].start()
+    wait_until(lambda: scheduler.stats()['running'] == 1)
+    for index, (model, run_lane, cost, weight) in enumerate(runs):
+        thread = threading.Thread(target=run, args=(index, model, run_lane, cost, weight))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: sum(sum(state['waiting'].values())
+                               for state in scheduler.stats()['models'].values()) == index + 1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def test_lane():
+    assert lane(None) == NORMAL
+    assert lane(' High ') == HIGH
+    assert lane('low') == NORMAL
+
+
+def test_unlimited_by_default():
+    scheduler = Scheduler()
+    with scheduler.slot('a', NORMAL, 10):
+        with scheduler.slot('a', NORMAL, 10):
+            assert scheduler.stats()['running'] == 2
+
+
+def test_small_batches_are_not_stuck_behind_large_ones():
+    scheduler = Scheduler(run_slots=1)
+    # Model "large" queues its batches first, "small" ones are cheaper
+    order = admission_order(scheduler, [('large', NORMAL, 100, 1)] * 3 + [('small', NORMAL, 1, 1)] * 3)
+    assert order[:4] == [0, 3, 4, 5]
+
+
+def test_weights_share_the_slots():
+    scheduler = Scheduler(run_slots=1)
+    order = admission_order(scheduler, [('light', NORMAL, 10, 1)] * 4 + [('heavy', NORMAL, 10, 3)] * 6)
+    # The model with 3 times the weight runs 3 batches for each batch of the other one
+    assert [index >= 4 for index in order] == [False, True, True, True, False, True, True, True, False, False]
+
+
+def test_high_lane_goes_first():
+    scheduler = Scheduler(run_slots=1)
+    order = admission_order(scheduler, [('a', NORMAL, 1, 1), ('b', NORMAL, 1, 1), ('a', HIGH, 1, 1)])
+    assert order == [2, 0, 1]
+
+
+def test_high_lane_does_not_starve_the_normal_lane():
+    scheduler = Scheduler(run_slots=1, high_burst=2)
+    order = admission_order(scheduler, [('a', NORMAL, 1, 1)] * 2 + [('b', HIGH, 1, 1)] * 5)
+    assert order == [2, 3, 0, 4, 5, 1, 6]
+
+
+def test_quota_limits_the_runs_of_a_model():
+    scheduler = Scheduler()
+    entered = threading.Event()
+    release = threading.Event()
+
+    def run():
+        with scheduler.slot('a', NORMAL, 1, quota=1):
+            entered.set()
+            release.wait()
+
+    with scheduler.slot('a', NORMAL, 1, quota=1):
+        thread = threading.Thread(target=run)
+        thread.start()
+        wait_until(lambda: scheduler.stats()['models']['a']['waiting'][NORMAL] == 1)
+        assert not entered.is_set()
+    assert entered.wait(5)
+    release.set()
+    thread.join()
+    assert scheduler.stats()['models']['a']['admitted'] == {HIGH: 0, NORMAL: 2}
+
+
+@pytest.mark.parametrize('run_slots', [1, 2])
+def test_slots_are_released_on_errors(run_slots):
+    scheduler = Scheduler(run_slots=run_slots)
+    with pytest.raises(RuntimeError):
+        with scheduler.slot('a', NORMAL, 1):
+            raise RuntimeError()
+    assert scheduler.stats()['running'] == 0
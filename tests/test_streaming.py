@@ -0,0 +1,84 @@
+import io
+import json
+
+import pytest
+
+from streaming import chunks, iter_json_rows
+
+ROWS = [
+    {'a': 1, 'b': [1.5, -2e3], 'c': 'é;"quoted"'},
+    'plain@example.com',
+    12345,
+    -0.25,
+    True,
+    None,
+    [1, [2, {'d': '名前'}]],
+    {},
+]
+
+READ_SIZES = [1, 2, 3, 7, 64 * 1024]
+
+
+def parse(body, read_size):
+    return list(iter_json_rows(io.BytesIO(body.encode('utf-8')), read_size))
+
+
+@pytest.mark.parametrize('read_size', READ_SIZES)
+@pytest.mark.parametrize('separator', [',', ' , ', ',\n  '])
+def test_json_array(read_size, separator):
+    body = ' \n[' + separator.join(json.dumps(row, ensure_ascii=False) for row in ROWS) + ']\n'
+    assert parse(body, read_size) == ROWS
+
+
+@pytest.mark.parametrize('read_size', READ_SIZES)
+@pytest.mark.parametrize('newline', ['\n', '\r\n', '\n\n'])
+def test_json_lines(read_size, newline):
+    body = newline.join(json.dumps(row, ensure_ascii=False) for row in ROWS)
+    assert parse(body, read_size) == ROWS
+    assert parse(body + newline, read_size) == ROWS
+
+
+@pytest.mark.parametrize('read_size', READ_SIZES)
+def test_numbers_split_across_chunks(read_size):
+    assert parse('[123456789, 1e10,-7]', read_size) == [123456789, 1e10, -7]
+    assert parse('123456789\n1e10', read_size) == [123456789, 1e10]
+
+
+@pytest.mark.parametrize('body', ['', '  \n ', '[]', '[ \n ]'])
+def test_empty_bodies(body):
+    assert parse(body, 2) == []
+
+
+@pytest.mark.parametrize('body, message', [
+    ('[1, 2', 'not closed'),
+    ('[1, 2,', 'not closed'),
+    ('[1, 2,]', 'Unexpected ","'),
+    ('[1 2]', 'Expected ","'),
+    ('[1, {"a": }]', 'Invalid JSON row'),
+    ('{"a": 1}\n{"a": \n', 'line 2'),
+    ('{"a": 1}\n\nnot json', 'line 3'),
+])
+@pytest.mark.parametrize('read_size', [1, 64 * 1024])
+def test_invalid_bodies(body, message, read_size):
+    with pytest.raises(ValueError, match=message):
+        parse(body, read_size)
+
+
+def test_rows_are_yielded_as_they_arrive():
+    class Body(io.RawIOBase):
+        """Body whose second row never arrives."""
+        def __init__(self):
+            self.parts = [b'[{"a": 1},', b' {"b"']
+
+        def read(self, size=-1):
+            if not self.parts:
+                raise AssertionError('The second row was awaited')
+            return self.parts.pop(0)
+
+    rows = iter_json_rows(Body())
+    assert next(rows) == {'a': 1}
+
+
+def test_chunks():
+    assert list(chunks(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(chunks([], 3)) == []
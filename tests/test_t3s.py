@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from t3s import _default_predictions
+
+
+def test_single_output_is_the_default_prediction():
+    np.testing.assert_array_equal(_default_predictions({'score': np.array([[0.5], [0.25]])}), [0.5, 0.25])
+    np.testing.assert_array_equal(_default_predictions({'score': np.array([1, 0])}), [1, 0])
+
+
+@pytest.mark.parametrize('outputs', [
+    {'scores': np.zeros((2, 3))},
+    {'classes': np.array([b'a', b'b'], dtype=object)},
+    {'a': np.zeros(2), 'b': np.zeros(2)},
+])
+def test_no_default_prediction(outputs):
+    with pytest.raises(ValueError, match='has no "probabilities" output.*%s' % sorted(outputs)[-1]):
+        _default_predictions(outputs)
@@ -0,0 +1,163 @@
+import contextlib
+import os
+
+import pytest
+
+import config
+import versions as versions_module
+from versions import ModelVersions, label, list_versions
+
+
+class FakeRegistry(object):
+    """Registry recording the loaded directories, whose loads fail for the 'failing' ones."""
+
+    def __init__(self):
+        self.loaded_dirs = []
+        self.loads = []
+        self.failing = set()
+        # Directories of the models in use
+        self.used = []
+
+    def get(self, saved_model_dir, tag_set, session_config=None):
+        self.loads.append(saved_model_dir)
+        if saved_model_dir in self.failing:
+            raise RuntimeError('Could not load %s' % saved_model_dir)
+        if saved_model_dir not in self.loaded_dirs:
+            self.loaded_dirs.append(saved_model_dir)
+        return saved_model_dir
+
+    @contextlib.contextmanager
+    def use(self, saved_model_dir, tag_set, session_config=None):
+        self.used.append(saved_model_dir)
+        yield self.get(saved_model_dir, tag_set, session_config)
+        self.used.remove(saved_model_dir)
+
+    def unload(self, saved_model_dir, tag_set=None):
+        if saved_model_dir in self.loaded_dirs:
+            self.loaded_dirs.remove(saved_model_dir)
+
+    def loaded(self):
+        return [(saved_model_dir, 'serve') for saved_model_dir in self.loaded_dirs]
+
+    def refresh(self):
+        pass
+
+
+def export(models_dir, model, version=None, content=b'graph'):
+    path = os.path.join(models_dir, model) if version is None else os.path.join(models_dir, model, str(version))
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'saved_model.pb'), 'wb') as graph_file:
+        graph_file.write(content)
+    return path + '/'
+
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+    monkeypatch.setitem(config.TF_MODELS, 'dir', str(tmp_path) + '/')
+    monkeypatch.setitem(config.TF_MODELS, 'options', {})
+    return str(tmp_path)
+
+
+@pytest.fixture
+def fake_registry(monkeypatch):
+    fake = FakeRegistry()
+    warmed = []
+    monkeypatch.setattr(versions_module, 'registry', fake)
+    def warm_up(model, loaded):
+        # The model is in use while it warms up
+        assert loaded in fake.used
+        warmed.append(loaded)
+
+    monkeypatch.setattr(versions_module, 'warm_up', warm_up)
+    fake.warmed = warmed
+    return fake
+
+
+def test_list_versions(models_dir):
+    export(models_dir, 'model', 1)
+    export(models_dir, 'model', 10)
+    os.makedirs(os.path.join(models_dir, 'model', '2'))
+    os.makedirs(os.path.join(models_dir, 'model', 'variables'))
+    assert list_versions(os.path.join(models_dir, 'model')) == [1, 10]
+    assert list_versions(os.path.join(models_dir, 'missing')) == []
+
+
+def test_label():
+    assert label('model') == 'model'
+    assert label('model', 3) == 'model/versions/3'
+
+
+def test_model_dir(models_dir):
+    versions = ModelVersions()
+    export(models_dir, 'plain')
+    for version in (1, 2, 3):
+        export(models_dir, 'model', version)
+
+    assert versions.model_dir('plain') == models_dir + '/plain/'
+    with pytest.raises(ValueError, match='has no versions'):
+        versions.model_dir('plain', 1)
+
+    assert versions.model_dir('model') == models_dir + '/model/3/'
+    assert versions.model_dir('model', 2) == models_dir + '/model/2/'
+    # Only the 'versions_kept' latest versions are served
+    with pytest.raises(ValueError, match='please choose from 2, 3'):
+        versions.model_dir('model', 1)
+    assert versions.status() == {'model': {'version': 3, 'versions': [2, 3]}}
+
+
+def test_missing_models_are_not_remembered(models_dir):
+    versions = ModelVersions()
+    with pytest.raises(ValueError, match='does not exist'):
+        versions.model_dir('missing')
+    assert not versions.known('missing')
+    export(models_dir, 'missing', 1)
+    assert versions.model_dir('missing') == models_dir + '/missing/1/'
+    assert versions.known('missing')
+
+
+def test_new_versions_are_swapped_in(models_dir, fake_registry):
+    versions = ModelVersions()
+    export(models_dir, 'model', 1)
+    fake_registry.get(versions.model_dir('model'), 'serve')
+    export(models_dir, 'model', 2)
+    # The current version is kept until the new one is loaded
+    assert versions.model_dir('model') == models_dir + '/model/1/'
+
+    assert versions.refresh('model') == 2
+    assert fake_registry.warmed == [models_dir + '/model/2/']
+    assert versions.model_dir('model') == models_dir + '/model/2/'
+    assert versions.model_dir('model', 1) == models_dir + '/model/1/'
+
+    export(models_dir, 'model', 3)
+    versions.refresh_all()
+    assert versions.status() == {'model': {'version': 3, 'versions': [2, 3]}}
+    # The versions no longer served are unloaded
+    assert fake_registry.loaded_dirs == [models_dir + '/model/2/', models_dir + '/model/3/']
+
+
+def test_failed_versions_are_retried_once_changed(models_dir, fake_registry):
+    versions = ModelVersions()
+    export(models_dir, 'model', 1)
+    versions.model_dir('model')
+    broken_dir = export(models_dir, 'model', 2, b'partial')
+    fake_registry.failing.add(broken_dir)
+
+    assert versions.refresh('model') == 1
+    assert versions.refresh('model') == 1
+    assert fake_registry.loads == [broken_dir]
+    assert versions.model_dir('model') == models_dir + '/model/1/'
+    with pytest.raises(ValueError):
+        versions.model_dir('model', 2)
+
+    # The export of the version is complete
+    fake_registry.failing.clear()
+    export(models_dir, 'model', 2, b'complete graph')
+    assert versions.refresh('model') == 2
+    assert fake_registry.loads == [broken_dir, broken_dir]
+    assert versions.model_dir('model') == broken_dir
+
+
+def test_admin_prefix_is_not_a_model(models_dir):
+    export(models_dir, '_t3s')
+    with pytest.raises(ValueError, match='reserved'):
+        ModelVersions().model_dir('_t3s')
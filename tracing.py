@@ -0,0 +1,185 @@
+"""
+T3S sampled tracing of the model runs.
+
+A fraction 'trace_rate' of the runs of a model is traced with TensorFlow's
+FULL_TRACE RunOptions, which records the start and duration of every op of the
+graph in the RunMetadata of the run. Tracing slows the traced runs down, so the
+rate should stay low in production.
+
+The op times of the last 'window' traced runs of each model are summed up into
+a hotspot table of the ops taking the most time, and the step stats of the
+last 'timelines' traced runs are kept to be downloaded as Chrome traces, which
+can be opened in chrome://tracing.
+"""
+
+import collections
+import random
+import threading
+import time
+
+import config
+
+# Devices whose stats repeat the ones of the other streams of a GPU
+_DUPLICATE_DEVICES = ('/stream:all',)
+
+
+class _ModelTraces(object):
+    """Last traced runs of a model."""
+
+    def __init__(self, window, timelines):
+        # Time in microseconds and op type of each node, for each traced run
+        self.op_times = collections.deque(maxlen=window)
+        # Time and step stats of each traced run, the latest last
+        self.step_stats = collections.deque(maxlen=timelines)
+        self.traced = 0
+
+
+class Tracer(object):
+    """Samples the model runs to trace, and aggregates their traces."""
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def start(self, model):
+        """
+        Decides whether to trace a run of a model.
+
+        Args:
+            model: Name of the model.
+
+        Returns:
+            The RunOptions and RunMetadata to pass to session.run() if the run is
+            traced, else (None, None).
+        """
+        rate = config.get_model_option(model, 'trace_rate')
+        if not rate or random.random() >= rate:
+            return None, None
+
+        from tensorflow.core.protobuf import config_pb2
+
+        return (config_pb2.RunOptions(trace_level=config_pb2.RunOptions.FULL_TRACE),
+                config_pb2.RunMetadata())
+
+    def record(self, model, run_metadata):
+        """
+        Aggregates the trace of a run.
+
+        Args:
+            model: Name of the model.
+            run_metadata: The RunMetadata filled by the traced run.
+        """
+        op_times = {}
+        for device_stats in run_metadata.step_stats.dev_stats:
+            if device_stats.device.endswith(_DUPLICATE_DEVICES):
+                continue
+            for node_stats in device_stats.node_stats:
+                micros, op = op_times.get(node_stats.node_name, (0, None))
+                op_times[node_stats.node_name] = (micros + node_stats.all_end_rel_micros,
+                                                  op or _op_type(node_stats))
+
+        with self._lock:
+            traces = self._models.get(model)
+            if traces is None:
+                traces = self._models[model] = _ModelTraces(
+                    config.TRACING['window'], config.TRACING['timelines'])
+            traces.op_times.append(op_times)
+            traces.step_stats.append((time.time(), run_metadata.step_stats))
+            traces.traced += 1
+
+    def hotspots(self, model, count=None):
+        """
+        Gets the ops of a model taking the most time in its last traced runs.
+
+        Args:
+            model: Name of the model.
+            count: Maximum number of ops, TRACING['hotspots'] when None.
+
+        Returns:
+            A dictionary with the number of traced runs, the number of runs in
+            the window, and the list of the ops sorted by decreasing total time,
+            with their node name, op type, total and mean time per run in
+            milliseconds, and share of the time of all the ops.
+        """
+        with self._lock:
+            traces = self._models.get(model)
+            if traces is None:
+                return {'traced': 0, 'runs': 0, 'ops': []}
+            runs = list(traces.op_times)
+            traced = traces.traced
+
+        totals = collections.Counter()
+        ops = {}
+        for op_times in runs:
+            for node_name, (micros, op) in op_times.items():
+                totals[node_name] += micros
+                ops[node_name] = op
+        total = float(sum(totals.values())) or 1.0
+        return {
+            'traced': traced,
+            'runs': len(runs),
+            'ops': [
+                {
+                    'node': node_name,
+                    'op': ops[node_name],
+                    'total_ms': micros / 1e3,
+                    'mean_ms': micros / 1e3 / len(runs),
+                    'share': micros / total,
+                }
+                for node_name, micros in totals.most_common(count or config.TRACING['hotspots'])
+            ],
+        }
+
+    def timelines(self, model):
+        """Returns the times of the traced runs of a model kept for their Chrome trace, the latest first."""
+        with self._lock:
+            traces = self._models.get(model)
+            return [] if traces is None else [traced_at for traced_at, _ in reversed(traces.step_stats)]
+
+    def chrome_trace(self, model, index=0):
+        """
+        Gets the Chrome trace of a traced run of a model.
+
+        Args:
+            model: Name of the model.
+            index: Index of the run, from 0 for the latest one.
+
+        Returns:
+            The Chrome trace, as a JSON string.
+
+        Raises:
+            ValueError: When the model has no such traced run.
+        """
+        with self._lock:
+            traces = self._models.get(model)
+            kept = [] if traces is None else list(traces.step_stats)
+        if not 0 <= index < len(kept):
+            raise ValueError('Model "%s" has %d traced runs kept, %d is not one of them.' % (model, len(kept), index))
+
+        from tensorflow.python.client import timeline
+
+        return timeline.Timeline(kept[-1 - index][1]).generate_chrome_trace_format()
+
+    def status(self):
+        """Returns the trace rate, number of traced runs and of kept timelines of each model."""
+        with self._lock:
+            return {
+                model: {
+                    'trace_rate': config.get_model_option(model, 'trace_rate'),
+                    'traced': traces.traced,
+                    'timelines': len(traces.step_stats),
+                }
+                for model, traces in self._models.items()
+            }
+
+
+def _op_type(node_stats):
+    # The timeline label reads "node_name = OpType(inputs)"
+    label = node_stats.timeline_label
+    if ' = ' in label:
+        return label.split(' = ', 1)[1].split('(', 1)[0]
+    return node_stats.node_name
+
+
+# Tracer of the whole server
+tracer = Tracer()
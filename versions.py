@@ -0,0 +1,225 @@
+"""
+T3S model versions.
+
+A model folder either directly holds a SavedModel, or holds successive versions
+of the model in numeric subfolders, e.g. `<model>/1/` and `<model>/2/`. Requests
+are served by the current version of the model, which is the latest one when
+it is first asked for, unless they pin another served version. The
+'versions_kept' most recent versions up to the current one are served.
+
+A watcher thread polls the folders of the models in use every
+TF_MODELS['watch_interval'] seconds. When a new version appears, it is loaded
+and warmed up in the background while the current version keeps serving, then
+swapped in at once. The versions no longer served are unloaded, their sessions
+being closed once the requests still running them are drained. Models without
+versions are reloaded when their folder changes on disk.
+"""
+
+import logging
+import os
+import threading
+
+import config
+from registry import directory_fingerprint, registry
+from warmup import warm_up
+
+# Files marking a folder as a SavedModel
+SAVED_MODEL_FILES = ('saved_model.pb', 'saved_model.pbtxt')
+
+# First segment of the addresses of the server itself, e.g. /_t3s/metrics, which
+# cannot be the name of a model
+ADMIN_PREFIX = '_t3s'
+
+_logger = logging.getLogger(__name__)
+
+
+def list_versions(model_dir):
+    """
+    Lists the versions of a model on disk.
+
+    Args:
+        model_dir: Folder of the model.
+
+    Returns:
+        The sorted numbers of the subfolders holding a SavedModel.
+    """
+    if not os.path.isdir(model_dir):
+        return []
+    found = []
+    for entry in os.scandir(model_dir):
+        if entry.is_dir() and entry.name.isdigit() and any(
+                os.path.isfile(os.path.join(entry.path, name)) for name in SAVED_MODEL_FILES):
+            found.append(int(entry.name))
+    return sorted(found)
+
+
+def label(model, version=None):
+    """Returns the name under which the requests pinning a version are accounted."""
+    if version is None:
+        return model
+    return '%s/versions/%d' % (model, version)
+
+
+class ModelVersions(object):
+    """Thread-safe table of the served versions of each model."""
+
+    def __init__(self):
+        # Maps model names to their current version, or None if they have no
+        # versions, and to the tuple of their served versions
+        self._served = {}
+        # Maps the (model, version) that could not be loaded to the fingerprint
+        # of their folder, so that they are only retried once it changes, e.g.
+        # when they were still being copied
+        self._failed = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    @staticmethod
+    def _base_dir(model):
+        return config.TF_MODELS['dir'] + model + '/'
+
+    def model_dir(self, model, version=None):
+        """
+        Resolves the SavedModel folder serving a model.
+
+        Args:
+            model: Name of the model.
+            version: Number of the version to use, or None for the current one.
+
+        Returns:
+            The folder of the version, or of the model if it has no versions.
+
+        Raises:
+            ValueError: When the model does not exist, or the version is not
+                served.
+        """
+        served = self._served.get(model)
+        if served is None:
+            if model == ADMIN_PREFIX:
+                raise ValueError('"%s" is reserved for the addresses of the server, '
+                                 'please rename the model.' % model)
+            # Missing models are not remembered, so that requests to any name
+            # do not fill the table up
+            if not os.path.isdir(self._base_dir(model)):
+                raise ValueError('Model "%s" does not exist.' % model)
+            with self._lock:
+                served = self._served.get(model)
+                if served is None:
+                    found = list_versions(self._base_dir(model))
+                    kept = config.get_model_option(model, 'versions_kept')
+                    served = (found[-1] if found else None, tuple(found[-kept:]))
+                    self._served[model] = served
+
+        current, served_versions = served
+        if current is None:
+            if version is not None:
+                raise ValueError('Model "%s" has no versions.' % model)
+            return self._base_dir(model)
+        if version is None:
+            version = current
+        elif version not in served_versions:
+            raise ValueError(
+                'Version %d of model "%s" is not served, please choose from %s.' %
+                (version, model, ', '.join(str(served) for served in served_versions)))
+        return self._base_dir(model) + str(version) + '/'
+
+    def known(self, model):
+        """Tells whether a model was found by model_dir()."""
+        return model in self._served
+
+    def refresh(self, model):
+        """
+        Swaps in the latest version of a model once loaded and warmed up, then
+        unloads the versions no longer served.
+
+        Args:
+            model: Name of the model.
+
+        Returns:
+            The current version of the model, or None if it has no versions.
+        """
+        base_dir = self._base_dir(model)
+        found = list_versions(base_dir)
+        if not found:
+            return None
+
+        with self._refresh_lock:
+            current = self._served.get(model, (None, ()))[0]
+            latest = found[-1]
+            latest_dir = base_dir + str(latest) + '/'
+            fingerprint = directory_fingerprint(latest_dir)
+            if latest != current and self._failed.get((model, latest)) != fingerprint:
+                # The current version serves the requests in the meantime
+                try:
+                    with registry.use(latest_dir, "serve",
+                                      config.get_model_option(model, 'session_config')) as loaded:
+                        warm_up(model, loaded)
+                    _logger.info('Serving version %d of model "%s".', latest, model)
+                    self._failed.pop((model, latest), None)
+                except Exception:
+                    _logger.exception('Could not load version %d of model "%s".', latest, model)
+                    self._failed[(model, latest)] = fingerprint
+                    registry.unload(latest_dir)
+            if self._failed.get((model, latest)) == fingerprint and current is not None:
+                latest = current
+
+            kept = config.get_model_option(model, 'versions_kept')
+            served_versions = tuple(version for version in found if version <= latest)[-kept:]
+            with self._lock:
+                self._served[model] = (latest, served_versions)
+
+            for saved_model_dir, tag_set in registry.loaded():
+                parent, name = os.path.split(os.path.normpath(saved_model_dir))
+                if parent == os.path.normpath(base_dir) and name.isdigit() and \
+                        int(name) not in served_versions:
+                    registry.unload(saved_model_dir, tag_set)
+        return latest
+
+    def refresh_all(self):
+        """Refreshes the versions of all the models in use, and reloads the changed models without versions."""
+        with self._lock:
+            models = list(self._served)
+        for model in models:
+            self.refresh(model)
+        registry.refresh()
+
+    def start(self, interval):
+        """
+        Starts watching the models folders.
+
+        Args:
+            interval: Time in seconds between two polls of the folders.
+        """
+        if self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name='t3s-versions')
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.refresh_all()
+            except Exception:
+                _logger.exception('Could not refresh the models versions.')
+
+    def status(self):
+        """Returns the current and served versions of each model with versions."""
+        with self._lock:
+            return {
+                model: {'version': current, 'versions': list(served_versions)}
+                for model, (current, served_versions) in self._served.items()
+                if current is not None
+            }
+
+    def close(self):
+        """Stops watching the models folders."""
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+
+# Versions table shared by the whole server
+versions = ModelVersions()
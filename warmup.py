@@ -0,0 +1,83 @@
+"""
+T3S models warm-up.
+
+The first runs of a fresh session are much slower than the following ones,
+while TensorFlow allocates its buffers and picks its kernels. Warming a model up
+runs a synthetic batch of 'warmup_batch_size' examples through its 'predict'
+signature before it serves any request.
+"""
+
+import numpy as np
+
+import config
+from features import FLOAT, INT64, FeatureSchema
+
+# Values of the features of the synthetic examples, by feature type
+_WARMUP_VALUES = {
+    FLOAT: 0.0,
+    INT64: 0,
+}
+
+
+def warmup_inputs(model, plan, batch_size):
+    """
+    Builds a synthetic batch for the inputs of a signature.
+
+    Serialized examples inputs get examples with every feature of the model
+    schema set to a default value, when the schema is known, and empty examples
+    otherwise. Dense inputs get zeros, their unknown dimensions being the batch
+    size.
+
+    Args:
+        model: Name of the model.
+        plan: The SignaturePlan to feed.
+        batch_size: Number of synthetic examples.
+
+    Returns:
+        A dictionary that maps input keys to numpy ndarrays or lists.
+    """
+    inputs = {}
+    for key, dtype in plan.input_dtypes.items():
+        encoder = plan.encoders.get(key)
+        declared = config.get_model_option(model, 'features')
+        if key == 'examples' and declared is not None:
+            encoder = FeatureSchema(declared).compile()
+        if encoder is not None:
+            example = {
+                name: _WARMUP_VALUES.get(kind, '')
+                for name, kind in encoder.schema.features.items()
+            }
+            inputs[key] = encoder.encode([example] * batch_size)
+            continue
+
+        shape = plan.input_shapes[key]
+        if shape.ndims is None:
+            dims = [batch_size]
+        else:
+            dims = [batch_size if dim is None else dim for dim in shape.as_list()]
+        if dtype.name == 'string':
+            inputs[key] = np.full(dims, b'', dtype=object)
+        else:
+            inputs[key] = np.zeros(dims, dtype=dtype.as_numpy_dtype)
+    return inputs
+
+
+def warm_up(model, loaded):
+    """
+    Runs a synthetic batch through the 'predict' signature of a loaded model.
+
+    The outputs are neither archived nor cached.
+
+    Args:
+        model: Name of the model.
+        loaded: The LoadedModel to warm up, acquired by the caller so that its
+            session stays open, see registry.use().
+
+    Raises:
+        ValueError: When the model has no 'predict' signature.
+    """
+    plan = loaded.plan("predict")
+    batch_size = config.get_model_option(model, 'warmup_batch_size')
+    if batch_size:
+        feed_dict = plan.feed_dict(warmup_inputs(model, plan, batch_size))
+        loaded.session.run(plan.fetch_names, feed_dict=feed_dict)